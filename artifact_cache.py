@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import pickle
+import shutil
+import hashlib
+import numpy as np
+
+# file digests already computed in this process, keyed by path, size and
+# modification time so unchanged files are only hashed once
+_DIGESTS = {}
+
+
+def file_digest(path, chunk=1 << 22):
+    '''
+    Returns the sha256 hex digest of a file contents.
+    '''
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    memo = (path, stat.st_size, stat.st_mtime_ns)
+    if memo not in _DIGESTS:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(chunk), b''):
+                h.update(block)
+        _DIGESTS[memo] = h.hexdigest()
+    return _DIGESTS[memo]
+
+
+def input_digest(src):
+    '''
+    Returns a digest of a raster or table input. Files are hashed by content,
+    numpy arrays, (array, geotransform) tuples and gdal datasets by their
+    values and geotransform.
+    '''
+    if isinstance(src, str):
+        return file_digest(src)
+    if isinstance(src, np.ndarray):
+        h = hashlib.sha256(str((src.dtype, src.shape)).encode())
+        h.update(np.ascontiguousarray(src).tobytes())
+        return h.hexdigest()
+    if isinstance(src, (tuple, list)):
+        return hashlib.sha256(
+            ''.join(input_digest(s) if isinstance(s, np.ndarray) else repr(s)
+                    for s in src).encode()
+        ).hexdigest()
+    # gdal.Dataset, imported lazily so the cache has no GDAL dependency
+    from raster_io import read_raster
+    array, geotransform, nodata = read_raster(src)
+    return input_digest((array, geotransform, nodata))
+
+
+class ArtifactCache(object):
+    '''
+    Content addressed cache of intermediate products of the parameter builds.
+    Artifacts are keyed on the digests of their inputs plus the arguments
+    used to create them, and the least recently used ones are evicted once
+    the cache grows over max_bytes.
+    Parameters
+    ----------
+    root : str (optional)
+        cache folder, defaults to $VIC_SCRIPTS_CACHE or ~/.cache/vic-scripts
+    max_bytes: int (optional)
+        maximum size of the cache folder in bytes
+    '''
+    def __init__(self, root=None, max_bytes=4 * 1024**3):
+        if root is None:
+            root = os.environ.get(
+                'VIC_SCRIPTS_CACHE',
+                os.path.join(os.path.expanduser('~'), '.cache', 'vic-scripts')
+            )
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+
+    def key(self, name, inputs=(), **kwargs):
+        '''
+        Returns the key of an artifact named name, created from the inputs
+        (paths, arrays or datasets) and keyword arguments.
+        '''
+        h = hashlib.sha256(name.encode())
+        for src in inputs:
+            h.update(input_digest(src).encode())
+        h.update(json.dumps(kwargs, sort_keys=True, default=repr).encode())
+        return '{0}-{1}'.format(name, h.hexdigest()[:32])
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def _touch(self, path):
+        # another process sharing the folder may have just evicted it
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except FileNotFoundError:
+            pass
+
+    def get(self, key, default=None):
+        '''
+        Returns the object stored at key, or default if it isn't cached.
+        '''
+        path = self.path(key) + '.pkl'
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return default
+        self._touch(path)
+        return value
+
+    def put(self, key, value):
+        '''
+        Stores a picklable object at key.
+        '''
+        path = self.path(key) + '.pkl'
+        tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        self.evict()
+        return value
+
+    def get_file(self, key, dst):
+        '''
+        Copies the file stored at key to dst. Returns False if it isn't cached.
+        '''
+        path = self.path(key)
+        try:
+            shutil.copyfile(path, dst)
+        except FileNotFoundError:
+            return False
+        self._touch(path)
+        return True
+
+    def put_file(self, key, src):
+        '''
+        Stores a copy of the file src at key.
+        '''
+        path = self.path(key)
+        tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, path)
+        self.evict()
+
+    def cached(self, key, func, *args, **kwargs):
+        '''
+        Returns the object stored at key, calling func(*args, **kwargs) and
+        storing its result if it isn't cached.
+        '''
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, func(*args, **kwargs))
+        return value
+
+    def evict(self):
+        '''
+        Removes the least recently used artifacts until the cache is smaller
+        than max_bytes. Stages running in parallel processes share the
+        folder, so files removed by another process meanwhile are skipped.
+        '''
+        entries = []
+        for name in os.listdir(self.root):
+            if name.endswith('.tmp'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.root, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(e[1] for e in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.root, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.root):
+            os.remove(os.path.join(self.root, name))
@@ -1,9 +1,11 @@
 import numpy as np
 from osgeo import gdal, osr
 from netCDF4 import Dataset 
-from datetime import datetime, timedelta 
+from datetime import timedelta 
 import os
 from tqdm import tqdm
+from raster_io import create_raster, build_overviews
+from instrument import instrumented, phase, count, count_output
 
 def get_array(filename, geotrans=False):
     '''
@@ -11,7 +13,9 @@ def get_array(filename, geotrans=False):
     returns the geotransform for the array.
     '''
     ncdf_ds = Dataset(filename)
+    count('files_opened')
     array = ncdf_ds.variables['Precipitation_Flux'][0]
+    count('bytes_read', array.nbytes)
     out = array
     # Get geotransform
     if geotrans:
@@ -32,7 +36,9 @@ def get_array(filename, geotrans=False):
     ncdf_ds.close()
     return out
 
-def aggregate_rasters(prefix, start, end, dst, statistic='mean'):
+@instrumented('climatology')
+def aggregate_rasters(prefix, start, end, dst, statistic='mean', profile=None,
+                      overviews=None):
     '''
     Aggregates a series of netcdf datasets into a single raster. The files are
     named following a {prefix}{YYYYmmdd}.nc structure. It assumes that all the 
@@ -47,41 +53,44 @@ def aggregate_rasters(prefix, start, end, dst, statistic='mean'):
         path to the output tif, including filename and tif extension
     statistic: str
         sum, mean
+    profile: str or list (optional)
+        GeoTIFF output profile, see raster_io.PROFILES
+    overviews: list or bool (optional)
+        overview decimation factors to build in the output
     '''
     dates = [
         start + timedelta(days=i) 
         for i in range((end - start).days + 1)
     ]
-    array = get_array(f'{prefix}{dates[0].strftime("%Y%m%d")}.nc')
-    
-    for date in tqdm(dates[1:]):
-        filename = f'{prefix}{date.strftime("%Y%m%d")}.nc'
-        array += get_array(filename)
+    with phase('read'):
+        array = get_array(f'{prefix}{dates[0].strftime("%Y%m%d")}.nc')
+
+        for date in tqdm(dates[1:]):
+            filename = f'{prefix}{date.strftime("%Y%m%d")}.nc'
+            array += get_array(filename)
     if statistic == 'mean':
         array = array / ((end - start).days + 1)
     array = array * 365 # Yearly average
     array = array.data 
     height, width = array.shape
     _, geotransform = get_array(filename, geotrans=True)
-    dst = gdal.GetDriverByName('GTiff').Create(
-        dst, width, height, 1, gdal.GDT_Float32
-    )
-    dst.SetGeoTransform(geotransform)
-    srs = osr.SpatialReference()
-    srs.ImportFromEPSG(4326)
-    dst.SetProjection(srs.ExportToWkt())
-    band = dst.GetRasterBand(1)
-    band.WriteArray(array)
-    band.SetNoDataValue(-9999.)
-    dst.FlushCache() 
+    count('cells', array.size)
+    path = dst
+    with phase('write'):
+        dst = create_raster(dst, width, height, gdal.GDT_Float32, profile)
+        dst.SetGeoTransform(geotransform)
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(4326)
+        dst.SetProjection(srs.ExportToWkt())
+        band = dst.GetRasterBand(1)
+        band.WriteArray(array)
+        band.SetNoDataValue(-9999.)
+        build_overviews(dst, overviews, 'average')
+        dst.FlushCache()
+        dst = None
+    count_output(path)
 
 if __name__ == '__main__':
-    PREFIX = '/home/diego/vic-southeastern-us/data/input/weather/precipitation_flux-total-'
-    START_DATE = datetime(2010, 1, 1)
-    END_DATE = datetime(2021, 12, 31)
-    aggregate_rasters(
-        PREFIX, START_DATE, END_DATE,
-        '/home/diego/vic-southeastern-us/data/input/gis/precip.tif', 
-        statistic='mean'
-    )
-
+    import sys
+    from cli import main
+    main(['climatology'] + sys.argv[1:])
@@ -0,0 +1,238 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import resource
+import tempfile
+import multiprocessing
+from datetime import datetime
+
+from pipeline import build_stages, dependencies, _topological_order, _run_stage
+
+# synthetic domain sizes (rows, cols) benchmarked by default
+SIZES = [(20, 30), (40, 60), (80, 120)]
+
+
+def _timed_stage(stage, conn):
+    '''
+    Runs a stage and sends its wall time and peak resident set size back
+    through conn. It runs in a fresh (spawned) process so the memory of one
+    stage doesn't count towards the next one.
+    '''
+    try:
+        t0 = time.perf_counter()
+        _run_stage(stage)
+        wall = time.perf_counter() - t0
+        # ru_maxrss is in kilobytes on Linux. format_meteo_forcing forks a
+        # process per pixel, so the largest child is counted too
+        rss = max(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        )
+        conn.send((wall, rss / 1024., None))
+    except Exception as e:
+        conn.send((None, None, '{0}: {1}'.format(type(e).__name__, e)))
+    conn.close()
+
+
+def time_stage(stage, repeat=1):
+    '''
+    Runs a stage repeat times in a new process each time. Returns the fastest
+    wall time in seconds and the largest peak RSS in MiB.
+    '''
+    ctx = multiprocessing.get_context('spawn')
+    walls, rss = [], []
+    for _ in range(repeat):
+        parent, child = ctx.Pipe(duplex=False)
+        p = ctx.Process(target=_timed_stage, args=(stage, child))
+        p.start()
+        child.close()
+        wall, peak, error = parent.recv()
+        p.join()
+        if error is not None:
+            raise RuntimeError('Stage {0} failed: {1}'.format(stage.name, error))
+        walls.append(wall)
+        rss.append(peak)
+    return min(walls), max(rss)
+
+
+def active_cells(mask):
+    '''
+    Returns the number of cells and of active cells of a template grid.
+    '''
+    from raster_io import read_raster
+    array = read_raster(mask)[0]
+    return int(array.size), int((array == 1).sum())
+
+
+def benchmark_domain(folder, rows, cols, ratio=10, days=365, seed=0, repeat=1,
+                     only=None):
+    '''
+    Creates a synthetic domain and times each of its build stages in
+    dependency order.
+    Parameters
+    ----------
+    folder : str
+        folder for the synthetic inputs and outputs
+    rows, cols: int
+        template grid size
+    ratio: int
+        hi res pixels per template pixel side
+    days: int
+        number of days of forcings
+    seed: int
+        random seed of the synthetic inputs
+    repeat: int
+        number of runs of each stage, the fastest one is reported
+    only: list (optional)
+        names of the stages to time. The others still run (once) when a timed
+        stage depends on them
+    Returns
+    -------
+    dict with the domain size and a record per stage with its wall time
+    (wall_s), peak RSS (peak_rss_mb) and active cells processed per second
+    '''
+    from synthetic_domain import make_synthetic_domain
+
+    t0 = time.perf_counter()
+    config = make_synthetic_domain(folder, rows, cols, ratio, days, seed=seed)
+    setup = time.perf_counter() - t0
+
+    stages = {s.name: s for s in build_stages(config)}
+    order = _topological_order(dependencies(list(stages.values())))
+    timings = []
+    for name in order:
+        timed = only is None or name in only
+        wall, rss = time_stage(stages[name], repeat if timed else 1)
+        if timed:
+            timings.append((name, wall, rss))
+
+    # throughput is given in active cells for every stage so the numbers are
+    # comparable across stages and domain sizes
+    cells, active = active_cells(os.path.join(folder, config['mask']))
+    records = []
+    for name, wall, rss in timings:
+        records.append({
+            'stage': name,
+            'wall_s': round(wall, 4),
+            'peak_rss_mb': round(rss, 1),
+            'cells_per_s': round(active / wall, 1) if wall > 0 else None,
+        })
+        print('{0:<28}{1:>10.3f} s{2:>10.1f} MiB{3:>14.1f} cells/s'.format(
+            name, wall, rss, records[-1]['cells_per_s'] or 0))
+    return {
+        'rows': rows, 'cols': cols, 'ratio': ratio, 'days': days,
+        'cells': cells, 'active_cells': active,
+        'setup_s': round(setup, 2), 'stages': records,
+    }
+
+
+def compare_reports(baseline, report, tolerance=1.2):
+    '''
+    Compares the stage wall times of a report against a baseline report.
+    Returns a list of (domain, stage, baseline_s, wall_s) for the stages that
+    got slower than tolerance times the baseline.
+    '''
+    old = {}
+    for dom in baseline['domains']:
+        for rec in dom['stages']:
+            old[(dom['rows'], dom['cols'], rec['stage'])] = rec['wall_s']
+    slower = []
+    for dom in report['domains']:
+        for rec in dom['stages']:
+            key = (dom['rows'], dom['cols'], rec['stage'])
+            if key in old and rec['wall_s'] > tolerance * old[key]:
+                slower.append((
+                    '{0}x{1}'.format(*key[:2]), key[2], old[key], rec['wall_s']
+                ))
+    return slower
+
+
+def run_benchmark(sizes=SIZES, ratio=10, days=365, seed=0, repeat=1,
+                  only=None, workdir=None, keep=False):
+    '''
+    Benchmarks the build stages on synthetic domains of several sizes.
+    Parameters
+    ----------
+    sizes : list
+        (rows, cols) of each synthetic domain
+    workdir: str (optional)
+        folder for the synthetic domains, a temporary folder by default
+    keep: bool
+        keep the synthetic domains after the run
+    See benchmark_domain for the other arguments.
+    Returns
+    -------
+    dict with the benchmark report
+    '''
+    import numpy as np
+    from osgeo import gdal
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix='vic-bench-')
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'host': platform.node(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'gdal': gdal.__version__,
+        'cpus': os.cpu_count(),
+        'repeat': repeat,
+        'domains': [],
+    }
+    try:
+        for rows, cols in sizes:
+            print('Domain {0}x{1}'.format(rows, cols))
+            folder = os.path.join(workdir, '{0}x{1}'.format(rows, cols))
+            report['domains'].append(benchmark_domain(
+                folder, rows, cols, ratio, days, seed, repeat, only
+            ))
+    finally:
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Benchmark the VIC parameter builds on synthetic domains'
+    )
+    parser.add_argument('--sizes', nargs='+', default=None,
+                        help='domain sizes as ROWSxCOLS, e.g. 40x60')
+    parser.add_argument('--ratio', type=int, default=10)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--only', nargs='+', help='stages to time')
+    parser.add_argument('--workdir', help='folder for the synthetic domains')
+    parser.add_argument('--keep', action='store_true',
+                        help='keep the synthetic domains')
+    parser.add_argument('--output', default='benchmark.json',
+                        help='JSON report file')
+    parser.add_argument('--baseline', help='JSON report to compare against')
+    parser.add_argument('--tolerance', type=float, default=1.2,
+                        help='slowdown ratio reported as a regression')
+    args = parser.parse_args()
+
+    sizes = SIZES
+    if args.sizes:
+        sizes = [tuple(int(v) for v in s.lower().split('x')) for s in args.sizes]
+    report = run_benchmark(
+        sizes, args.ratio, args.days, args.seed, args.repeat, args.only,
+        args.workdir, args.keep
+    )
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        slower = compare_reports(baseline, report, args.tolerance)
+        for domain, stage, old, new in slower:
+            print('Regression {0} {1}: {2:.3f} s -> {3:.3f} s'.format(
+                domain, stage, old, new))
+        if slower:
+            sys.exit(1)
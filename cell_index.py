@@ -0,0 +1,71 @@
+import numpy as np
+
+
+def cell_coordinates(gt, shape):
+    '''
+    Returns the latitude of each row and longitude of each column of a grid.
+    The values are computed with the same operations the formatters always
+    used, gt[3] - gt[5]/2 + i*gt[5] and gt[0] + gt[1]/2 + j*gt[1], so the
+    coordinates written to the parameter files don't change.
+    Parameters
+    ----------
+    gt : tuple
+        grid geotransform
+    shape: tuple
+        (rows, cols) of the grid
+    '''
+    lats = gt[3]-gt[5]/2 + np.arange(shape[0])*gt[5]
+    lons = gt[0]+gt[1]/2 + np.arange(shape[1])*gt[1]
+    return lats, lons
+
+
+def cell_table(mask, gt, active=None, window=None, grid_shape=None):
+    '''
+    Builds the table of the active cells of a template grid, shared by all
+    the formatters so every parameter file uses the same cell ids and
+    coordinates.
+    Parameters
+    ----------
+    mask : numpy.ndarray
+        template grid array
+    gt: tuple
+        template grid geotransform
+    active: numpy.ndarray (optional)
+        boolean array with the cells to include, mask == 1 by default
+    window: tuple (optional)
+        (row_off, col_off, nrows, ncols) of the mask in the whole grid, when
+        mask is a tile of it. gt is still the geotransform of the whole grid
+    grid_shape: tuple (optional)
+        (rows, cols) of the whole grid, mask.shape by default
+    Returns
+    -------
+    dict with the row ('row'), column ('col'), grid cell id ('cellid'),
+    latitude ('lat') and longitude ('lon') arrays of the active cells in row
+    major order, and the grid 'shape'. Rows and columns index the mask, cell
+    ids are the row major position of the cell in the whole grid plus one, so
+    they depend neither on the mask nor on the tile.
+    '''
+    if active is None:
+        active = mask == 1
+    if grid_shape is None:
+        grid_shape = mask.shape
+    row_off, col_off = (0, 0) if window is None else window[:2]
+    rows, cols = np.nonzero(active)
+    lats, lons = cell_coordinates(gt, grid_shape)
+    grows = rows.astype(np.int64) + row_off
+    gcols = cols.astype(np.int64) + col_off
+    return {
+        'row': rows.astype(np.int64),
+        'col': cols.astype(np.int64),
+        'cellid': grows*grid_shape[1] + gcols + 1,
+        'lat': lats[grows],
+        'lon': lons[gcols],
+        'shape': tuple(grid_shape),
+    }
+
+
+def select_cells(cells, keep):
+    '''
+    Returns the cells of a cell table where keep is True.
+    '''
+    return {k: v if k == 'shape' else v[keep] for k, v in cells.items()}
@@ -0,0 +1,237 @@
+import os
+import sys
+import time
+import argparse
+import importlib
+from datetime import datetime
+
+# Subcommands of vic-scripts: module and function run, and the heavy packages
+# the module imports. Nothing of a subcommand is imported until it runs, so
+# the command line starts fast and a step only pays for its own dependencies
+COMMANDS = {
+    'grid': ('create_base_grid', 'create_grid', ('numpy', 'osgeo.gdal')),
+    'snap': ('snap_grid', 'snap_raster', ('numpy', 'osgeo.gdal')),
+    'soil': ('format_soil_params', 'format_soil_params', ('numpy', 'osgeo.gdal')),
+    'snow': ('format_snow_parameters', 'format_snow_params',
+             ('numpy', 'osgeo.gdal', 'numba')),
+    'veg': ('format_veg_params', 'format_veg_params',
+            ('numpy', 'osgeo.gdal', 'numba')),
+    'veglib': ('make_veg_lib', 'make_veg_lib',
+               ('numpy', 'osgeo.gdal', 'scipy.ndimage')),
+    'forcing': ('format_meteo_forcing', 'format_meteo_forcing',
+                ('numpy', 'osgeo.gdal', 'netCDF4', 'tqdm')),
+    'download': ('download_era5', 'download_period', ('cdsapi',)),
+    'climatology': ('avg_annual', 'aggregate_rasters',
+                    ('numpy', 'osgeo.gdal', 'netCDF4', 'tqdm')),
+}
+
+
+def _date(text):
+    return datetime.strptime(text, '%Y-%m-%d')
+
+
+def _path(text):
+    # the formatters resolve relative paths against their own folder, so
+    # paths given in the command line are made absolute first
+    return os.path.abspath(text)
+
+
+def _add_output_options(parser):
+    parser.add_argument('--profile', help='GeoTIFF output profile, see README')
+    parser.add_argument('--overviews', type=int, nargs='+', metavar='FACTOR',
+                        help='overview factors built into the output')
+
+
+def _add_cache_option(parser):
+    parser.add_argument('--cache', type=_path, metavar='FOLDER',
+                        help='artifact cache folder, see artifact_cache.py')
+
+
+def build_parser():
+    '''
+    Returns the argument parser of the vic-scripts command line.
+    '''
+    parser = argparse.ArgumentParser(
+        prog='vic-scripts', description='Create the input files of a VIC model domain'
+    )
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='report the import time of the command modules')
+    sub = parser.add_subparsers(dest='command', metavar='command')
+    sub.required = True
+
+    p = sub.add_parser('grid', help='template grid from a basin shapefile')
+    p.add_argument('shapefile', type=_path)
+    p.add_argument('output', type=_path)
+    p.add_argument('size', type=float, help='cell size in degrees')
+    _add_output_options(p)
+
+    p = sub.add_parser('snap', help='snap a raster to the template grid')
+    p.add_argument('input', type=_path)
+    p.add_argument('output', type=_path)
+    p.add_argument('template', type=_path)
+    p.add_argument('resample', help='nearest, bilinear, mean, mode, ...')
+    p.add_argument('--sub-grid', action='store_true',
+                   help='keep the input resolution inside the template extent')
+    _add_output_options(p)
+    _add_cache_option(p)
+
+    p = sub.add_parser('soil', help='soil parameter file')
+    for name in ('mask', 'hwsd', 'elevation', 'annual_precip', 'slope', 'output'):
+        p.add_argument(name, type=_path)
+    for name in ('b_val', 'Ws_val', 'Ds_val', 's2', 's3'):
+        p.add_argument('--' + name, type=float)
+    _add_cache_option(p)
+
+    p = sub.add_parser('snow', help='snow band parameter file')
+    p.add_argument('mask', type=_path)
+    p.add_argument('elevation', type=_path, help='hi res elevation raster')
+    p.add_argument('output', type=_path)
+    p.add_argument('interval', type=int, help='elevation band interval')
+    p.add_argument('--precip', type=_path,
+                   help='precipitation climatology weighting the bands')
+    _add_cache_option(p)
+
+    p = sub.add_parser('veg', help='vegetation parameter file')
+    p.add_argument('mask', type=_path)
+    p.add_argument('landcover', type=_path)
+    p.add_argument('output', type=_path)
+    p.add_argument('--scheme', default='IGBP')
+    p.add_argument('--lai', type=_path, metavar='FOLDER',
+                   help='monthly LAI rasters written per cell and class')
+    p.add_argument('--albedo', type=_path, metavar='FOLDER',
+                   help='monthly albedo rasters written per cell and class')
+    _add_cache_option(p)
+
+    p = sub.add_parser('veglib', help='vegetation library')
+    p.add_argument('landcover', type=_path)
+    p.add_argument('lai', type=_path, help='folder with the LAI rasters')
+    p.add_argument('albedo', type=_path, help='folder with the albedo rasters')
+    p.add_argument('output', type=_path)
+    p.add_argument('--scheme', default='IGBP')
+
+    p = sub.add_parser('forcing', help='forcing files from AgERA5 grids')
+    p.add_argument('mask', type=_path)
+    p.add_argument('weather', type=_path, help='folder with the AgERA5 files')
+    p.add_argument('output', type=_path)
+    p.add_argument('start', type=int, help='first year')
+    p.add_argument('end', type=int, help='last year')
+    p.add_argument('--method', default='nearest')
+    p.add_argument('--max-open', type=int, default=8)
+    p.add_argument('--read-ahead-days', type=int, default=2)
+    p.add_argument('--qa', type=_path, metavar='PREFIX',
+                   help='write a QA report of the forcings to PREFIX.json and '
+                        'per cell statistics to PREFIX.npz')
+    _add_cache_option(p)
+
+    p = sub.add_parser('download', help='download AgERA5 daily grids')
+    p.add_argument('output', type=_path)
+    p.add_argument('start', type=_date, help='YYYY-MM-DD')
+    p.add_argument('end', type=_date, help='YYYY-MM-DD')
+    p.add_argument('--box', type=float, nargs=4, default=[90, -180, -90, 180],
+                   metavar=('NORTH', 'WEST', 'SOUTH', 'EAST'))
+
+    p = sub.add_parser('climatology', help='mean or total of daily grids')
+    p.add_argument('prefix', type=_path, help='path prefix of the daily files')
+    p.add_argument('start', type=_date, help='YYYY-MM-DD')
+    p.add_argument('end', type=_date, help='YYYY-MM-DD')
+    p.add_argument('output', type=_path)
+    p.add_argument('--statistic', default='mean')
+    _add_output_options(p)
+    return parser
+
+
+def command_arguments(args):
+    '''
+    Returns the (args, kwargs) the function of a parsed command is called
+    with. Options that are not given are left to the function defaults.
+    '''
+    c = args.command
+    kwargs = {}
+    for name in ('profile', 'overviews', 'precip', 'b_val', 'Ws_val', 'Ds_val',
+                 's2', 's3'):
+        if getattr(args, name, None) is not None:
+            kwargs[name] = getattr(args, name)
+    if getattr(args, 'cache', None) is not None:
+        from artifact_cache import ArtifactCache
+        kwargs['cache'] = ArtifactCache(args.cache)
+    if c == 'grid':
+        pos = (args.shapefile, args.output, args.size)
+    elif c == 'snap':
+        pos = (args.input, args.output, args.template, args.sub_grid, args.resample)
+    elif c == 'soil':
+        pos = (args.mask, args.hwsd, args.elevation, args.annual_precip,
+               args.slope, args.output)
+    elif c == 'snow':
+        pos = (args.mask, args.elevation, args.output, args.interval)
+    elif c == 'veg':
+        pos = (args.mask, args.landcover, args.output)
+        kwargs.update(scheme=args.scheme, LAIFolder=args.lai,
+                      ALBFolder=args.albedo)
+    elif c == 'veglib':
+        pos = (args.landcover, args.lai, args.albedo, args.output)
+        kwargs['scheme'] = args.scheme
+    elif c == 'forcing':
+        pos = (args.mask, args.weather, args.output, args.start, args.end)
+        kwargs.update(method=args.method, max_open=args.max_open,
+                      read_ahead_days=args.read_ahead_days, qa=args.qa)
+    elif c == 'download':
+        pos = (args.start, args.end, args.output)
+        kwargs['box'] = args.box
+    elif c == 'climatology':
+        pos = (args.prefix, args.start, args.end, args.output)
+        kwargs['statistic'] = args.statistic
+    return pos, kwargs
+
+
+def import_command(command, report=None):
+    '''
+    Imports the function of a command. If report is a list, the time spent
+    importing each heavy dependency, then the command module itself, is
+    appended to it as (name, seconds, number of modules loaded) tuples.
+    '''
+    module, function, requires = COMMANDS[command]
+    if report is None:
+        return getattr(importlib.import_module(module), function)
+    for name in requires + (module,):
+        loaded = len(sys.modules)
+        t0 = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            if name == module:
+                raise
+            report.append((name, time.perf_counter() - t0, 'not installed'))
+            continue
+        report.append((name, time.perf_counter() - t0, len(sys.modules) - loaded))
+    return getattr(sys.modules[module], function)
+
+
+def print_startup_report(report, elapsed):
+    '''
+    Prints the import times of import_command to stderr.
+    '''
+    err = sys.stderr
+    print('{0:<24}{1:>10}{2:>10}'.format('import', 'seconds', 'modules'), file=err)
+    for name, seconds, modules in report:
+        print('{0:<24}{1:>10.3f}{2:>10}'.format(name, seconds, modules), file=err)
+    print('{0:<24}{1:>10.3f}'.format('total', elapsed), file=err)
+    return
+
+
+def main(argv=None):
+    '''
+    Entry point of the vic-scripts command.
+    '''
+    t0 = time.perf_counter()
+    args = build_parser().parse_args(argv)
+    report = [] if args.profile_startup else None
+    func = import_command(args.command, report)
+    pos, kwargs = command_arguments(args)
+    if report is not None:
+        print_startup_report(report, time.perf_counter() - t0)
+    func(*pos, **kwargs)
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -3,9 +3,30 @@ import os
 import sys
 import numpy as np
 from osgeo import gdal,ogr,osr
-
-
-def create_grid(baseShape, outputGrid, gridSize):
+from raster_io import create_raster, build_overviews
+from cell_index import cell_table
+from zonal import CellZones
+from instrument import instrumented, phase, count, count_output
+
+
+@instrumented('grid')
+def create_grid(baseShape, outputGrid, gridSize, profile=None, overviews=None):
+    '''
+    Rasterizes a basin shapefile into the VIC template grid (1 inside the
+    basin, 0 outside).
+    Parameters
+    ----------
+    baseShape : str
+        basin shapefile
+    outputGrid: str
+        output template raster with TIF file extension
+    gridSize: float
+        grid resolution in degrees
+    profile: str or list (optional)
+        GeoTIFF output profile, see raster_io.PROFILES
+    overviews: list or bool (optional)
+        overview decimation factors to build in the output
+    '''
     NoData_value = -9999.
 
     #Define output coordinate system
@@ -38,43 +59,43 @@ def create_grid(baseShape, outputGrid, gridSize):
     band.SetNoDataValue(NoData_value)
 
     # Rasterize shapefile to high resolution grid
-    gdal.RasterizeLayer(mem_ds, [1], source_layer, burn_values=[1])
-
-    # Get rasterized high res shapefile
-    array = band.ReadAsArray()
-
-    # Flush memory file
-    del mem_ds
-    del band
+    with phase('rasterize'):
+        gdal.RasterizeLayer(mem_ds, [1], source_layer, burn_values=[1])
 
     # Create the destination data source
     x_size = int(np.ceil((x_max - x_min) / gridSize))
     y_size = int(np.ceil((y_max - y_min) / gridSize))
-    drv =  gdal.GetDriverByName('GTiff')
-    target_ds = drv.Create(outputGrid, x_size, y_size, 1, gdal.GDT_Byte)
-    target_ds.SetGeoTransform((x_min, gridSize, 0, y_max, 0, -gridSize))
+    gt = (x_min, gridSize, 0, y_max, 0, -gridSize)
+    target_ds = create_raster(outputGrid, x_size, y_size, gdal.GDT_Byte, profile)
+    target_ds.SetGeoTransform(gt)
     target_ds.SetProjection(spatialRef.ExportToWkt())
 
-    # Create blank mask array at target res
-    outMask = np.zeros([y_size,x_size])
+    # A cell is in the basin if any of its high res pixels is, the high res
+    # raster is read block by block
+    with phase('compute'):
+        grid = np.ones([y_size,x_size], dtype=bool)
+        zones = CellZones(cell_table(grid, gt, grid), gt, mem_ds)
+        inside = zones.count(lambda values: values != 0) > 0
+        outMask = inside.reshape(y_size,x_size).astype(np.float64)
+    count('cells', outMask.size)
 
-    # Loop over array to find the elements the high res raster falls in
-    for i, i_hres in enumerate(np.arange(0, y_hres_size, hiResRatio, int)):
-        for j, j_hres in enumerate(np.arange(0, x_hres_size, hiResRatio, int)):
-            subset = array[i_hres:i_hres+hiResRatio, j_hres:j_hres+hiResRatio]
-            if subset.any():
-                outMask[i,j] = 1
+    # Flush memory file
+    del zones
+    del mem_ds
+    del band
 
     # set the mask array to the target file
-    band = target_ds.GetRasterBand(1)
-    band.WriteArray(outMask)
-    band.SetNoDataValue(NoData_value)
+    with phase('write'):
+        band = target_ds.GetRasterBand(1)
+        band.WriteArray(outMask)
+        band.SetNoDataValue(NoData_value)
+        build_overviews(target_ds, overviews, 'nearest')
+        target_ds.FlushCache()
+        target_ds = None
+    count_output(outputGrid)
     return
 
 # Execute the main level program if run as standalone
 if __name__ == "__main__":
-    create_grid(
-        '/home/diego/vic-southeastern-us/data/shapefiles/sample_watershed.shp',
-        '/home/diego/vic-southeastern-us/data/input/gis/grid-sample.tif',
-        0.05
-    )
\ No newline at end of file
+    from cli import main
+    main(['grid'] + sys.argv[1:])
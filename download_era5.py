@@ -1,7 +1,22 @@
-import cdsapi
 import zipfile
 import os
-from datetime import datetime, timedelta
+from datetime import timedelta
+
+# (variable, statistic) of the AgERA5 grids read by format_meteo_forcing
+VARIABLES = [
+    ('2m_temperature', '24_hour_maximum'),
+    ('2m_temperature', '24_hour_minimum'),
+    ('10m_wind_speed', '24_hour_mean'),
+    ('precipitation_flux', False)
+]
+
+def daily_filename(variable, statistic, date, extension='nc'):
+    '''
+    Returns the name of the file of a daily grid, the {prefix}-YYYYmmdd.nc
+    files read by format_meteo_forcing.
+    '''
+    return f'{variable}-{statistic or "total"}-{date.strftime("%Y%m%d")}.{extension}'
+
 
 def download_era5(variable, date, statistic=False, path='.', box=[90, -180, -90, 180]):
     '''
@@ -30,6 +45,7 @@ def download_era5(variable, date, statistic=False, path='.', box=[90, -180, -90,
         statistic = 'total'
     zip_filename = os.path.join(path, 'download.zip')
 
+    import cdsapi
     c = cdsapi.Client()
     c.retrieve(
         'sis-agrometeorological-indicators',
@@ -40,7 +56,7 @@ def download_era5(variable, date, statistic=False, path='.', box=[90, -180, -90,
     with zipfile.ZipFile(zip_filename, 'r') as zip_ref:
         for file in zip_ref.filelist:
             extension = file.filename.split('.')[-1]
-            filename = f'{variable}-{statistic}-{date.strftime("%Y%m%d")}.{extension}'
+            filename = daily_filename(variable, statistic, date, extension)
             zip_ref.extract(file.filename, path=path)
             os.rename(
                 os.path.join(path, file.filename),
@@ -48,24 +64,30 @@ def download_era5(variable, date, statistic=False, path='.', box=[90, -180, -90,
             )
 
 
-if __name__ == '__main__':
-    DOWNLOAD_PATH = '/home/diego/vic-southeastern-us/data/input/weather'
+def download_period(start, end, path='.', box=[90, -180, -90, 180],
+                    variables=VARIABLES):
+    '''
+    Downloads the daily grids of the forcing variables for every day from
+    start to end (both included).
 
-    START_DATE = datetime(2010, 1, 1)
-    END_DATE = datetime(2011, 12, 31)
+    Parameters
+    ----------
+    start, end: datetime.datetime
+    path: str
+        Path to download the data to
+    box: list
+        [north, west, south, east] of the area to download
+    variables: list
+        (variable, statistic) tuples, see download_era5
+    '''
+    date = start
+    while date <= end:
+        for variable, statistic in variables:
+            download_era5(variable, date, statistic, path, box)
+        date += timedelta(days=1)
 
-    VARIABLES = [
-        ('2m_temperature', '24_hour_maximum'),
-        ('2m_temperature', '24_hour_minimum'),
-        ('10m_wind_speed', '24_hour_mean'),
-        ('precipitation_flux', False)
-    ]
-    
-    date = START_DATE
-    while date <= END_DATE:
-        for variable, statistic in VARIABLES:
-            download_era5(
-                variable, date, statistic, DOWNLOAD_PATH,
-                [37.6, -90.7, 24.4, -75.4]
-            )
-        date += timedelta(days=1)
\ No newline at end of file
+
+if __name__ == '__main__':
+    import sys
+    from cli import main
+    main(['download'] + sys.argv[1:])
@@ -0,0 +1,327 @@
+import os
+import json
+import numpy as np
+from datetime import datetime, timedelta
+
+from download_era5 import VARIABLES, daily_filename
+
+# registry of the domains and of the area covered by each daily file, kept in
+# the archive folder
+INDEX_FILE = 'archive.json'
+
+# degrees added around the template grid of a domain, two AgERA5 cells so
+# the interpolation of the edge cells finds the same source cells as in the
+# whole grid
+MARGIN = 0.2
+
+
+def load_index(root):
+    '''
+    Returns the index of an archive folder, with the [north, west, south,
+    east] box of each registered domain ('domains'), of each daily file
+    ('files'), and of each daily file of each domain, the box it was cut with
+    ('slices').
+    '''
+    path = os.path.join(root, INDEX_FILE)
+    if not os.path.exists(path):
+        return {'domains': {}, 'files': {}, 'slices': {}}
+    with open(path) as f:
+        index = json.load(f)
+    # indexes written before the slices were recorded
+    index.setdefault('slices', {})
+    return index
+
+
+def save_index(root, index):
+    '''
+    Writes the index of an archive folder, replacing the old one at once.
+    '''
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, INDEX_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+    return
+
+
+def union_box(boxes):
+    '''
+    Returns the [north, west, south, east] box covering all the boxes.
+    '''
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    return [float(boxes[:, 0].max()), float(boxes[:, 1].min()),
+            float(boxes[:, 2].min()), float(boxes[:, 3].max())]
+
+
+def covers(outer, inner):
+    '''
+    Returns True if the outer box contains the inner one.
+    '''
+    return (outer[0] >= inner[0] and outer[1] <= inner[1] and
+            outer[2] <= inner[2] and outer[3] >= inner[3])
+
+
+def domain_box(basin_mask, margin=MARGIN):
+    '''
+    Returns the [north, west, south, east] box of a template grid, with a
+    margin in degrees around it.
+    '''
+    from raster_io import raster_info
+    gt, shape = raster_info(basin_mask)
+    north, west = gt[3], gt[0]
+    south, east = gt[3] + shape[0]*gt[5], gt[0] + shape[1]*gt[1]
+    return [float(np.round(north + margin, 6)), float(np.round(west - margin, 6)),
+            float(np.round(south - margin, 6)), float(np.round(east + margin, 6))]
+
+
+def register_domain(root, name, box):
+    '''
+    Adds a domain to an archive, or updates its box.
+    Parameters
+    ----------
+    root : str
+        archive folder
+    name: str
+        domain name
+    box: list or str
+        [north, west, south, east] of the domain, or its template raster
+        (see domain_box)
+    Returns
+    -------
+    the box of the union of all the domains of the archive
+    '''
+    if isinstance(box, str):
+        box = domain_box(box)
+    index = load_index(root)
+    index['domains'][name] = [float(v) for v in box]
+    save_index(root, index)
+    return union_box(list(index['domains'].values()))
+
+
+def _days(start, end):
+    date = start
+    while date <= end:
+        yield date
+        date += timedelta(days=1)
+
+
+def update_archive(root, start, end, names=None, variables=VARIABLES):
+    '''
+    Downloads the daily grids of the forcing variables that the archive is
+    missing for some domains. A file is downloaded when it doesn't exist or
+    doesn't cover the domains, and then covers the union of all the
+    registered domains, so domains inside the area already archived cost no
+    downloads.
+    Parameters
+    ----------
+    root : str
+        archive folder
+    start, end: datetime.datetime
+        first and last day (both included)
+    names: list (optional)
+        domains the files have to cover, all the registered ones by default
+    variables: list
+        (variable, statistic) tuples, see download_era5
+    Returns
+    -------
+    number of files downloaded
+    '''
+    from download_era5 import download_era5
+    index = load_index(root)
+    domains = index['domains']
+    if not domains:
+        raise ValueError('No domains registered in {0}'.format(root))
+    names = list(domains) if names is None else names
+    needed = union_box([domains[n] for n in names])
+    box = union_box(list(domains.values()))
+    downloaded = 0
+    for date in _days(start, end):
+        for variable, statistic in variables:
+            name = daily_filename(variable, statistic, date)
+            covered = index['files'].get(name)
+            if (covered is not None and covers(covered, needed) and
+                    os.path.exists(os.path.join(root, name))):
+                continue
+            download_era5(variable, date, statistic, root, box)
+            index['files'][name] = box
+            downloaded += 1
+        # the index is saved every day, so an interrupted update resumes
+        save_index(root, index)
+    return downloaded
+
+
+def _coordinate_slice(coords, low, high):
+    # contiguous index range of the coordinates in [low, high], with a
+    # tolerance of a thousandth of the grid spacing
+    coords = np.asarray(coords, dtype=np.float64)
+    tol = np.abs(np.diff(coords[:2])).max(initial=0.) * 1e-3
+    inside = np.nonzero((coords >= low - tol) & (coords <= high + tol))[0]
+    if inside.size == 0:
+        raise ValueError('The domain is out of the archived grid')
+    return slice(int(inside[0]), int(inside[-1]) + 1)
+
+
+def grid_slices(path, box):
+    '''
+    Returns the (lat, lon) index slices of the cells of a netCDF grid file
+    inside a [north, west, south, east] box.
+    '''
+    from netCDF4 import Dataset
+    with Dataset(path) as nc:
+        lat = np.ma.getdata(nc.variables['lat'][:])
+        lon = np.ma.getdata(nc.variables['lon'][:])
+    return (_coordinate_slice(lat, box[2], box[0]),
+            _coordinate_slice(lon, box[1], box[3]))
+
+
+def subset_file(src, dst, slices):
+    '''
+    Copies the (lat, lon) index slices of a netCDF grid file to a new file,
+    with the raw values, data types, compression and attributes of the
+    source. No value is resampled.
+    '''
+    from netCDF4 import Dataset
+    index = {'lat': slices[0], 'lon': slices[1]}
+    tmp = dst + '.tmp'
+    with Dataset(src) as nc, Dataset(tmp, 'w', format=nc.data_model) as out:
+        nc.set_auto_maskandscale(False)
+        out.setncatts({k: nc.getncattr(k) for k in nc.ncattrs()})
+        for name, dim in nc.dimensions.items():
+            if dim.isunlimited():
+                size = None
+            elif name in index:
+                size = len(range(*index[name].indices(len(dim))))
+            else:
+                size = len(dim)
+            out.createDimension(name, size)
+        for name, var in nc.variables.items():
+            attrs = {k: var.getncattr(k) for k in var.ncattrs()}
+            filters = var.filters() or {}
+            new = out.createVariable(
+                name, var.datatype, var.dimensions,
+                fill_value=attrs.pop('_FillValue', None),
+                zlib=filters.get('zlib', False),
+                complevel=filters.get('complevel', 4),
+                shuffle=filters.get('shuffle', False))
+            new.set_auto_maskandscale(False)
+            new.setncatts(attrs)
+            new[:] = var[tuple(index.get(d, slice(None)) for d in var.dimensions)]
+    os.replace(tmp, dst)
+    return dst
+
+
+def slice_domain(root, name, start, end, outpath, variables=VARIABLES):
+    '''
+    Writes the daily files of a registered domain, cut from the archive
+    files by index, to the folder format_meteo_forcing reads them from.
+    Files already there, newer than the archive file and cut with the current
+    box of the domain are kept.
+    Parameters
+    ----------
+    root : str
+        archive folder
+    name: str
+        domain name
+    start, end: datetime.datetime
+        first and last day (both included)
+    outpath: str
+        folder of the domain daily files
+    variables: list
+        (variable, statistic) tuples, see download_era5
+    Returns
+    -------
+    number of files written
+    '''
+    index = load_index(root)
+    box = index['domains'][name]
+    cut = index['slices'].setdefault(name, {})
+    os.makedirs(outpath, exist_ok=True)
+    # files downloaded with the same box share their grid, so the slices are
+    # found once per box
+    slices = {}
+    written = 0
+    for date in _days(start, end):
+        for variable, statistic in variables:
+            filename = daily_filename(variable, statistic, date)
+            src = os.path.join(root, filename)
+            dst = os.path.join(outpath, filename)
+            if (cut.get(filename) == box and os.path.exists(dst) and
+                    os.path.getmtime(dst) >= os.path.getmtime(src)):
+                continue
+            key = tuple(index['files'].get(filename, ()))
+            if key not in slices:
+                slices[key] = grid_slices(src, box)
+            subset_file(src, dst, slices[key])
+            cut[filename] = box
+            written += 1
+    # files cut and not recorded if this is interrupted are cut again
+    save_index(root, index)
+    return written
+
+
+def domain_forcing_files(root, name, basin_mask, startyr, endyr, outpath,
+                         variables=VARIABLES):
+    '''
+    Registers the domain of a template grid in an archive, downloads what
+    the archive is missing for it and writes its daily files, see
+    register_domain, update_archive and slice_domain. This is the forcing
+    input stage of the pipeline.
+    Parameters
+    ----------
+    root : str
+        archive folder
+    name: str
+        domain name
+    basin_mask: str
+        template raster of the domain
+    startyr, endyr: int
+        first and last year
+    outpath: str
+        folder of the domain daily files
+    '''
+    start, end = datetime(startyr, 1, 1), datetime(endyr, 12, 31)
+    register_domain(root, name, basin_mask)
+    n = update_archive(root, start, end, [name], variables)
+    print('Downloaded {0} files to {1}'.format(n, root))
+    n = slice_domain(root, name, start, end, outpath, variables)
+    print('Wrote {0} files to {1}'.format(n, outpath))
+    return
+
+
+if __name__ == '__main__':
+    import argparse
+    date = lambda text: datetime.strptime(text, '%Y-%m-%d')
+    parser = argparse.ArgumentParser(
+        description='Shared archive of AgERA5 daily grids covering several '
+                    'domains, with the daily files of each domain cut from it'
+    )
+    parser.add_argument('root', help='archive folder')
+    sub = parser.add_subparsers(dest='action', metavar='action')
+    sub.required = True
+    p = sub.add_parser('register', help='add a domain to the archive')
+    p.add_argument('name')
+    p.add_argument('mask', nargs='?', help='template grid of the domain')
+    p.add_argument('--box', type=float, nargs=4,
+                   metavar=('NORTH', 'WEST', 'SOUTH', 'EAST'))
+    p = sub.add_parser('update', help='download the missing daily grids')
+    p.add_argument('start', type=date, help='YYYY-MM-DD')
+    p.add_argument('end', type=date, help='YYYY-MM-DD')
+    p.add_argument('--domains', nargs='+')
+    p = sub.add_parser('slice', help='write the daily files of a domain')
+    p.add_argument('name')
+    p.add_argument('start', type=date, help='YYYY-MM-DD')
+    p.add_argument('end', type=date, help='YYYY-MM-DD')
+    p.add_argument('output', help='folder of the domain daily files')
+    args = parser.parse_args()
+
+    if args.action == 'register':
+        if (args.mask is None) == (args.box is None):
+            parser.error('give either the template grid or --box')
+        print('Archive box:', register_domain(args.root, args.name,
+                                              args.box or args.mask))
+    elif args.action == 'update':
+        print('Downloaded', update_archive(args.root, args.start, args.end,
+                                           args.domains), 'files')
+    else:
+        print('Wrote', slice_domain(args.root, args.name, args.start, args.end,
+                                    args.output), 'files')
@@ -1,14 +1,18 @@
 import os
 import sys
+import json
 from netCDF4 import Dataset
 import numpy as np
-from osgeo import gdal
-from osgeo.gdalnumeric import *
-from osgeo.gdalconst import *
 from datetime import datetime, timedelta
+from collections import OrderedDict
+from queue import Queue, Empty
+from contextlib import closing
+import threading
 from tqdm import tqdm
-
-import multiprocessing
+from instrument import instrumented, phase, count, count_output
+from cell_index import cell_table
+from raster_io import read_raster, raster_info
+from param_writer import join_columns, write_lines
 
 VAR_PREFIX = {
     'tmax': '2m_temperature-24_hour_maximum', 
@@ -27,101 +31,510 @@ COLUMNS = ['precip', 'tmax', 'tmin', 'wind']
 VAR_PREFIX = {k: VAR_PREFIX[k] for k in COLUMNS}
 
 
-def write_forcings(x, y, mode, nc_datasets, outpath):
-    meteofile = os.path.join(outpath,'forcing_{0:.4f}_{1:.4f}'.format(y,x))
-    ncds = nc_datasets['precip'][0]
-    latnc = ncds.variables['lat'][:]
-    lonnc = ncds.variables['lon'][:]
-    x_idx = (np.abs(lonnc - x)).argmin()
-    y_idx = (np.abs(latnc - y)).argmin()
-    cols = [] 
-    for var, ts in nc_datasets.items():
-        cols.append([])
-        for t in ts:
-            val = t.variables[VAR_NCNAME[var]][:][0][y_idx, x_idx]
-            cols[-1].append(val)
-    cols = np.array(cols).T
-    cols[:, 1] = cols[:, 1] - 273.15
-    cols[:, 2] = cols[:, 2] - 273.15
-    lines = list(map(lambda x: '{0:.4f} {1:.4f} {2:.4f} {3:.4f}\n'.format(*x), cols))
-    with open(meteofile, mode) as f:
-        f.writelines(lines)
-
-
-def format_meteo_forcing(basin_mask, inpath, outpath, startyr, endyr):
+# interpolation methods of the forcings to the cells
+METHODS = ('nearest', 'bilinear', 'idw')
+
+
+# plausible range of the written values of each variable (mm, C, C, m/s).
+# Values out of it are usually unit mistakes, like temperatures left in K or
+# precipitation written as a flux
+VALID_RANGE = {
+    'precip': (0., 1000.),
+    'tmax': (-90., 60.),
+    'tmin': (-90., 60.),
+    'wind': (0., 100.)
+}
+
+# source values at least this large, or equal to MISSING_VALUE, are fill
+# values the netCDF files don't flag as missing
+FILL_LIMIT = 1e20
+MISSING_VALUE = -9999.
+
+
+def forcing_units(variable, values):
+    '''
+    Returns the values of a variable in the units of the forcing files,
+    temperatures are converted from K to C.
+    '''
+    if variable in ('tmax', 'tmin'):
+        return values - 273.15
+    return values
+
+
+class ForcingQA(object):
+    '''
+    Statistics of the forcings of each cell and variable, accumulated while
+    they are written so checking them doesn't need another pass over the
+    files: minimum, maximum and mean, days with no value (NaN), with some
+    source cell missing (masked), with fill values and out of VALID_RANGE,
+    and days with tmax < tmin. The values are checked before they are
+    rounded to the 4 decimals written.
+    '''
+    def __init__(self, ncells):
+        self.days = np.zeros(ncells, dtype=np.int64)
+        self.stats = {}
+        for var in COLUMNS:
+            self.stats[var] = {
+                'min': np.full(ncells, np.inf),
+                'max': np.full(ncells, -np.inf),
+                'sum': np.zeros(ncells),
+                'valid': np.zeros(ncells, dtype=np.int64),
+                'nan': np.zeros(ncells, dtype=np.int64),
+                'masked': np.zeros(ncells, dtype=np.int64),
+                'fill': np.zeros(ncells, dtype=np.int64),
+                'range': np.zeros(ncells, dtype=np.int64),
+            }
+        self.tmax_lt_tmin = np.zeros(ncells, dtype=np.int64)
+
+    def add_grid(self, variable, grid, index):
+        '''
+        Counts the cells with some of their source cells (index, see
+        interpolation_weights) missing in a daily grid.
+        '''
+        self.stats[variable]['masked'] += np.isnan(grid.reshape(-1)[index]).any(axis=1)
+
+    def add(self, values, cells=slice(None)):
+        '''
+        Adds the (days, cells) array of each COLUMNS variable, in the units of
+        the source grids, as passed to write_forcings. cells is the slice of
+        the cells of the arrays when they are a batch of them.
+        '''
+        self.days[cells] += values[COLUMNS[0]].shape[0]
+        for var in COLUMNS:
+            s = {k: v[cells] for k, v in self.stats[var].items()}
+            v = values[var].astype(np.float64)
+            nan = np.isnan(v)
+            fill = (np.abs(v) >= FILL_LIMIT) | (v == MISSING_VALUE)
+            v = np.where(fill, np.nan, forcing_units(var, v))
+            valid = ~np.isnan(v)
+            low, high = VALID_RANGE[var]
+            s['nan'] += nan.sum(axis=0)
+            s['fill'] += fill.sum(axis=0)
+            s['range'] += (valid & ((v < low) | (v > high))).sum(axis=0)
+            s['valid'] += valid.sum(axis=0)
+            s['sum'] += np.where(valid, v, 0.).sum(axis=0)
+            s['min'] = np.fmin(s['min'], np.fmin.reduce(v, axis=0))
+            s['max'] = np.fmax(s['max'], np.fmax.reduce(v, axis=0))
+            for k, v in s.items():
+                self.stats[var][k][cells] = v
+        self.tmax_lt_tmin[cells] += (values['tmax'] < values['tmin']).sum(axis=0)
+
+    def cell_stats(self):
+        '''
+        Returns a dict with the statistics of each cell, as '<variable>_<stat>'
+        arrays (min, max, mean, nan, masked, fill, range) and 'tmax_lt_tmin'.
+        Cells with no valid values have NaN minimum, maximum and mean.
+        '''
+        out = {}
+        for var, s in self.stats.items():
+            empty = s['valid'] == 0
+            with np.errstate(invalid='ignore', divide='ignore'):
+                out[var + '_mean'] = np.where(empty, np.nan, s['sum'] / s['valid'])
+            out[var + '_min'] = np.where(empty, np.nan, s['min'])
+            out[var + '_max'] = np.where(empty, np.nan, s['max'])
+            for k in ('nan', 'masked', 'fill', 'range'):
+                out[var + '_' + k] = s[k].copy()
+        out['tmax_lt_tmin'] = self.tmax_lt_tmin.copy()
+        return out
+
+    def report(self, cells, nflagged=20):
+        '''
+        Returns the QA report of the cells (see cell_table) as a JSON ready
+        dict: the statistics of each variable over all the cells, the number
+        of tmax < tmin days, the first nflagged cells with problems and an ok
+        flag. Masked days are not problems, the other source cells of the
+        interpolation give their value.
+        '''
+        stats = self.cell_stats()
+        problems = np.zeros(cells['cellid'].size, dtype=bool)
+        report = {'cells': int(cells['cellid'].size),
+                  'days': int(self.days.max(initial=0)),
+                  'variables': {}}
+        for var in COLUMNS:
+            bad = ((stats[var + '_nan'] > 0) | (stats[var + '_fill'] > 0) |
+                   (stats[var + '_range'] > 0))
+            problems |= bad
+            s = self.stats[var]
+            valid = int(s['valid'].sum())
+            report['variables'][var] = {
+                'min': float(np.nanmin(stats[var + '_min'])) if valid else None,
+                'max': float(np.nanmax(stats[var + '_max'])) if valid else None,
+                'mean': float(s['sum'].sum() / valid) if valid else None,
+                'nan': int(s['nan'].sum()),
+                'masked': int(s['masked'].sum()),
+                'fill': int(s['fill'].sum()),
+                'out_of_range': int(s['range'].sum()),
+                'valid_range': list(VALID_RANGE[var]),
+                'cells_flagged': int(bad.sum()),
+            }
+        problems |= self.tmax_lt_tmin > 0
+        report['tmax_lt_tmin'] = {'days': int(self.tmax_lt_tmin.sum()),
+                                  'cells': int((self.tmax_lt_tmin > 0).sum())}
+        report['flagged'] = []
+        for k in np.flatnonzero(problems)[:nflagged]:
+            found = [var + ' ' + p for var in COLUMNS
+                     for p in ('nan', 'fill', 'range') if stats[var + '_' + p][k]]
+            if self.tmax_lt_tmin[k]:
+                found.append('tmax < tmin')
+            report['flagged'].append({
+                'cellid': int(cells['cellid'][k]), 'lat': float(cells['lat'][k]),
+                'lon': float(cells['lon'][k]), 'problems': found})
+        report['cells_flagged'] = int(problems.sum())
+        report['ok'] = not problems.any()
+        return report
+
+    def save(self, prefix, cells, shape, gt):
+        '''
+        Writes the QA report to <prefix>.json and the statistics of each cell
+        as (rows, cols) grids of the mask, NaN out of the active cells, to
+        <prefix>.npz, with the grid geotransform, ready to plot as heatmaps.
+        Returns the report.
+        '''
+        report = self.report(cells)
+        os.makedirs(os.path.dirname(os.path.abspath(prefix)), exist_ok=True)
+        with open(prefix + '.json', 'w') as f:
+            json.dump(report, f, indent=1)
+        grids = {}
+        for k, v in self.cell_stats().items():
+            grids[k] = np.full(shape, np.nan)
+            grids[k][cells['row'], cells['col']] = v
+        np.savez_compressed(prefix + '.npz', geotransform=np.asarray(gt), **grids)
+        return report
+
+
+def forcing_path(outpath, x, y):
+    return os.path.join(outpath,'forcing_{0:.4f}_{1:.4f}'.format(y,x))
+
+
+def _nearest(coords, values):
+    # index of the closest source coordinate to each value, the first one on
+    # ties like argmin
+    uniq, inv = np.unique(values, return_inverse=True)
+    idx = np.array([np.abs(coords - v).argmin() for v in uniq], dtype=np.int64)
+    return idx[inv.reshape(-1)]
+
+
+def _bracket(coords, values):
+    # indices of the source coordinates around each value and the position
+    # of the value between them, clamped to the grid edges
+    order = np.argsort(coords, kind='stable')
+    s = np.asarray(coords, dtype=np.float64)[order]
+    if s.size == 1:
+        zero = np.zeros(values.size, dtype=np.int64)
+        return order[zero], order[zero], np.zeros(values.size)
+    p = np.clip(np.searchsorted(s, values), 1, s.size - 1)
+    t = np.clip((values - s[p-1]) / (s[p] - s[p-1]), 0., 1.)
+    return order[p-1], order[p], t
+
+
+def interpolation_weights(lats, lons, latnc, lonnc, method='nearest'):
+    '''
+    Sparse weights mapping a source grid to a set of cells.
+    Parameters
+    ----------
+    lats, lons : numpy.ndarray
+        cell center coordinates
+    latnc, lonnc: numpy.ndarray
+        source grid coordinates
+    method: str
+        'nearest' (closest source cell), 'bilinear' or 'idw' (inverse
+        distance squared to the 4 source cells around the cell center)
+    Returns
+    -------
+    (index, weight) arrays of shape (cells, k), with the flat index of the
+    source cells used by each cell and their weights, see regrid
+    '''
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    nlon = np.size(lonnc)
+    if method == 'nearest':
+        index = _nearest(latnc, lats)*nlon + _nearest(lonnc, lons)
+        return index[:, None], np.ones((index.size, 1))
+    if method not in METHODS:
+        raise ValueError('Interpolation method {0} not supported'.format(method))
+
+    y0, y1, ty = _bracket(latnc, lats)
+    x0, x1, tx = _bracket(lonnc, lons)
+    index = np.stack([y0*nlon + x0, y0*nlon + x1, y1*nlon + x0, y1*nlon + x1], axis=1)
+    if method == 'bilinear':
+        weight = np.stack([(1-ty)*(1-tx), (1-ty)*tx, ty*(1-tx), ty*tx], axis=1)
+        return index, weight
+
+    # inverse distance, with longitudes scaled to the cell latitude
+    latc = np.asarray(latnc, dtype=np.float64)
+    lonc = np.asarray(lonnc, dtype=np.float64)
+    coslat = np.cos(np.radians(lats))[:, None]
+    dy = np.stack([latc[y0], latc[y0], latc[y1], latc[y1]], axis=1) - lats[:, None]
+    dx = (np.stack([lonc[x0], lonc[x1], lonc[x0], lonc[x1]], axis=1) - lons[:, None])*coslat
+    d2 = dx**2 + dy**2
+    exact = d2 == 0
+    with np.errstate(divide='ignore'):
+        weight = np.where(exact.any(axis=1)[:, None], exact*1., 1./d2)
+    return index, weight / weight.sum(axis=1)[:, None]
+
+
+def regrid(grid, index, weight):
+    '''
+    Maps a source grid to the cells with the weights of
+    interpolation_weights, as a single sparse matrix vector product. Missing
+    (NaN) source values are left out and the weights of the others are
+    normalized. Values are returned in the grid data type.
+    '''
+    values = grid.reshape(-1)[index]
+    valid = ~np.isnan(values)
+    weight = np.where(valid, weight, 0.)
+    total = weight.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out = (np.where(valid, values, 0.)*weight).sum(axis=1) / total
+    return out.astype(grid.dtype)
+
+
+class DatasetPool(object):
+    '''
+    Bounded pool of open netCDF datasets. Opening one more than max_open
+    closes the least recently used one, so the number of file handles and
+    of HDF5 chunk caches doesn't grow with the number of files read.
+    '''
+    def __init__(self, max_open=8):
+        self.max_open = max(1, int(max_open))
+        self.handles = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        with self.lock:
+            nc = self.handles.pop(path, None)
+            if nc is None:
+                while len(self.handles) >= self.max_open:
+                    self.handles.popitem(last=False)[1].close()
+                nc = Dataset(path)
+                count('files_opened')
+            self.handles[path] = nc
+            return nc
+
+    def close(self):
+        with self.lock:
+            while self.handles:
+                self.handles.popitem()[1].close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_grid(path, variable, pool):
+    '''
+    Reads the first time step of a variable of a netCDF file from a
+    DatasetPool, with missing values as NaN.
+    '''
+    grid = pool.get(path).variables[variable][0]
+    if not np.issubdtype(grid.dtype, np.floating):
+        grid = grid.astype(np.float64)
+    return np.ma.filled(grid, np.nan)
+
+
+def read_coordinates(path, pool):
+    '''
+    Returns the latitudes and longitudes of a netCDF file grid.
+    '''
+    nc = pool.get(path)
+    return (np.ma.getdata(nc.variables['lat'][:]),
+            np.ma.getdata(nc.variables['lon'][:]))
+
+
+_DONE = object()
+
+
+def read_ahead(requests, pool, depth=4):
+    '''
+    Yields the grids of a list of (path, variable) requests in order. A
+    background thread reads up to depth grids ahead, so reading overlaps
+    with the processing of the previous grids while the memory used stays
+    bounded. All the netCDF reads are done by that thread. Closing the
+    generator before the end stops the thread.
+    '''
+    queue = Queue(maxsize=max(1, int(depth)))
+    stop = threading.Event()
+
+    def worker():
+        try:
+            for path, variable in requests:
+                if stop.is_set():
+                    return
+                queue.put(read_grid(path, variable, pool))
+        except Exception as e:
+            queue.put(e)
+        queue.put(_DONE)
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = queue.get()
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # unblock the thread if it waits on the full queue
+        stop.set()
+        while thread.is_alive():
+            try:
+                queue.get(timeout=0.1)
+            except Empty:
+                pass
+        thread.join()
+
+
+# cells whose lines are formatted at once, so the text held in memory doesn't
+# grow with the domain
+CELL_BATCH = 2000
+
+
+def write_forcings(paths, values, mode):
+    '''
+    Writes the forcing file of each cell. format_meteo_forcing passes the
+    cells in batches of CELL_BATCH.
+    Parameters
+    ----------
+    paths : list
+        forcing file of each cell
+    values: dict
+        (days, cells) array of each COLUMNS variable, temperatures in K
+    mode: str
+        'w' to create the files, 'a' to append to them
+    '''
+    ndays = values[COLUMNS[0]].shape[0]
+    columns = []
+    for var in COLUMNS:
+        v = forcing_units(var, values[var])
+        # cell major order, so the lines of each cell are contiguous
+        columns.append((v.T.reshape(-1), '{:.4f}'))
+    lines = join_columns(columns, sep=' ', end='\n')
+    for k, path in enumerate(paths):
+        write_lines(path, lines[k*ndays:(k+1)*ndays], mode)
+
+
+@instrumented('forcing')
+def format_meteo_forcing(basin_mask, inpath, outpath, startyr, endyr,
+                         window=None, method='nearest', cache=None,
+                         max_open=8, read_ahead_days=2, qa=None):
+    '''
+    Writes the VIC forcing file of each active cell of the template from the
+    AgERA5 daily netCDF files.
+    Parameters
+    ----------
+    basin_mask : str
+        template raster
+    inpath: str
+        folder with the daily {prefix}-YYYYmmdd.nc files of each variable
+    outpath: str
+        folder of the forcing files
+    startyr, endyr: int
+        first and last year to write
+    window: tuple (optional)
+        (row_off, col_off, nrows, ncols) tile of the mask to write the
+        forcings of, see tiling.py
+    method: str (optional)
+        interpolation of the AgERA5 grid to the cells, 'nearest' (default),
+        'bilinear' or 'idw', see interpolation_weights
+    cache: artifact_cache.ArtifactCache (optional)
+        cache of the interpolation weights
+    max_open: int (optional)
+        maximum number of netCDF files open at the same time
+    read_ahead_days: int (optional)
+        days of grids (of all the variables) read ahead of the one being
+        regridded
+    qa: str (optional)
+        path prefix of the QA report (<qa>.json) and per cell statistics
+        (<qa>.npz) of the forcings, accumulated while they are written, see
+        ForcingQA
+    '''
     band = 1
-    ds = gdal.Open(basin_mask, GA_ReadOnly)
-    b1 = ds.GetRasterBand(band)
-    data = BandReadAsArray(b1)
-    gt = ds.GetGeoTransform()
-    lon0 = gt[0] + (gt[1] / 2.)
-    lon1 = gt[0] + (data.shape[1]*gt[1])
-    lat0 = gt[3] + (data.shape[0]*gt[-1])
-    lat1 = gt[3] + (gt[-1] / 2.)
-
-    del ds
-    del b1
-    # lons = np.linspace(lon0, lon1, data.shape[1])
-    # lats = np.linspace(lat0, lat1, data.shape[0])
-    lons = [gt[0]+gt[1]/2 + i*gt[1] for i in range(data.shape[1])]
-    lats = [gt[3]-gt[5]/2 + i*gt[5] for i in range(data.shape[0])]
-    xx, yy = np.meshgrid(lons, lats)
-    # yy = np.flipud(yy)
-    mask = data.astype(uint8)
-    mask = np.ma.masked_where(mask!=1,mask)
+    gt, shape = raster_info(basin_mask)
+    data = read_raster(basin_mask, band, window)[0]
+
+    # coordinates of the active cells
+    cells = cell_table(data.astype(np.uint8), gt, None, window, shape)
     dates = [datetime(startyr, 1, 1)]
     while dates[-1] < datetime(endyr, 12, 31):
         dates.append(dates[-1] + timedelta(days=1))
 
-    lons = xx[~mask.mask]
-    lats = yy[~mask.mask]
-
-    # Write it yearly batches
-    for year in sorted(set(map(lambda x: x.year, dates))):
-        if year == startyr:
-            mode = 'w'
-        else:
-            mode = 'a'
-        dates_year = sorted(filter(lambda x: x.year == year, dates))
-        # dates_year = sorted(dates)
-        # Open netCDF Datasets for the year
-        nc_datasets = {}
-        for variable, prefix in VAR_PREFIX.items():
-            nc_datasets[variable] = []
-            for date in dates_year:
-                nc_datasets[variable].append(
-                    Dataset(os.path.join(inpath, f'{prefix}-{date.strftime("%Y%m%d")}.nc'))
-                )
-        # For all the pixels
-        N_CORES = 8
-        all_pixels = list(zip(lons, lats))
-        batches = [
-            all_pixels[i*N_CORES: (i+1)*N_CORES]
-            for i in range(int(np.ceil(len(all_pixels)/N_CORES)))
-        ]
-        for batch in tqdm(batches[:]):
-            processes = []
-            for x, y in batch:
-                p = multiprocessing.Process(
-                    target=write_forcings, args=(x, y, mode, nc_datasets, outpath)
-                )
-                processes.append(p)
-                p.start()
-
-            for p in processes:
-                p.join()
-
-        for var, vards in nc_datasets.items():
-            for ds in vards:
-                ds.close()
+    lons = cells['lon']
+    lats = cells['lat']
+    paths = [forcing_path(outpath, x, y) for x, y in zip(lons, lats)]
+    filename = lambda prefix, date: os.path.join(
+        inpath, f'{prefix}-{date.strftime("%Y%m%d")}.nc')
+
+    # files are read in date order through a bounded pool of open datasets,
+    # closed even if the reading or writing fails
+    with DatasetPool(max_open) as pool:
+        # interpolation weights from the grid of the first file, computed once
+        with phase('weights'):
+            latnc, lonnc = read_coordinates(filename(VAR_PREFIX['precip'], dates[0]), pool)
+            weights = None
+            if cache is not None:
+                extra = {} if window is None else {'window': list(window)}
+                key = cache.key('forcing-weights', [basin_mask, latnc, lonnc],
+                                method=method, **extra)
+                weights = cache.get(key)
+            if weights is None:
+                weights = interpolation_weights(lats, lons, latnc, lonnc, method)
+                if cache is not None:
+                    cache.put(key, weights)
+            else:
+                count('cache_hits')
+
+        checks = ForcingQA(len(lons)) if qa is not None else None
+
+        # Write it yearly batches
+        for year in sorted(set(map(lambda x: x.year, dates))):
+            if year == startyr:
+                mode = 'w'
+            else:
+                mode = 'a'
+            dates_year = sorted(filter(lambda x: x.year == year, dates))
+
+            # each daily grid is read once and mapped to all the cells
+            requests = [(filename(prefix, date), VAR_NCNAME[variable])
+                        for date in dates_year
+                        for variable, prefix in VAR_PREFIX.items()]
+            values = {variable: [] for variable in VAR_PREFIX}
+            with phase('read'), closing(read_ahead(
+                    requests, pool, read_ahead_days*len(VAR_PREFIX))) as grids:
+                for date in tqdm(dates_year, desc=str(year)):
+                    for variable in VAR_PREFIX:
+                        grid = next(grids)
+                        values[variable].append(regrid(grid, *weights))
+                        if checks is not None:
+                            checks.add_grid(variable, grid, weights[0])
+            values = {k: np.stack(v) for k, v in values.items()}
+
+            for k in range(0, len(paths), CELL_BATCH):
+                batch = slice(k, k + CELL_BATCH)
+                part = {var: v[:, batch] for var, v in values.items()}
+                with phase('write'):
+                    write_forcings(paths[batch], part, mode)
+                if checks is not None:
+                    with phase('qa'):
+                        checks.add(part, batch)
+
+    if checks is not None:
+        row_off, col_off = (0, 0) if window is None else window[:2]
+        report = checks.save(qa, cells, data.shape, (
+            gt[0] + col_off*gt[1], gt[1], gt[2], gt[3] + row_off*gt[5], gt[4], gt[5]))
+        print('Forcing QA: {0} ({1} cells flagged), see {2}.json'.format(
+            'ok' if report['ok'] else 'problems found',
+            report['cells_flagged'], qa))
+
+    count('cells', len(lons))
+    for path in paths:
+        count_output(path)
     return
 
 # Execute the main level program if run as standalone
 if __name__ == "__main__":
-    INPUT_PATH = '/home/diego/vic-southeastern-us/data/input'
-    format_meteo_forcing(
-        os.path.join(INPUT_PATH, 'gis', 'grid-sample.tif'),
-        os.path.join(INPUT_PATH, 'weather'),
-        os.path.join(INPUT_PATH, 'forcing'),
-        2010, 2021
-    )
+    from cli import main
+    main(['forcing'] + sys.argv[1:])
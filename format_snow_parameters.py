@@ -2,161 +2,279 @@ import os
 import sys
 import warnings
 import numpy as np
-from osgeo import gdal
-from osgeo.gdalnumeric import *
-from osgeo.gdalconst import *
+from raster_io import read_raster, raster_info
+from cell_index import cell_table
+from zonal import CellZones
+from kernels import snow_band_classes
+from param_writer import format_column, join_columns, write_lines
+from instrument import instrumented, phase, count, count_output
 
 # set system to ignore simple warnings
 warnings.simplefilter("ignore")
 
-def format_snow_params(basinMask, elvHiRes, outSnow, interval):
+def get_snow_bands(zone, elv, interval, weight=None):
     """
-    FUNCTION: format_snow_params
-    ARGUMENTS: basinMask - path to template raster to run VIC model at
-               elvHiRes - path elevation raster dataset at native resolution
-               outsnow - path output snow parameter file
+    FUNCTION: get_snow_bands
+    ARGUMENTS: zone - cell of each hi res pixel of a block, see
+                      zonal.CellZones.blocks
+               elv - hi res elevation of each pixel, values less than 0 are
+                     masked
+               interval - vertical distance to do equal interval segmentation
+    KEYWORDS: weight - precipitation of each pixel. The precipitation
+                       fraction of each band is its share of the cell
+                       precipitation, or its area fraction if not given or
+                       if the cell has no precipitation data
+    RETURNS: dictionary with the cell ('zone'), fractional area ('area'),
+             mean elevation ('elevation') and precipitation fraction
+             ('precip') of each band of the block, in cell and band order,
+             and the cells of the block ('cells') with their
+             number of bands ('nbands') and whether it is counted for the
+             maximum number of bands ('counted'), which it is unless the cell
+             elevation range fits in a single band limit
+    NOTES: The bands of all the cells of a block are found at once, with the
+           same limits and classes the loop over each cell used, see
+           kernels.snow_band_classes
+    """
+    # mask elevation values less than 0
+    elv = elv.astype(np.float64)
+    elv[elv<0] = np.nan
+    valid = ~np.isnan(elv)
+    cells, inv = np.unique(zone, return_inverse=True)
+    inv = inv.reshape(-1)
+    ncells = cells.size
+
+    # band limits of each cell and band of each hi res pixel, -1 if it is
+    # not in a band
+    nlimits, bcls = snow_band_classes(inv, elv, ncells, interval)
+
+    # bands present in each cell, from the pixels above 0
+    nkeys = int(nlimits.max()) + 1
+    key = inv*nkeys + bcls + 1
+    bands = np.unique(key[valid & (elv > 0)])
+    idx = np.minimum(np.searchsorted(bands, key), bands.size - 1)
+    if bands.size > 0:
+        match = bands[idx] == key
+    else:
+        match = np.zeros(key.shape, dtype=bool)
+
+    # find frational area and mean elevation for each band
+    num = np.bincount(inv[bcls>=0], minlength=ncells).astype(np.float64)
+    npix = np.bincount(idx[match], minlength=bands.size).astype(np.float64)
+    esum = np.bincount(idx[match & valid], elv[match & valid], bands.size)
+    enum = np.bincount(idx[match & valid], minlength=bands.size)
+    bandcell = bands // nkeys
+    with np.errstate(invalid='ignore', divide='ignore'):
+        area = np.where(num[bandcell] == 0, 1., npix / num[bandcell])
+        elevation = esum / enum
+
+    # precipitation of the bands over the precipitation of the cell
+    precip = area
+    if weight is not None:
+        weight = np.where(np.isnan(weight), 0., weight)
+        wnum = np.bincount(inv[bcls>=0], weight[bcls>=0], ncells)
+        wband = np.bincount(idx[match], weight[match], bands.size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            precip = np.where(wnum[bandcell] > 0, wband / wnum[bandcell], area)
+
+    return {'zone': cells[bandcell], 'area': area, 'elevation': elevation,
+            'precip': precip,
+            'cells': cells, 'nbands': np.bincount(bandcell, minlength=ncells),
+            'counted': nlimits > 1}
+
+def snow_band_blocks(zones, interval, precip=None, rows=None):
+    """
+    FUNCTION: snow_band_blocks
+    ARGUMENTS: zones - zonal.CellZones of the hi res elevation raster
+               interval - vertical distance to do equal interval segmentation
+    KEYWORDS: precip - see snow_band_table
+              rows - (first, last + 1) template rows to read, all if not set
+    RETURNS: yields the bands of the cells of each block, see get_snow_bands
+    NOTES: The precipitation is sampled in the same pass
+    """
+    others = [] if precip is None else [precip]
+    for z, elv, *weight in zones.blocks(*others, rows=rows):
+        yield get_snow_bands(z, elv, interval, *weight)
+
+def snow_band_table(cells, zones, interval, precip=None, blocks=None):
+    """
+    FUNCTION: snow_band_table
+    ARGUMENTS: cells - active cells of the template, see cell_index.cell_table
+               zones - zonal.CellZones of the hi res elevation raster over
+                       the cells
                interval - vertical distance to do equal interval segmentation
+    KEYWORDS: precip - precipitation raster input sampled at each hi res
+                       pixel to weight the band precipitation fractions,
+                       they are equal to the area fractions if not given
+              blocks - bands of the blocks of all the cells, in row order,
+                       already read with snow_band_blocks (zones and precip
+                       are not used then)
+    RETURNS: dictionary with the grid cell ids ('cellid'), number of bands
+             ('nbands') and the (cells, maxbands) arrays of area fraction
+             ('area'), mean elevation ('elevation') and precipitation
+             fraction ('precip') of each band
+    NOTES: Cells without hi res pixels take the bands of the previous cell
+    """
+    ncells = cells['cellid'].size
+    nbands = np.zeros(ncells, dtype=np.int64) # number of bands of each pixel
+    counted = np.zeros(ncells, dtype=bool) # counted for the maximum bands
+    seen = np.zeros(ncells, dtype=bool) # pixels with hi res data
+    zone, fracs, elevs, precs = [], [], [], []
+
+    # find the bands of the cells block by block
+    if blocks is None:
+        blocks = snow_band_blocks(zones, interval, precip)
+    for block in blocks:
+        nbands[block['cells']] = block['nbands']
+        counted[block['cells']] = block['counted']
+        seen[block['cells']] = True
+        zone.append(block['zone'])
+        fracs.append(block['area'])
+        elevs.append(block['elevation'])
+        precs.append(block['precip'])
+    zone = np.concatenate(zone) if zone else np.zeros(0, dtype=np.int64)
+    fracs = np.concatenate(fracs) if fracs else np.zeros(0)
+    elevs = np.concatenate(elevs) if elevs else np.zeros(0)
+    precs = np.concatenate(precs) if precs else np.zeros(0)
+    first = np.searchsorted(zone, np.arange(ncells)) # first band of each cell
+
+    # pixels out of the hi res raster take the values of the previous one
+    src = np.maximum.accumulate(np.where(seen, np.arange(ncells), -1))
+    nbands = np.where(src >= 0, nbands[np.maximum(src, 0)], 0)
+    counted = (src >= 0) & counted[np.maximum(src, 0)]
+    src = np.maximum(src, 0)
+
+    # maximum number of bands for a pixel, a tile can have no counted pixels
+    maxbands = int(nbands[counted].max()) if counted.any() else 1
+
+    # pass the bands into fixed size arrays padded with zeros
+    n = np.minimum(nbands, maxbands)
+    row = np.repeat(np.arange(ncells), n)
+    col = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+    band = np.repeat(first[src], n) + col
+    area = np.zeros((ncells, maxbands))
+    elevation = np.zeros((ncells, maxbands))
+    prec = np.zeros((ncells, maxbands))
+    area[row, col] = fracs[band]
+    elevation[row, col] = elevs[band]
+    prec[row, col] = precs[band]
+
+    return {'cellid': np.array(cells['cellid'], dtype=np.int64),
+            'nbands': nbands,
+            'area': area, 'elevation': elevation, 'precip': prec}
+
+def write_snow_params(table, outSnow):
+    """
+    FUNCTION: write_snow_params
+    ARGUMENTS: table - snow band table from snow_band_table
+               outSnow - path output snow parameter file
     KEYWORDS: n/a
     RETURNS: n/a
-    NOTES: Does not return a variable but writes an output file
+    NOTES: n/a
+    """
+    # check if the output parameter file exists, if so delete it
+    if os.path.exists(outSnow)==True:
+        os.remove(outSnow)
+
+    maxbands = table['area'].shape[1]
+
+    # grid cell id, then the fractional area, mean elevation and
+    # precipitation fraction of each band, each column followed by a tab
+    columns = [format_column(table['cellid'])]
+    for k in ('area', 'elevation', 'precip'):
+        for c in range(maxbands):
+            columns.append(format_column(table[k][:,c], '{:.4f}'))
+
+    # write the output snow parameter file
+    write_lines(outSnow, join_columns(columns, end='\t\n'))
+    return
+
+def get_snow_table(infiles, interval, cache=None, band=1, window=None,
+                   precip=None):
+    """
+    FUNCTION: get_snow_table
+    ARGUMENTS: infiles - mask and hi res elevation raster inputs
+               interval - vertical distance to do equal interval segmentation
+    KEYWORDS: cache - artifact_cache.ArtifactCache to reuse the table of
+                      previous builds with the same inputs
+              band - raster band to read
+              window, precip - see format_snow_params
+    RETURNS: snow band table, see snow_band_table
+    NOTES: n/a
     """
-    # maxbands = 11
-    band = 1 # constant variable for reading in data
 
     interval = int(interval) # force equal interval value to be int type
 
+    # look for the snow band table of a previous build with the same inputs
+    table = None
+    if cache is not None:
+        extra = {} if window is None else {'window': list(window)}
+        inputs = infiles if precip is None else infiles + [precip]
+        # v2: band elevations are the float mean of their pixels
+        key = cache.key('snow-table-v2', inputs, interval=interval,
+                        cellids='grid', **extra)
+        table = cache.get(key)
+
+    if table is None:
+        with phase('read'):
+            # read basin grid raster
+            maskGt, shape = raster_info(infiles[0])
+            mask, tileGt, _ = read_raster(infiles[0], band, window)
+            cells = cell_table(mask, maskGt, None, window, shape)
+
+        # hi res elevation pixels of each cell, read block by block
+        with phase('compute'):
+            zones = CellZones(cells, tileGt, infiles[1], band)
+            table = snow_band_table(cells, zones, interval, precip)
+        if cache is not None:
+            cache.put(key, table)
+    else:
+        count('cache_hits')
+    count('cells', table['cellid'].size)
+    return table
+
+@instrumented('snow')
+def format_snow_params(basinMask, elvHiRes, outSnow, interval, cache=None,
+                       window=None, precip=None):
+    """
+    FUNCTION: format_snow_params
+    ARGUMENTS: basinMask - template raster to run VIC model at
+               elvHiRes - elevation raster dataset at native resolution
+               outsnow - path output snow parameter file
+               interval - vertical distance to do equal interval segmentation
+    KEYWORDS: cache - artifact_cache.ArtifactCache to reuse the snow band
+                      table of previous builds with the same inputs
+              window - (row_off, col_off, nrows, ncols) tile of the template
+                       to write the cells of, see tiling.py. Only the hi res
+                       pixels under the tile are read
+              precip - annual precipitation raster (e.g. the avg_annual
+                       climatology, at any resolution) to weight the band
+                       precipitation fractions with. Each hi res pixel
+                       takes the precipitation of the pixel its center falls
+                       in. The fractions are equal to the area fractions if
+                       not set
+    RETURNS: n/a
+    NOTES: Does not return a variable but writes an output file. Raster
+           inputs can be file paths, gdal datasets (e.g. snap_raster output
+           with driver='MEM') or (array, geotransform) tuples. Hi res pixels
+           are matched to the template cells with the raster geotransforms,
+           so the resolutions don't need an integer ratio
+    """
+    # maxbands = 11
+
     # make a list of input raster files
     infiles = [basinMask,elvHiRes]
 
-    # read basin grid raster
-    ds = gdal.Open(infiles[0],GA_ReadOnly)
-    b1 = ds.GetRasterBand(band)
-    mask = BandReadAsArray(b1)
-    maskRes = ds.GetGeoTransform()[1]
-    ds = None
-    b1 = None
-
-    # read hi res elevation raster
-    ds = gdal.Open(infiles[1],GA_ReadOnly)
-    b1 = ds.GetRasterBand(band)
-    elvhires = BandReadAsArray(b1)
-    clsRes = ds.GetGeoTransform()[1]
-    ds = None
-    b1 = None
-
-    # mask elevation values less than 0
-    elvhires[np.where(elvhires<0)] = np.nan
+    table = get_snow_table(infiles, interval, cache, window=window,
+                           precip=precip)
 
-    # get ratio of high resoltion to low resolution
-    clsRatio = int(maskRes/clsRes)
+    with phase('write'):
+        write_snow_params(table, outSnow)
+    count_output(outSnow)
 
-    # check if the output parameter file exists, if so delete it
-    if os.path.exists(outSnow)==True:
-        os.remove(outSnow)
-    nbands = [] # blank list
-
-    # try to write to output snow parameter file
-    with open(outSnow, 'w') as f:
-        cnt = 1 # set grid cell id counter
-        # pass counter
-        pass_counter = range(2)
-        # perform two passes on the raster data
-        # 1) to grab the maximum number of bands for a given pixel
-        # 2) to calculate the snow band parameters and write to output file
-        for pass_cnt in pass_counter:
-            # loop over each pixel in the template raster
-            for i in range(mask.shape[0]):
-                cy1 = i*clsRatio
-                cy2 = cy1+clsRatio
-
-                for j in range(mask.shape[1]):
-                    cx1 = j*clsRatio
-                    cx2 = cx1+clsRatio
-
-                    # get all hi res pixels in a template pixel
-                    tmp = elvhires[cy1:cy2,cx1:cx2]
-                    if tmp.size == 0: 
-                        tmp=tmp2[:]
-                
-                    # create blank array for number of bands calculation...
-                    if mask[i,j] == 1: # ...if it is not a masked pixel
-                        tmp2=tmp
-                        if np.all(tmp == np.nan) == True:
-                            tmp[:,:] = 0
-            
-                        # find min and max values for interval
-                        minelv = np.nanmin(tmp.astype(int)) - (np.nanmin(tmp.astype(int))%interval)
-                        maxelv = np.nanmax(tmp.astype(int)) + (np.nanmax(tmp.astype(int))%interval)
-                    
-                        #print(np.min(tmp).mask)
-                        # create an array of band limits
-                        bands = np.arange(minelv, maxelv+interval,interval)
-                        bcls = np.zeros_like(tmp)
-                        bcls[:,:] = -1
-
-                        # get the number of bands per pixel
-                        for b in range(bands.size-1):
-                            bcls[np.where((tmp>=bands[b])&(tmp<bands[b+1]))] = b # band counter
-
-                            # if it's the first pass get number of bands for each pixel
-                            if pass_cnt == 0:
-                                uniqcnt = np.unique(bcls[np.where(tmp>0)])
-                                nbands.append(uniqcnt.size) # save to a list for second pass
-                            
-                        if pass_cnt == 1:
-                            uniqcnt = np.unique(bcls[np.where(tmp>0)])
-                            #clscnt = np.bincount(tmp.ravel())
-
-                            f.write('{0}\t'.format(cnt)) # write grid cell id
-
-                            # find frational area for each band and write to file
-                            for c in range(maxbands):
-                                try:
-                                    idx = np.where(bcls==uniqcnt[c])
-                                    num = np.float(bcls[np.where(bcls>=0)].size)
-                                    if num == 0:
-                                        num = np.float(idx[0].size)
-                                    frac = np.float(idx[0].size) / num
-                                except IndexError:
-                                    frac = 0
-                                f.write('{0:.4f}\t'.format(frac))
-
-                            # calculate the mean elevation for each band and write to file
-                            for c in range(maxbands):
-                                try:
-                                    idx = np.where(bcls==uniqcnt[c])
-                                    muelv = np.nanmean(tmp[idx])
-                                except IndexError:
-                                    muelv = 0
-                                f.write('{0:.4f}\t'.format(muelv))
-
-                            # calculate the precipitation fractions and write to file
-                            for c in range(maxbands):
-                                try:
-                                    idx = np.where(bcls==uniqcnt[c])
-                                    num = np.float(bcls[np.where(bcls>=0)].size)
-                                    if num == 0:
-                                        num = np.float(idx[0].size)
-                                    frac = np.float(idx[0].size) / num
-                                except IndexError:
-                                    frac = 0
-                            
-                                f.write('{0:.4f}\t'.format(frac))
-                            f.write('\n') # write return value for new line
-                        
-                    if pass_cnt == 1 & mask[i,j] == 1:
-                        cnt += 1 # plus one to the grid cell id counter
-            if pass_cnt == 0:
-                maxbands = max(nbands) # maximum number of bands for a pixel
     # print the number of bands for user to input into global parameter file
-    print('Number of maximum bands: {0}'.format(maxbands))
+    print('Number of maximum bands: {0}'.format(table['area'].shape[1]))
     return
 
 if __name__ == "__main__":
-    INPUT_PATH = '/home/diego/vic-southeastern-us/data/input'
-    format_snow_params(
-        os.path.join(INPUT_PATH, 'gis', 'grid-sample.tif'), 
-        os.path.join(INPUT_PATH, 'gis', 'sample-strm-snap.tif'), 
-        os.path.join(INPUT_PATH, 'snow.param'), 
-        5
-)
\ No newline at end of file
+    from cli import main
+    main(['snow'] + sys.argv[1:])
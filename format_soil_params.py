@@ -3,10 +3,10 @@ import sys
 import json
 import warnings
 import numpy as np
-import pandas as pd
-from osgeo import gdal
-from osgeo.gdalnumeric import *
-from osgeo.gdalconst import *
+from raster_io import read_raster, raster_info, sample_raster
+from cell_index import cell_table, select_cells
+from param_writer import format_column, join_columns, write_lines
+from instrument import instrumented, phase, count, count_output
 
 # set system to ignore simple warnings
 warnings.simplefilter("ignore")
@@ -66,17 +66,39 @@ def get_soil_params(scls, sdata,subsoil):
     return {'topUSDA':usdacls,'subUSDA':susdacls,'topBulkDen':tbden,
             'subBulkDen':sbden,'topOC':toc,'subOC':soc,'drainage':drncls}
 
-def format_soil_params(basinMask,HWSD,basinElv,AnnPrecip,Slope,outsoil,
-                       b_val=None,Ws_val=None,Ds_val=None,s2=None,s3=None):
-
-    band = 1 # constant variable for reading in data
-
-    # define script file path for relative path definitions
-    __location__ = os.path.realpath(
-    os.path.join(os.getcwd(), os.path.dirname(__file__)))
+# columns of the per-cell soil table, i.e. the soil parameters that don't
+# depend on the calibration keywords of format_soil_params
+SOIL_COLUMNS = ['run','grdc','lat','lon','infilt','Ds','Ws','Dsmax','expt',
+                'expt1','tksat','sksat','elev','tbub','sbub','quartz',
+                'quartz1','bulk_den','bulk_den1','t_oc','s_oc','off_gmt',
+                'wrc_frac','wrc_frac1','wpwp_frac','wpwp_frac1','annprecip',
+                'resid','resid1']
+
+# soil parameters with the same value in every cell
+BASEFLOW_C = 2 # exponent in baseflow curve
+PHI_S = -999 # fill value
+TOP_DEPTH = 0.10 # top layer soil depth
+AVG_T = 27 # average temperature of soil
+DP = 4 # depth that soil temp does not change
+SOIL_DEN = (2650., 2685.) # top and lower layers soil density
+ORG_SOIL_DEN = (1295., 1300.) # top and lower layers organic soil density
+ROUGH = 0.01 # bare soil roughness coefficient
+SNOW_ROUGH = 0.001 # snow roughness coefficient
+FS_ACTIVE = 1 # boolean value to run frozen soil algorithm
+
+def read_soil_lookups(location):
+    """
+    FUNCTION: read_soil_lookups
+    ARGUMENTS: location - folder with the soil lookup files
+    KEYWORDS: n/a
+    RETURNS: soildata, subsoil - HWSD data tables for the top and bottom layer
+             soilAttributes - soil type attributes lookup
+             drainAttributes - drainage type attributes lookup
+    NOTES: n/a
+    """
 
     # define soil type lookup file path
-    attriFile = os.path.join(__location__,'soil_type_attributes.json')
+    attriFile = os.path.join(location,'soil_type_attributes.json')
 
     # open/read soil type json file
     with open(attriFile) as data_file:
@@ -86,7 +108,7 @@ def format_soil_params(basinMask,HWSD,basinElv,AnnPrecip,Slope,outsoil,
     soilAttributes = attriData['classAttributes']
 
     # define drainage type lookup file path
-    attriFile = os.path.join(__location__,'drain_type_attributes.json')
+    attriFile = os.path.join(location,'drain_type_attributes.json')
 
     # open/read drainage type json file
     with open(attriFile) as data_file:
@@ -95,8 +117,9 @@ def format_soil_params(basinMask,HWSD,basinElv,AnnPrecip,Slope,outsoil,
     # pass lookup information into variable
     drainAttributes = attriData['classAttributes']
 
-    # define path to HWSD table
-    csvfile = os.path.join(__location__,'HWSD_CLS_DATA.csv')
+    # define path to HWSD table, pandas is only loaded to read it
+    import pandas as pd
+    csvfile = os.path.join(location,'HWSD_CLS_DATA.csv')
 
     # open and read data for...
     indata = pd.read_csv(csvfile)
@@ -104,187 +127,279 @@ def format_soil_params(basinMask,HWSD,basinElv,AnnPrecip,Slope,outsoil,
     # ...top soil layer...
     soildata = [np.array(indata.MU_GLOBAL),
                 np.array(indata.T_USDA_TEX_CLASS,dtype=np.int32),
-                np.array(indata.T_BULK_DENSITY,dtype=np.float),
-                np.array(indata.T_OC,dtype=np.float),
+                np.array(indata.T_BULK_DENSITY,dtype=float),
+                np.array(indata.T_OC,dtype=float),
                 np.array(indata.DRAINAGE,dtype=np.int32)]
     # ...and bottom soil layer
     subsoil = [np.array(indata.MU_GLOBAL),
                np.array(indata.S_USDA_TEX_CLASS,dtype=np.int32),
-               np.array(indata.S_BULK_DENSITY,dtype=np.float),
-               np.array(indata.S_OC,dtype=np.float)]
+               np.array(indata.S_BULK_DENSITY,dtype=float),
+               np.array(indata.S_OC,dtype=float)]
 
-    # create list of input raster files
-    infiles = [os.path.join(__location__,basinMask),
-               os.path.join(__location__,HWSD),
-               os.path.join(__location__,basinElv),
-               os.path.join(__location__,AnnPrecip),
-               os.path.join(__location__,Slope)]
+    return soildata, subsoil, soilAttributes, drainAttributes
 
+def read_soil_cells(infiles, band=1, window=None):
+    """
+    FUNCTION: read_soil_cells
+    ARGUMENTS: infiles - mask, HWSD, elevation, precipitation and slope raster
+                         inputs (paths, gdal datasets, arrays or (array,
+                         geotransform) tuples)
+    KEYWORDS: band - raster band to read
+              window - (row_off, col_off, nrows, ncols) tile of the template
+                       to read, the whole template if not set
+    RETURNS: cells - cells written to the soil file, see cell_index.cell_table
+             values - dictionary with the run flag ('run') and the HWSD class
+                      ('hwsd'), elevation ('elev'), precipitation ('precip')
+                      and slope ('slope') of each cell
+    NOTES: Only the mask is read whole. The other rasters are only sampled at
+           the cells, in strips, in their own data type, and the samples are
+           cast to float64 like the values of the full grid array were
+    """
     try:
-        # loop over each raster file and pass into an array
-        for i in range(len(infiles)):
-
-            # open and read file
-            ds = gdal.Open(infiles[i],GA_ReadOnly)
-            b1 = ds.GetRasterBand(band)
-            var = BandReadAsArray(b1)
-
-            # if it is the first iteration, define blank data array and grab geographic information
-            if i == 0:
-                data = np.zeros((ds.RasterYSize,ds.RasterXSize, len(infiles)))
-                # get geotransform
-                gt = ds.GetGeoTransform()
-                # define raster bounding box
-                lon0 = gt[0] + (gt[1] / 2.)
-                lon1 = lon0 + (data.shape[1]*gt[1])
-                lat1 = gt[3] + (gt[-1]/2)
-                lat0 = lat1 + (data.shape[0]*gt[-1])
-                
-
-            # get the no data value
-            if i == 2:
-                NoData = b1.GetNoDataValue()
-
-            # add raster data to array
-            data[:,:,i] = var[:,:]
-
-            # flush variables
-            ds = None
-            b1 = None
+        # read basin grid raster, cells are written where the mask is
+        # positive (int(mask) > 0) and there is elevation data
+        gt, shape = raster_info(infiles[0])
+        if gt is None:
+            raise ValueError('basinMask input needs a geotransform')
+        mask = read_raster(infiles[0], band, window)[0]
+        cells = cell_table(mask, gt, mask >= 1, window, shape)
+
+        # the other rasters are sampled at the cells position in the grid
+        row_off, col_off = (0, 0) if window is None else window[:2]
+
+        # elevation at the candidate cells
+        elev, _, NoData = sample_raster(infiles[2], cells['row'] + row_off,
+                                        cells['col'] + col_off, band)
+        elev = elev.astype(np.float64)
+        if NoData is not None:
+            keep = elev != NoData
+            cells = select_cells(cells, keep)
+            elev = elev[keep]
+
+        values = {'run': mask[cells['row'], cells['col']].astype(np.int64),
+                  'elev': elev}
+        del mask
+
+        # sample the rest of the rasters at the cells
+        for k, src in (('hwsd', infiles[1]), ('precip', infiles[3]),
+                       ('slope', infiles[4])):
+            values[k] = sample_raster(src, cells['row'] + row_off,
+                                      cells['col'] + col_off,
+                                      band)[0].astype(np.float64)
 
     # if not working, give error message
     except AttributeError:
         raise IOError('Raster file input error, check that all paths are correct')
 
-    # create arrays for all lat/lon points
-    # lons = np.linspace(lon0,lon1,data.shape[1])
-    # lats = np.linspace(lat0,lat1,data.shape[0])
-    lons = [gt[0]+gt[1]/2 + i*gt[1] for i in range(data.shape[1])]
-    lats = [gt[3]-gt[5]/2 + i*gt[5] for i in range(data.shape[0])]
+    return cells, values
 
-    # mesh the lat/lon points
-    xx,yy = np.meshgrid(lons,lats)
-    # yy = np.flipud(yy) # invert the lat
+def soil_cell_table(cells,values,soildata,subsoil,soilAttributes,drainAttributes):
+    """
+    FUNCTION: soil_cell_table
+    ARGUMENTS: cells, values - cells and raster values from read_soil_cells
+               soildata, subsoil, soilAttributes, drainAttributes - lookups
+                                                   from read_soil_lookups
+    KEYWORDS: n/a
+    RETURNS: dictionary with an array per SOIL_COLUMNS entry, with one value
+             per grid cell written to the soil parameter file
+    NOTES: n/a
+    """
 
-    # define the path to the output soil parameter file
-    soilfile = os.path.join(__location__,outsoil)
+    table = {k: [] for k in SOIL_COLUMNS}
+    soildics = {} # soil attributes already looked up by HWSD class
+
+    # loop over each cell
+    for c in range(cells['cellid'].size):
+
+        # get soil class and attributes
+        hwsdcls = values['hwsd'][c]
+        if hwsdcls not in soildics:
+            soildics[hwsdcls] = get_soil_params(hwsdcls, soildata,subsoil)
+        soildic = soildics[hwsdcls]
+
+        # extract data tree from lookup json files
+        soilDrain = drainAttributes[soildic['drainage']-1]['properties']
+        topSoilPro = soilAttributes[soildic['topUSDA']-1]['properties']
+        subSoilPro = soilAttributes[soildic['subUSDA']-1]['properties']
+
+        table['run'].append(values['run'][c]) # run cell flag
+        table['grdc'].append(cells['cellid'][c]) # grid cell id
+        table['lat'].append(cells['lat'][c]) # latitude
+        table['lon'].append(cells['lon'][c]) # longitude
+        table['infilt'].append(soilDrain['infilt']) # drainage class infiltration curve parameter
+        table['Ds'].append(soilDrain['Ds']) # drainage class Ds value
+        table['Ws'].append(soilDrain['Ws']) # drainage class Ws value
+        table['Dsmax'].append((values['slope'][c]/100.) * (float(subSoilPro['SatHydraulicCapacity'])*240)) # Dsmax value
+        table['expt'].append(3+(2*float(topSoilPro['SlopeRCurve']))) # top layer exponent value
+        table['expt1'].append(3+(2*float(subSoilPro['SlopeRCurve']))) # bottom layer exponent value
+        table['tksat'].append(float(topSoilPro['SatHydraulicCapacity'])*240) # top layer Ksat value
+        table['sksat'].append(float(subSoilPro['SatHydraulicCapacity'])*240) # bottom layer Ksat value
+        table['elev'].append(values['elev'][c]) # average elevation of gridcell
+        table['tbub'].append(topSoilPro['BubblingPressure']) # top layer bubbling pressure
+        table['sbub'].append(subSoilPro['BubblingPressure']) # bottom layer bubbling pressure
+        table['quartz'].append(topSoilPro['Quartz']) # top layer percent quartz
+        table['quartz1'].append(subSoilPro['Quartz']) # bottom layer percent quartz
+        table['bulk_den'].append(float(soildic['topBulkDen'])) # top layer bulk density
+        table['bulk_den1'].append(float(soildic['subBulkDen'])) # bottom layer bulk density
+        table['t_oc'].append(float(soildic['topOC'])) # top layer organic content
+        table['s_oc'].append(float(soildic['subOC'])) # bottom layer organic content
+        table['off_gmt'].append(cells['lon'][c] * 24 / 360.) # time zone offset from GMT
+        table['wrc_frac'].append(float(topSoilPro['FieldCapacity'])/
+                                 float(topSoilPro['Porosity'])) # top layer critical point
+        table['wrc_frac1'].append(float(subSoilPro['FieldCapacity'])/
+                                  float(subSoilPro['Porosity'])) # bottom layer critical point
+        table['wpwp_frac'].append(float(topSoilPro['WiltingPoint'])/
+                                  float(topSoilPro['Porosity'])) # top layer wilting point
+        table['wpwp_frac1'].append(float(subSoilPro['WiltingPoint'])/
+                                   float(subSoilPro['Porosity'])) # bottom layer wilting point
+        table['annprecip'].append(values['precip'][c]) # climotological average precipitation
+        table['resid'].append(topSoilPro['Residual']) # top layer residual moisture
+        table['resid1'].append(subSoilPro['Residual']) # bottom layer residual moisture
+
+    # pass lists to arrays, lookup strings are kept as strings
+    for k in SOIL_COLUMNS:
+        if k in ('run','grdc'):
+            table[k] = np.array(table[k], dtype=np.int64)
+        elif k in ('tbub','sbub','quartz','quartz1','resid','resid1'):
+            table[k] = np.array(table[k], dtype=str)
+        else:
+            table[k] = np.array(table[k], dtype=np.float64)
+    return table
+
+def soil_line_parts(table):
+    """
+    FUNCTION: soil_line_parts
+    ARGUMENTS: table - per-cell soil table from soil_cell_table
+    KEYWORDS: n/a
+    RETURNS: dictionary with the text of each soil file line that doesn't
+             depend on the calibration keywords, split into the pieces that
+             go around them ('head', 'mid1', 'mid2', 'mid3', 'tail')
+    NOTES: the lines are put together by write_soil_lines
+    """
+
+    # constant columns
+    c = str(BASEFLOW_C) # exponent in baseflow curve
+    phis = str(PHI_S) # fill value
+    depth = TOP_DEPTH # top layer soil depth
+    avg_t = str(AVG_T) # average temperature of soil
+    dp = str(DP) # depth that soil temp does not change
+    soil_den, soil_den1 = SOIL_DEN # top and bottom layer soil density
+    org_soil_den, org_soil_den1 = ORG_SOIL_DEN # top and bottom layer organic soil density
+    rough = str(ROUGH) # bare soil roughness coefficient
+    srough = str(SNOW_ROUGH) # snow roughness coefficient
+    fs_act = str(FS_ACTIVE) # boolean value to run frozen soil algorithm
+
+    # columns written more than once are formatted once
+    expt1 = format_column(table['expt1']) # bottom layer exponent value
+    sksat = format_column(table['sksat']) # bottom layer Ksat value
+    sbub = format_column(table['sbub']) # bottom layer bubbling pressure
+    quartz1 = format_column(table['quartz1']) # bottom layer percent quartz
+    bulk_den1 = format_column(table['bulk_den1']) # bottom layer bulk density
+    s_oc = format_column(table['s_oc']) # bottom layer organic content
+    org_bulk_den1 = format_column(0.25*table['bulk_den1']) # bottom layer organic bulk density
+    wrc_frac1 = format_column(table['wrc_frac1']) # bottom layer critical point
+    wpwp_frac1 = format_column(table['wpwp_frac1']) # bottom layer wilting point
+    resid1 = format_column(table['resid1']) # bottom layer residual moisture
+    init_moist = (table['bulk_den'] / soil_den) * depth *1000 # top layer inital moisture conditions
+
+    parts = {
+        # line text up to the infiltration parameter
+        'head': join_columns([
+            (table['run'], '{}'), (table['grdc'], '{}'),
+            (table['lat'], '{:.4f}'), (table['lon'], '{:.4f}')], end='\t'),
+        # between Ds and Ws
+        'mid1': join_columns(['', (table['Dsmax'], '{:.4f}')], end='\t'),
+        # between Ws and the second layer initial moisture
+        'mid2': join_columns([
+            '', c, (table['expt'], '{}'), expt1, expt1, (table['tksat'], '{}'),
+            sksat, sksat, phis, phis, phis, (init_moist, '{}')], end='\t'),
+        # between the bottom layer initial moisture and the second layer depth
+        'mid3': join_columns(['', (table['elev'], '{}'), str(depth)], end='\t'),
+        # after the bottom layer depth
+        'tail': join_columns([
+            '', avg_t, dp, (table['tbub'], '{}'), sbub, sbub,
+            (table['quartz'], '{}'), quartz1, quartz1,
+            (table['bulk_den'], '{}'), bulk_den1, bulk_den1,
+            str(soil_den), str(soil_den1), str(soil_den1),
+            (table['t_oc'], '{}'), s_oc, s_oc,
+            (0.25*table['bulk_den'], '{}'), org_bulk_den1, org_bulk_den1,
+            str(org_soil_den), str(org_soil_den1), str(org_soil_den1),
+            (table['off_gmt'], '{}'), (table['wrc_frac'], '{}'), wrc_frac1,
+            wrc_frac1, (table['wpwp_frac'], '{}'), wpwp_frac1, wpwp_frac1,
+            rough, srough, (table['annprecip'], '{}'),
+            (table['resid'], '{}'), resid1, resid1, fs_act], end='\n'),
+    }
+    return parts
+
+def soil_calibration(table,b_val=None,Ws_val=None,Ds_val=None,s2=None,s3=None):
+    """
+    FUNCTION: soil_calibration
+    ARGUMENTS: table - per-cell soil table from soil_cell_table
+    KEYWORDS: b_val, Ws_val, Ds_val, s2, s3 - see format_soil_params
+    RETURNS: the b_val, Ws_val, Ds_val, s2 and s3 values written to every cell
+    NOTES: n/a
+    """
+
+    # if keywords are not set then pass data from the drainage class of the
+    # first grid cell
+    if table['run'].size > 0:
+        if b_val == None:
+            b_val = table['infilt'][0]
+        if Ds_val == None:
+            Ds_val = table['Ds'][0]
+        if Ws_val == None:
+            Ws_val = table['Ws'][0]
+    if s2 == None:
+        s2 = 1.50
+    if s3 == None:
+        s3 = 0.30
+    return b_val, Ws_val, Ds_val, s2, s3
+
+def write_soil_lines(table,parts,soilfile,b_val=None,Ws_val=None,Ds_val=None,
+                     s2=None,s3=None):
+    """
+    FUNCTION: write_soil_lines
+    ARGUMENTS: table - per-cell soil table from soil_cell_table
+               parts - line text from soil_line_parts
+               soilfile - path output soil parameter file
+    KEYWORDS: b_val, Ws_val, Ds_val, s2, s3 - see format_soil_params
+    RETURNS: n/a
+    NOTES: n/a
+    """
 
     # if soil parameter file exists, then delete the file
     if os.path.exists(soilfile)==True:
         os.remove(soilfile)
 
-    cells = 0 # counter
+    # no active cells, the calibration values taken from the first cell
+    # are not set, write an empty file
+    if table['run'].size == 0:
+        write_lines(soilfile, [])
+        return
+
+    b_val, Ws_val, Ds_val, s2, s3 = soil_calibration(
+        table, b_val, Ws_val, Ds_val, s2, s3)
+
+    soil_den1 = SOIL_DEN[1] # bottom layer soil density
+    depth1 = s2 # second layer soil depth
+    depth2 = s3 # bottom layer soil depth
+
+    # calibration values are the same for every line...
+    infilt = '{0:.4f}\t{1:.4f}'.format(b_val,Ds_val) # infiltration curve parameter and Ds
+    Ws = '{0:.4f}'.format(Ws_val) # Ws value
+    depths = '{0}\t{1}'.format(depth1,depth2) # second and bottom layer depths
+    # ...except the initial moisture of the lower layers
+    initmoist2 = (table['bulk_den1'] / soil_den1) * depth1 *1000 # second layer initial moisture conditions
+    initmoist3 = (table['bulk_den1'] / soil_den1) * depth2 *1000 # bottom layer initial moisture conditions
 
     # try to write the output parameter file
     try:
 
-        # open soil parameter file for writing
-        with open(soilfile, 'w') as f:
-
-            cnt = 1 # grid cell id variable
-
-            # loop over each lat/lon point
-            for i in range(data.shape[0]):
-                for j in range(data.shape[1]):
-
-                    # check if there is data at the lat/lon
-                    run = int(data[i,j,0])
-                    if run <= 0:
-                        run=0
-                    if data[i,j,2] == NoData:
-                        run = 0
-
-                    # check if to write data for the file based on data
-                    if run == 0:
-                        # if there is no data, add 1 to cell id variable
-                        cnt+=1
-
-                    else:
-                        # get soil class and attributes
-                        hwsdcls = data[i,j,1]
-                        soildic = get_soil_params(hwsdcls, soildata,subsoil)
-                        cells+=1
-
-                        # extract data tree from lookup json files
-                        soilDrain = drainAttributes[soildic['drainage']-1]['properties']
-                        topSoilPro = soilAttributes[soildic['topUSDA']-1]['properties']
-                        subSoilPro = soilAttributes[soildic['subUSDA']-1]['properties']
-
-                        # if keywords are not set then pass data from lookup json files
-                        if b_val == None:
-                            b_val = soilDrain['infilt']
-                        if Ds_val == None:
-                            Ds_val = soilDrain['Ds']
-                        if Ws_val == None:
-                            Ws_val = soilDrain['Ws']
-                        if s2 == None:
-                            s2 = 1.50
-                        if s3 == None:
-                            s3 = 0.30
-
-                        # start passing information to simple variables
-                        grdc = cnt # grid cell id
-                        lat = yy[i,j] # latitude
-                        lon = xx[i,j] # longitude
-                        infilt = b_val # variable infiltration curve parameter
-                        Ds = Ds_val # Ds value
-                        Dsmax = (data[i,j,4]/100.) * (float(subSoilPro['SatHydraulicCapacity'])*240) # Dsmax value
-                        Ws = Ws_val # Ws value
-                        c = 2 # exponent in baseflow curve
-                        expt = 3+(2*float(topSoilPro['SlopeRCurve'])) # top layer exponent value
-                        expt1 = 3+(2*float(subSoilPro['SlopeRCurve'])) # bottom layer exponent value
-                        tksat = (float(topSoilPro['SatHydraulicCapacity'])*240) # top layer Ksat value
-                        sksat = (float(subSoilPro['SatHydraulicCapacity'])*240) # bottom layer Ksat value
-                        phis = -999 # fill value
-                        elev = data[i,j,2] # average elevation of gridcell
-                        depth = 0.10 # top layer soil depth
-                        depth1 =s2 # second layer soil depth
-                        depth2 =s3 # bottom layer soil depth
-                        avg_t = 27 # average temperature of soil
-                        dp = 4 # depth that soil temp does not change
-                        tbub = topSoilPro['BubblingPressure'] # top layer bubbling pressure
-                        sbub = subSoilPro['BubblingPressure'] # bottom layer bubbling pressure
-                        quartz = topSoilPro['Quartz'] # top layer percent quartz
-                        quartz1 = subSoilPro['Quartz'] # bottom layer percent quartz
-                        bulk_den = float(soildic['topBulkDen']) # top layer bulk density
-                        bulk_den1 =float(soildic['subBulkDen']) # bottom layer bulk density
-                        soil_den = 2650. # top layer soil density
-                        soil_den1 = 2685. # bottom layer soil density
-                        t_oc = float(soildic['topOC']) # top layer organic content
-                        s_oc = float(soildic['subOC']) # bottom layer organic content
-                        org_bulk_den = 0.25*bulk_den # top layer organic bul density
-                        org_bulk_den1 = 0.25*bulk_den1 # bottom layer organic bulk density
-                        org_soil_den = 1295. # top layer organic soil density
-                        org_soil_den1 = 1300. # bottom layer organic soil density
-                        off_gmt = lon * 24 / 360. # time zone offset from GMT
-                        wrc_frac = (float(topSoilPro['FieldCapacity'])/
-                                    float(topSoilPro['Porosity'])) # top layer critical point
-                        wrc_frac1 = (float(subSoilPro['FieldCapacity'])/
-                                    float(subSoilPro['Porosity'])) # bottom layer critical point
-                        wpwp_frac = (float(topSoilPro['WiltingPoint'])/
-                                    float(topSoilPro['Porosity'])) # top layer wilting point
-                        wpwp_frac1 = (float(subSoilPro['WiltingPoint'])/
-                                    float(subSoilPro['Porosity'])) # bottom layer wilting point
-                        rough = 0.01 # bare soil roughness coefficient
-                        srough = 0.001 # snow roughness coefficient
-                        annprecip = data[i,j,3] # climotological average precipitation
-                        resid = topSoilPro['Residual'] # top layer residual moisture
-                        resid1 = subSoilPro['Residual'] # bottom layer residual moisture
-                        fs_act = 1 # boolean value to run frozen soil algorithm
-                        init_moist = (bulk_den / soil_den) * depth *1000 # top layer inital moisture conditions
-                        initmoist2 = (bulk_den1 / soil_den1) * depth1 *1000 # second layer initial moisture conditions
-                        initmoist3 = (bulk_den1 / soil_den1) * depth2 *1000 # bottom layer initial moisture conditions
-
-                        # write the soil parameterization information for each grid cell as a line
-                        f.write('{0}\t{1}\t{2:.4f}\t{3:.4f}\t{4:.4f}\t{5:.4f}\t{6:.4f}\t{7:.4f}\t{8}\t{9}\t{10}\t{10}\t{11}\t{12}\t{12}\t{13}\t{13}\t{13}\t{14}\t{15}\t{16}\t{17}\t{18}\t{19}\t{20}\t{21}\t{22}\t{23}\t{24}\t{24}\t{25}\t{26}\t{26}\t{27}\t{28}\t{28}\t{29}\t{30}\t{30}\t{31}\t{32}\t{32}\t{33}\t{34}\t{34}\t{35}\t{36}\t{36}\t{37}\t{38}\t{39}\t{39}\t{40}\t{41}\t{41}\t{42}\t{43}\t{44}\t{45}\t{46}\t{46}\t{47}\n'.format(run,
-                                            grdc,lat,lon,infilt,Ds,Dsmax,Ws,c,expt,expt1,tksat,sksat,
-                                            phis,init_moist,initmoist2,initmoist3,elev,depth,
-                                            depth1,depth2,avg_t,dp,tbub,sbub,quartz,quartz1,bulk_den,
-                                            bulk_den1,soil_den,soil_den1,t_oc,s_oc,org_bulk_den,org_bulk_den1,
-                                            org_soil_den,org_soil_den1,off_gmt,wrc_frac,wrc_frac1,wpwp_frac,
-                                            wpwp_frac1,rough,srough,annprecip,resid,resid1,fs_act))
-
-                        cnt+=1 # plus one to the grid cell id
+        # write the soil parameterization information for each grid cell as a line
+        write_lines(soilfile, join_columns([
+            parts['head'], infilt, parts['mid1'], Ws, parts['mid2'],
+            (initmoist2, '{}'), '\t', (initmoist3, '{}'), parts['mid3'],
+            depths, parts['tail']], sep=''))
 
     # except raise an error
     except IOError:
@@ -292,14 +407,218 @@ def format_soil_params(basinMask,HWSD,basinElv,AnnPrecip,Slope,outsoil,
 
     return
 
+def write_soil_params(table,soilfile,b_val=None,Ws_val=None,Ds_val=None,
+                      s2=None,s3=None):
+    """
+    FUNCTION: write_soil_params
+    ARGUMENTS: table - per-cell soil table from soil_cell_table
+               soilfile - path output soil parameter file
+    KEYWORDS: b_val, Ws_val, Ds_val, s2, s3 - see format_soil_params
+    RETURNS: n/a
+    NOTES: n/a
+    """
+    with phase('format'):
+        parts = soil_line_parts(table)
+    with phase('write'):
+        write_soil_lines(table, parts, soilfile, b_val, Ws_val, Ds_val, s2, s3)
+    count_output(soilfile)
+    return
+
+def get_soil_table(infiles, location, cache=None, band=1, window=None):
+    """
+    FUNCTION: get_soil_table
+    ARGUMENTS: infiles - mask, HWSD, elevation, precipitation and slope raster
+                         inputs
+               location - folder with the soil lookup files
+    KEYWORDS: cache - artifact_cache.ArtifactCache to reuse the table of
+                      previous builds with the same inputs
+              band - raster band to read
+              window - tile of the template to read, see read_soil_cells
+    RETURNS: per-cell soil table, see soil_cell_table
+    NOTES: n/a
+    """
+
+    # look for the soil table of a previous build with the same inputs
+    table = None
+    if cache is not None:
+        lookups = [os.path.join(location,f) for f in (
+            'soil_type_attributes.json','drain_type_attributes.json',
+            'HWSD_CLS_DATA.csv')]
+        extra = {} if window is None else {'window': list(window)}
+        key = cache.key('soil-table', list(infiles) + lookups, **extra)
+        table = cache.get(key)
+
+    if table is None:
+        with phase('lookup'):
+            lookups = read_soil_lookups(location)
+        with phase('read'):
+            cells, values = read_soil_cells(infiles, band, window)
+        with phase('compute'):
+            table = soil_cell_table(cells, values, *lookups)
+        if cache is not None:
+            cache.put(key, table)
+    else:
+        count('cache_hits')
+
+    count('cells', table['run'].size)
+    return table
+
+def soil_defaults(basinMask,HWSD,basinElv,band=1):
+    """
+    FUNCTION: soil_defaults
+    ARGUMENTS: basinMask, HWSD, basinElv - raster inputs, see
+                                           format_soil_params
+    KEYWORDS: band - raster band to read
+    RETURNS: dictionary with the b_val, Ds_val and Ws_val used when they are
+             not set, the drainage class values of the first grid cell of
+             the whole template
+    NOTES: Tiles of a domain pass these to format_soil_params so all of them
+           write the same values as the whole domain, see tiling.py
+    """
+    __location__ = os.path.realpath(
+    os.path.join(os.getcwd(), os.path.dirname(__file__)))
+    infiles = [os.path.join(__location__,f) if isinstance(f, str) else f
+               for f in (basinMask,HWSD,basinElv)]
+
+    # first cell with elevation data
+    gt, shape = raster_info(infiles[0])
+    mask = read_raster(infiles[0], band)[0]
+    cells = cell_table(mask, gt, mask >= 1)
+    del mask
+    elev, _, NoData = sample_raster(infiles[2], cells['row'], cells['col'], band)
+    keep = np.arange(elev.size)
+    if NoData is not None:
+        keep = np.nonzero(elev.astype(np.float64) != NoData)[0]
+    if keep.size == 0:
+        return {}
+    k = keep[:1]
+
+    # drainage class of its soil
+    hwsdcls = sample_raster(infiles[1], cells['row'][k], cells['col'][k],
+                            band)[0].astype(np.float64)[0]
+    soildata, subsoil, soilAttributes, drainAttributes = read_soil_lookups(__location__)
+    soildic = get_soil_params(hwsdcls, soildata, subsoil)
+    soilDrain = drainAttributes[soildic['drainage']-1]['properties']
+    return {'b_val': float(soilDrain['infilt']), 'Ds_val': float(soilDrain['Ds']),
+            'Ws_val': float(soilDrain['Ws'])}
+
+@instrumented('soil')
+def format_soil_params(basinMask,HWSD,basinElv,AnnPrecip,Slope,outsoil,
+                       b_val=None,Ws_val=None,Ds_val=None,s2=None,s3=None,
+                       cache=None,window=None):
+    """
+    FUNCTION: format_soil_params
+    ARGUMENTS: basinMask - basin template raster
+               HWSD - HWSD soil class raster snapped to the template
+               basinElv - mean elevation raster snapped to the template
+               AnnPrecip - annual precipitation raster snapped to the template
+               Slope - mean slope raster snapped to the template
+               outsoil - path output soil parameter file
+    KEYWORDS: b_val, Ws_val, Ds_val - infiltration and baseflow parameters,
+                                      taken from the drainage class if not set
+              s2, s3 - depth of the second and third soil layers
+              cache - artifact_cache.ArtifactCache to reuse the per-cell soil
+                      table of previous builds with the same inputs
+              window - (row_off, col_off, nrows, ncols) tile of the template
+                       to write the cells of, see tiling.py
+    RETURNS: n/a
+    NOTES: Raster inputs can be file paths, gdal datasets (e.g. snap_raster
+           output with driver='MEM') or (array, geotransform) tuples
+    """
+
+    # define script file path for relative path definitions
+    __location__ = os.path.realpath(
+    os.path.join(os.getcwd(), os.path.dirname(__file__)))
+
+    # create list of raster inputs, in-memory datasets and (array,
+    # geotransform) tuples are passed through as they are
+    infiles = [os.path.join(__location__,f) if isinstance(f, str) else f
+               for f in (basinMask,HWSD,basinElv,AnnPrecip,Slope)]
+
+    table = get_soil_table(infiles, __location__, cache, window=window)
+
+    # define the path to the output soil parameter file
+    soilfile = os.path.join(__location__,outsoil)
+
+    write_soil_params(table, soilfile, b_val, Ws_val, Ds_val, s2, s3)
+
+    return
+
+# keywords of format_soil_params that can be swept
+SWEEP_KEYWORDS = ('b_val','Ws_val','Ds_val','s2','s3')
+
+def _init_sweep(table, parts):
+    # pass the shared soil table to each sweep worker once
+    global _SWEEP_TABLE, _SWEEP_PARTS
+    _SWEEP_TABLE = table
+    _SWEEP_PARTS = parts
+
+def _write_sweep_member(args):
+    soilfile, member = args
+    write_soil_lines(_SWEEP_TABLE, _SWEEP_PARTS, soilfile, **member)
+    return soilfile
+
+@instrumented('soil-sweep')
+def format_soil_params_sweep(basinMask,HWSD,basinElv,AnnPrecip,Slope,outsoil,
+                             params,processes=None,cache=None):
+    """
+    FUNCTION: format_soil_params_sweep
+    ARGUMENTS: basinMask, HWSD, basinElv, AnnPrecip, Slope - raster inputs,
+                                                  see format_soil_params
+               outsoil - output soil parameter file name pattern, formatted
+                         with the member index and its keywords, e.g.
+                         'soil_{0:03d}.param' or 'soil_b{b_val}.param'
+               params - list of dictionaries with the b_val, Ws_val, Ds_val,
+                        s2 and s3 values of each member, or dictionary with
+                        a list of values per keyword to sweep all their
+                        combinations
+    KEYWORDS: processes - number of processes writing files, all the CPUs if
+                          not set. Files are written serially if it's 1
+              cache - artifact_cache.ArtifactCache, see format_soil_params
+    RETURNS: list with the path of each member soil parameter file
+    NOTES: The rasters and HWSD table are read, and the per-cell columns are
+           formatted, only once for all the members
+    """
+    import itertools
+    import multiprocessing
+
+    # get the list of members from a parameter grid
+    if isinstance(params, dict):
+        keys = list(params.keys())
+        params = [dict(zip(keys, values))
+                  for values in itertools.product(*[params[k] for k in keys])]
+    for member in params:
+        for k in member:
+            if k not in SWEEP_KEYWORDS:
+                raise KeyError('{0} is not a soil parameter keyword'.format(k))
+
+    # define script file path for relative path definitions
+    __location__ = os.path.realpath(
+    os.path.join(os.getcwd(), os.path.dirname(__file__)))
+
+    infiles = [os.path.join(__location__,f) if isinstance(f, str) else f
+               for f in (basinMask,HWSD,basinElv,AnnPrecip,Slope)]
+
+    # invariant per-cell columns and line text, computed once
+    table = get_soil_table(infiles, __location__, cache)
+    with phase('format'):
+        parts = soil_line_parts(table)
+
+    jobs = [(os.path.join(__location__,outsoil.format(i, **member)), member)
+            for i, member in enumerate(params)]
+
+    with phase('write'):
+        if processes == 1:
+            _init_sweep(table, parts)
+            soilfiles = [_write_sweep_member(job) for job in jobs]
+        else:
+            with multiprocessing.Pool(processes, _init_sweep, (table, parts)) as pool:
+                soilfiles = pool.map(_write_sweep_member, jobs)
+
+    for soilfile in soilfiles:
+        count_output(soilfile)
+    return soilfiles
+
 if __name__ == "__main__":
-    INPUT_PATH = '/home/diego/vic-southeastern-us/data/input'
-    format_soil_params(
-        os.path.join(INPUT_PATH, 'gis', 'grid-sample.tif'), 
-        os.path.join(INPUT_PATH, 'gis', 'sample-soils-agg.tif'), 
-        os.path.join(INPUT_PATH, 'gis', 'sample-strm-avg.tif'),
-        os.path.join(INPUT_PATH, 'gis', 'sample-precip-snap.tif'),
-        os.path.join(INPUT_PATH, 'gis', 'sample-slope-avg.tif'),
-        os.path.join(INPUT_PATH, 'soil.param'), 
-        100
-    )
+    from cli import main
+    main(['soil'] + sys.argv[1:])
@@ -2,20 +2,209 @@ import os
 import sys
 import json
 import numpy as np
-from osgeo import gdal
-from osgeo.gdalnumeric import *
-from osgeo.gdalconst import *
+from raster_io import read_raster, raster_info
+from cell_index import cell_table
+from zonal import CellZones, BLOCK_PIXELS
+from kernels import modal_fill
+from param_writer import format_column, join_columns, write_lines
+from instrument import instrumented, phase, count, count_output
 
-def format_veg_params(basinMask,lcData,outVeg,scheme='IGBP'):
+# scale factors of the monthly LAI and albedo rasters, see make_veg_lib
+MONTHLY_SCALE = {'lai': 0.0001, 'albedo': 0.001}
+
+# monthly LAI and albedo of water, also used for classes without data
+WATER_VALUES = {'lai': 0.01, 'albedo': 0.08}
+
+# water class of each classification scheme, see make_veg_lib
+WATER_CLASS = {'IGBP': 0, 'GLCC': 12, 'IPCC': 0}
+
+# monthly variables in the order of their rows after each class line
+MONTHLY = ('lai', 'albedo')
+
+def veg_class_histogram(zones,nclasses,rows=None,out=None):
     """
-    FUNCTION: format_veg_params
-    ARGUMENTS: basinMask - path to basin template raster
-               lcData - path to land cover raster
-               outveg - path output vegetation parameter file
-    KEYWORDS:  scheme - Abbreviation of land cover classification scheme the
-                        input land cover data is formatted in
+    FUNCTION: veg_class_histogram
+    ARGUMENTS: zones - zonal.CellZones of the land cover raster
+               nclasses - number of classes of the classification scheme
+    KEYWORDS: rows - (first, last + 1) template rows to read, all if not set
+              out - histogram the counts are added to
+    RETURNS: (cells, nclasses+1) land cover pixel count of each class, with
+             no data values (classes out of the scheme) counted last
+    NOTES: n/a
+    """
+    return zones.histogram(nclasses+1,
+                           lambda v: np.where(v>nclasses-1, nclasses, v),
+                           rows, out)
+
+def monthly_rasters(LAIFolder=None,ALBFolder=None):
+    """
+    FUNCTION: monthly_rasters
+    ARGUMENTS: n/a
+    KEYWORDS: LAIFolder, ALBFolder - folders with the monthly LAI and albedo
+                                     rasters (0.tif to 11.tif)
+    RETURNS: dictionary with the list of the 12 monthly rasters of each
+             folder given ('lai', 'albedo')
+    NOTES: n/a
+    """
+    monthly = {}
+    for k, folder in (('lai',LAIFolder),('albedo',ALBFolder)):
+        if folder is not None:
+            monthly[k] = [os.path.join(folder, f'{i}.tif') for i in range(12)]
+    return monthly
+
+def veg_class_monthly(zones,nclasses,monthly,rows=None,out=None):
+    """
+    FUNCTION: veg_class_monthly
+    ARGUMENTS: zones - zonal.CellZones of the land cover raster
+               nclasses - number of classes of the classification scheme
+               monthly - monthly raster inputs of each variable, see
+                         monthly_rasters
+    KEYWORDS: rows - (first, last + 1) template rows to read, all if not set
+              out - statistics the values are added to
+    RETURNS: (hist, sums, n) with the class histogram of veg_class_histogram
+             and the (variables*12, cells, nclasses+1) sums and numbers of
+             data values of the monthly rasters under the pixels of each
+             class in each cell, variables in MONTHLY order
+    NOTES: The monthly rasters are sampled at the land cover pixel centers
+           in the same pass that counts the classes
+    """
+    rasters = [f for k in MONTHLY if k in monthly for f in monthly[k]]
+    return zones.histogram_sums(nclasses+1, rasters,
+                                lambda v: np.where(v>nclasses-1, nclasses, v),
+                                rows, out)
+
+def veg_monthly_values(counts,stats,monthly,waterCls=0):
+    """
+    FUNCTION: veg_monthly_values
+    ARGUMENTS: counts - land cover counts of veg_cover_matrix
+               stats - statistics from veg_class_monthly
+               monthly - monthly raster inputs, see monthly_rasters
+    KEYWORDS: waterCls - water class of the scheme
+    RETURNS: dictionary with the (classes in cells, 12) monthly values of
+             each variable for the class lines of the veg parameter file,
+             in cell and class order ('lai', 'albedo'), and the (nclasses,
+             12) mean of each class in the whole template ('class_lai',
+             'class_albedo')
+    NOTES: Values are scaled like in make_veg_lib. Classes of a cell without
+           data take the mean of the class in the cells read (the tile for
+           tiled builds), and the water class and classes without data
+           anywhere take the water values
+    """
+    _, sums, n = stats
+    nclasses = counts.shape[1]
+    cell, vegcls = np.nonzero(counts)
+    out = {}
+    for j, k in enumerate([k for k in MONTHLY if k in monthly]):
+        s = sums[12*j:12*(j+1),:,:nclasses]
+        m = n[12*j:12*(j+1),:,:nclasses]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            clsmean = s.sum(axis=1) / m.sum(axis=1) * MONTHLY_SCALE[k]
+            cellmean = s[:,cell,vegcls] / m[:,cell,vegcls] * MONTHLY_SCALE[k]
+        clsmean[:,waterCls] = np.nan
+        clsmean = np.where(np.isnan(clsmean), WATER_VALUES[k], clsmean)
+        cellmean[:,vegcls==waterCls] = np.nan
+        cellmean = np.where(np.isnan(cellmean), clsmean[:,vegcls], cellmean)
+        out[k] = cellmean.T.copy()
+        out['class_' + k] = clsmean.T.copy()
+    return out
+
+def veg_cover_matrix(cells,zones,nclasses,hist=None):
+    """
+    FUNCTION: veg_cover_matrix
+    ARGUMENTS: cells - active cells of the template, see cell_index.cell_table
+               zones - zonal.CellZones of the land cover raster over the cells
+               nclasses - number of classes of the classification scheme
+    KEYWORDS: hist - class histogram of all the cells already read with
+                     veg_class_histogram (zones is not used then)
+    RETURNS: dictionary with the grid cell ids ('cellid') and the (cells,
+             nclasses) land cover pixel count of each class ('counts')
+    NOTES: No data pixels (classes out of the scheme) are counted as the
+           modal class of the cell data pixels
+    """
+
+    # class pixel counts of each written pixel, no data values counted last
+    if hist is None:
+        hist = veg_class_histogram(zones, nclasses)
+
+    # if there are nodata values calculate histogram for only data values
+    # and add them to its modal class, or to class 0 if there is no data
+    counts = modal_fill(hist, nclasses)
+
+    return {'cellid': np.array(cells['cellid'], dtype=np.int64),
+            'counts': counts.astype(np.int64)}
+
+def write_veg_params(table,clsAttributes,vegfile):
+    """
+    FUNCTION: write_veg_params
+    ARGUMENTS: table - veg cover table from veg_cover_matrix
+               clsAttributes - land cover class attributes lookup
+               vegfile - path output vegetation parameter file
+    KEYWORDS: n/a
     RETURNS: n/a
-    NOTES: Returns no variables but writes an output file
+    NOTES: n/a
+    """
+
+    # check if the output parameter file exists, if so delete it
+    if os.path.exists(vegfile)==True:
+        os.remove(vegfile)
+
+    try: # try to write output veg parameter file
+
+        counts = table['counts']
+
+        # grid cell id and number of classes of each cell
+        Nveg = (counts > 0).sum(axis=1) # n veg equal to unique values
+        heads = join_columns([(table['cellid'], '{}'), (Nveg, '{}')],
+                             sep=' ', end='\n')
+
+        # a line per class in each cell, in cell and class order
+        cell, vegcls = np.nonzero(counts)
+        Cv = counts[cell, vegcls] / counts.sum(axis=1)[cell].astype(np.float64) # percent coverage
+
+        # rooting depths and fractions of the classes found
+        roots = np.empty(counts.shape[1], dtype=object)
+        for c in np.unique(vegcls):
+            attributes = clsAttributes[c]['properties'] # intermediate variale
+            roots[c] = ' '.join(str(attributes[k]) for k in (
+                'rootd1','rootfr1','rootd2','rootfr2','rootd3','rootfr3'))
+
+        lines = join_columns([
+            ['\t' + v for v in format_column(vegcls)], (Cv, '{:.4f}'),
+            list(roots[vegcls])], sep=' ', end='\n')
+
+        # monthly LAI and albedo rows after each class line, read by VIC
+        # with VEGPARAM_LAI and VEGPARAM_ALB
+        for k in MONTHLY:
+            if k in table:
+                values = [format_column(table[k][:,i], '{:.4f}')
+                          for i in range(12)]
+                values[0] = ['\t\t' + v for v in values[0]]
+                rows = join_columns(values, sep=' ', end='\n')
+                lines = [a + b for a, b in zip(lines, rows)]
+
+        # put each cell header before its class lines
+        ends = np.cumsum(Nveg).tolist()
+        starts = [0] + ends[:-1]
+        blocks = [heads[k] + ''.join(lines[starts[k]:ends[k]])
+                  for k in range(len(heads))]
+
+        # write the output veg parameter file
+        write_lines(vegfile, blocks)
+
+    # except raise an error when it doesn't work
+    except IOError:
+        raise IOError('Cannot write output file, error with output veg parameter file path')
+
+    return
+
+def veg_class_attributes(scheme='IGBP'):
+    """
+    FUNCTION: veg_class_attributes
+    ARGUMENTS: n/a
+    KEYWORDS: scheme - Abbreviation of land cover classification scheme
+    RETURNS: path of the class attributes lookup of the scheme and the list
+             of class attributes in it
+    NOTES: n/a
     """
 
     # define script file path for relative path definitions
@@ -32,125 +221,141 @@ def format_veg_params(basinMask,lcData,outVeg,scheme='IGBP'):
     else:
         raise SyntaxError('Land cover classification scheme not supported')
 
-    band = 1 # constant variable for reading in data
-
     # open/read veg scheme json file
     with open(attriFile) as data_file:
         attriData = json.load(data_file)
 
     # pass look up information into variable
-    clsAttributes = attriData['classAttributes']
+    return attriFile, attriData['classAttributes']
 
-    # create list of input raster files
-    infiles = [os.path.join(__location__,basinMask),
-               os.path.join(__location__,lcData)]
+def get_veg_table(infiles,attriFile,nclasses,cache=None,band=1,window=None,
+                  monthly=None,waterCls=0):
+    """
+    FUNCTION: get_veg_table
+    ARGUMENTS: infiles - mask and land cover raster inputs
+               attriFile - class attributes lookup, part of the cache key
+               nclasses - number of classes of the classification scheme
+    KEYWORDS: cache - artifact_cache.ArtifactCache to reuse the table of
+                      previous builds with the same inputs
+              band - raster band to read
+              window - see format_veg_params
+              monthly - monthly LAI and albedo rasters, see monthly_rasters
+              waterCls - water class of the scheme
+    RETURNS: veg cover table, see veg_cover_matrix, with the monthly values
+             of veg_monthly_values if monthly rasters are given
+    NOTES: n/a
+    """
 
-    try: # try to read in the raster data
+    # look for the cover matrix of a previous build with the same inputs
+    table = None
+    if cache is not None:
+        extra = {} if window is None else {'window': list(window)}
+        if monthly:
+            extra['monthly'] = sorted(monthly)
+        rasters = [f for k in MONTHLY if monthly and k in monthly
+                   for f in monthly[k]]
+        key = cache.key('veg-table', infiles + [attriFile] + rasters, **extra)
+        table = cache.get(key)
 
-        # read basin grid raster
-        ds = gdal.Open(infiles[0],GA_ReadOnly)
-        b1 = ds.GetRasterBand(band)
-        mask = BandReadAsArray(b1)
-        maskRes = ds.GetGeoTransform()[1]
-        ds = None
-        b1 = None
+    if table is None:
+        try: # try to read in the raster data
 
-        # read land cover raster
-        ds = gdal.Open(infiles[1],GA_ReadOnly)
-        b1 = ds.GetRasterBand(band)
-        lccls = BandReadAsArray(b1)
-        clsRes = ds.GetGeoTransform()[1]
-        ds = None
-        b1 = None
+            with phase('read'):
+                # read basin grid raster
+                maskGt, shape = raster_info(infiles[0])
+                mask, tileGt, _ = read_raster(infiles[0], band, window)
+                cells = cell_table(mask, maskGt, None, window, shape)
 
-    # if not working, give error message
-    except AttributeError:
-        raise IOError('Raster file input error, check that all paths are correct')
+            # land cover pixels of each cell, read block by block
+            with phase('compute'):
+                if monthly:
+                    # the monthly rasters are sampled at every pixel of a
+                    # block, smaller blocks keep the memory of a single one
+                    zones = CellZones(cells, tileGt, infiles[1], band,
+                                      BLOCK_PIXELS // (1 + 12*len(monthly)))
+                    stats = veg_class_monthly(zones, nclasses, monthly)
+                    table = veg_cover_matrix(cells, zones, nclasses, stats[0])
+                    table.update(veg_monthly_values(table['counts'], stats,
+                                                    monthly, waterCls))
+                else:
+                    zones = CellZones(cells, tileGt, infiles[1], band)
+                    table = veg_cover_matrix(cells, zones, nclasses)
 
-    ratio = maskRes/clsRes # get ratio of high resoltion to low resolution
+        # if not working, give error message
+        except AttributeError:
+            raise IOError('Raster file input error, check that all paths are correct')
+        if cache is not None:
+            cache.put(key, table)
+    else:
+        count('cache_hits')
+    count('cells', table['cellid'].size)
+    return table
 
-    # get file path to output file
-    vegfile = os.path.join(__location__,outVeg)
+@instrumented('veg')
+def format_veg_params(basinMask,lcData,outVeg,scheme='IGBP',cache=None,
+                      window=None,LAIFolder=None,ALBFolder=None):
+    """
+    FUNCTION: format_veg_params
+    ARGUMENTS: basinMask - basin template raster
+               lcData - land cover raster
+               outveg - path output vegetation parameter file
+    KEYWORDS:  scheme - Abbreviation of land cover classification scheme the
+                        input land cover data is formatted in
+               cache - artifact_cache.ArtifactCache to reuse the veg cover
+                       matrix of previous builds with the same inputs
+               window - (row_off, col_off, nrows, ncols) tile of the template
+                        to write the cells of, see tiling.py. Only the land
+                        cover pixels under the tile are read
+               LAIFolder, ALBFolder - folders with the monthly LAI and albedo
+                                      rasters (0.tif to 11.tif, as for
+                                      make_veg_lib). If set, the monthly LAI
+                                      and albedo of each class in each cell
+                                      are written after its class line, to
+                                      run VIC with VEGPARAM_LAI and
+                                      VEGPARAM_ALB
+    RETURNS: n/a
+    NOTES: Returns no variables but writes an output file. Raster inputs can
+           be file paths, gdal datasets (e.g. snap_raster output with
+           driver='MEM') or (array, geotransform) tuples
+    """
 
-    # check if the output parameter file exists, if so delete it
-    if os.path.exists(vegfile)==True:
-        os.remove(vegfile)
+    # define script file path for relative path definitions
+    __location__ = os.path.realpath(
+    os.path.join(os.getcwd(), os.path.dirname(__file__)))
 
-    try: # try to write output veg parameter file
+    # land cover classification scheme lookup table
+    attriFile, clsAttributes = veg_class_attributes(scheme)
 
-        # open output file for writing
-        with open(vegfile, 'w') as f:
-
-            cnt = 1 # grid cell id counter
-
-            # loop over each pixel in the template raster
-            for i in range(mask.shape[0]):
-                y1 = int(i*ratio)
-                y2 = int(y1+ratio)
-                for j in range(mask.shape[1]):
-                    x1 = int(j*ratio)
-                    x2 = int(x1+ratio)
-
-                    # get land cover data within template raster pixel
-                    tmp = lccls[y1:y2,x1:x2]
-
-                    # if not a mask value...
-                    if mask[i,j] == 1:
-                        # if there are nodata values...
-                        if np.any(tmp>len(clsAttributes)-1)==True:
-                            # ...find where they are...
-                            negdx = np.where(tmp>len(clsAttributes)-1)
-                            try:
-                                # ...and calculate hisogram for only data values
-                                tmp[negdx] = np.bincount(tmp[np.where(tmp<len(
-                                                clsAttributes)-1)].ravel()).argmax()
-                            except ValueError:
-                                tmp[negdx] = 0
-                        uniqcnt = np.unique(tmp) # number of unique values
-                        clscnt = np.bincount(tmp.ravel())
-
-                        # check if there is only 1 value in unique value array
-                        if type(uniqcnt).__name__ == 'int':
-                            Nveg = 1 # if so, only 1 value
-                        else:
-                            Nveg = len(uniqcnt) # if not, n veg equal to unique values
-
-                        # write the grid cell id and number of classes
-                        f.write('{0} {1}\n'.format(cnt,Nveg))
-
-                        # if there is vegetation data...
-                        if Nveg != 0:
-                            # ...loop over each class...
-                            for t in range(uniqcnt.size):
-                                # ...and grab the parameter attributes
-                                vegcls = int(uniqcnt[t]) # class value
-                                Cv = np.float(clscnt[uniqcnt[t]])/np.float(clscnt.sum()) # percent coverage
-                                attributes = clsAttributes[vegcls]['properties'] # intermediate variale
-                                rdepth1 = str(attributes['rootd1']) # rooting depth layer 1
-                                rfrac1 = str(attributes['rootfr1']) # rooting fraction layer 1
-                                rdepth2 = str(attributes['rootd2']) # rooting depth layer 2
-                                rfrac2 = str(attributes['rootfr2']) # rooting fraction layer 2
-                                rdepth3 = str(attributes['rootd3']) # rooting depth layer 3
-                                rfrac3 = str(attributes['rootfr3']) # rooting fraction layer 3
-
-                                # write the veg class information
-                                f.write('\t{0} {1:.4f} {2} {3} {4} {5} {6} {7}\n'.format(vegcls,Cv,rdepth1,rfrac1,rdepth2,rfrac2,rdepth3,rfrac3))
-
-                    cnt+=1 # plus one to grid cell id counter
+    # create list of raster inputs, in-memory datasets and (array,
+    # geotransform) tuples are passed through as they are
+    infiles = [os.path.join(__location__,f) if isinstance(f, str) else f
+               for f in (basinMask,lcData)]
 
-    # except raise an error when it doesn't work
-    except IOError:
-        raise IOError('Cannot write output file, error with output veg parameter file path')
+    # monthly LAI and albedo averaged over the pixels of each class of a cell
+    monthly = monthly_rasters(*[os.path.join(__location__,f) if f else None
+                                for f in (LAIFolder,ALBFolder)])
+
+    table = get_veg_table(infiles, attriFile, len(clsAttributes), cache,
+                          window=window, monthly=monthly,
+                          waterCls=WATER_CLASS[scheme])
+
+    # get file path to output file
+    vegfile = os.path.join(__location__,outVeg)
+
+    with phase('write'):
+        write_veg_params(table, clsAttributes, vegfile)
+    count_output(vegfile)
+
+    # print the options for user to input into global parameter file
+    if 'lai' in table:
+        print('VEGPARAM_LAI TRUE, LAI_SRC FROM_VEGPARAM')
+    if 'albedo' in table:
+        print('VEGPARAM_ALB TRUE, ALB_SRC FROM_VEGPARAM')
 
     return
 
 
 # Execute the main level program if run as standalone
 if __name__ == "__main__":
-    INPUT_PATH = '/home/diego/vic-southeastern-us/data/input'
-    format_veg_params(
-        os.path.join(INPUT_PATH, 'gis', 'grid-sample.tif'), 
-        os.path.join(INPUT_PATH, 'gis', 'sample-lc-igbp.tif'),
-        os.path.join(INPUT_PATH, 'veg.param'),
-        'IGBP'
-        )
+    from cli import main
+    main(['veg'] + sys.argv[1:])
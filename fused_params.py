@@ -0,0 +1,165 @@
+import os
+import numpy as np
+
+from raster_io import open_dataset, read_raster
+from cell_index import cell_table
+from zonal import CellZones, BLOCK_PIXELS
+from instrument import instrumented, phase, count, count_output
+
+# template rows of each strip walked through all the inputs at once
+STRIP_ROWS = 64
+
+
+def strip_windows(mask, strip_rows=STRIP_ROWS):
+    '''
+    Returns the (row_off, col_off, nrows, ncols) window of each strip of
+    whole template rows with active cells (mask >= 1), top to bottom.
+    '''
+    windows = []
+    for r0 in range(0, mask.shape[0], strip_rows):
+        strip = mask[r0:r0+strip_rows]
+        if np.any(strip >= 1):
+            windows.append((r0, 0, strip.shape[0], mask.shape[1]))
+    return windows
+
+
+def _concat_cells(parts):
+    # joins the cell tables and raster values of the strips read by
+    # read_soil_cells, with the rows of each strip moved to the whole grid
+    cells = {'shape': parts[0][1]['shape']}
+    for k in ('row', 'col', 'cellid', 'lat', 'lon'):
+        cells[k] = np.concatenate([c[k] + w[0] if k == 'row' else c[k]
+                                   for w, c, _ in parts])
+    values = {k: np.concatenate([v[k] for _, _, v in parts])
+              for k in parts[0][2]}
+    return cells, values
+
+
+@instrumented('params')
+def format_params_fused(basinMask, soil=None, snow=None, veg=None,
+                        strip_rows=STRIP_ROWS):
+    '''
+    Writes the soil, snow and veg parameter files of a template in a single
+    pass over it, instead of running format_soil_params, format_snow_params
+    and format_veg_params one after the other. The mask is read once and
+    every input is opened once. The template is walked in strips of whole
+    rows, and for each strip the soil rasters are sampled at its cells and
+    only the hi res elevation and land cover pixels under it are read. The
+    files are the same as the ones of the separate formatters. Sections that
+    are not given are not written.
+    Parameters
+    ----------
+    basinMask : str, gdal.Dataset or tuple
+        template raster
+    soil: dict (optional)
+        'hwsd', 'elevation', 'precip' and 'slope' rasters snapped to the
+        template, the 'output' soil parameter file, and the calibration
+        keywords of format_soil_params ('b_val', 'Ws_val', 'Ds_val', 's2',
+        's3') if set
+    snow: dict (optional)
+        'elevation' hi res raster, band 'interval' and 'output' snow parameter
+        file, and the 'precip' climatology if set, see format_snow_params
+    veg: dict (optional)
+        'landcover' raster, classification 'scheme' and 'output' veg
+        parameter file, and the 'lai' and 'albedo' folders of monthly
+        rasters if set, see format_veg_params
+    strip_rows: int (optional)
+        template rows read at once
+    Returns
+    -------
+    list with the (row_off, col_off, nrows, ncols) window of each strip
+    '''
+    opened = lambda src: open_dataset(src) if isinstance(src, str) else src
+    with phase('read'):
+        mask, gt, _ = read_raster(basinMask)
+    template = (mask, gt)
+    windows = strip_windows(mask, strip_rows)
+    # the snow and veg files have the cells of mask == 1, the soil file the
+    # cells of mask >= 1 with elevation data
+    cells = cell_table(mask, gt)
+
+    if soil is not None:
+        import format_soil_params as fs
+        soil_files = [template] + [opened(soil[k])
+                                   for k in ('hwsd', 'elevation', 'precip', 'slope')]
+        soil_parts = []
+    if snow is not None:
+        from format_snow_parameters import snow_band_blocks
+        interval = int(snow['interval'])
+        snow_precip = opened(snow['precip']) if snow.get('precip') else None
+        snow_zones = CellZones(cells, gt, opened(snow['elevation']))
+        snow_blocks = []
+    if veg is not None:
+        import format_veg_params as fv
+        scheme = veg.get('scheme', 'IGBP')
+        _, clsAttributes = fv.veg_class_attributes(scheme)
+        nclasses = len(clsAttributes)
+        monthly = fv.monthly_rasters(veg.get('lai'), veg.get('albedo'))
+        monthly = {k: [opened(f) for f in v] for k, v in monthly.items()}
+        veg_zones = CellZones(cells, gt, opened(veg['landcover']), 1,
+                              BLOCK_PIXELS // (1 + 12*len(monthly)))
+        # empty statistics, the strips add their pixels to them
+        veg_stats = fv.veg_class_monthly(veg_zones, nclasses, monthly, (0, 0))
+
+    # walk the template once, each strip through all the inputs
+    for window in windows:
+        rows = (window[0], window[0] + window[2])
+        with phase('read'):
+            if soil is not None:
+                soil_parts.append((window,) + fs.read_soil_cells(
+                    soil_files, 1, window))
+        with phase('compute'):
+            if snow is not None:
+                snow_blocks += snow_band_blocks(snow_zones, interval,
+                                                snow_precip, rows)
+            if veg is not None:
+                veg_stats = fv.veg_class_monthly(veg_zones, nclasses, monthly,
+                                                 rows, veg_stats)
+        count('strips')
+
+    if soil is not None and soil_parts:
+        location = os.path.dirname(os.path.realpath(fs.__file__))
+        with phase('lookup'):
+            lookups = fs.read_soil_lookups(location)
+        with phase('compute'):
+            table = fs.soil_cell_table(*_concat_cells(soil_parts), *lookups)
+        fs.write_soil_params(table, soil['output'], *[
+            soil.get(k) for k in ('b_val', 'Ws_val', 'Ds_val', 's2', 's3')])
+    if snow is not None:
+        from format_snow_parameters import snow_band_table, write_snow_params
+        with phase('compute'):
+            table = snow_band_table(cells, snow_zones, interval,
+                                    blocks=snow_blocks)
+        with phase('write'):
+            write_snow_params(table, snow['output'])
+        count_output(snow['output'])
+        print('Number of maximum bands: {0}'.format(table['area'].shape[1]))
+    if veg is not None:
+        with phase('compute'):
+            table = fv.veg_cover_matrix(cells, veg_zones, nclasses,
+                                        veg_stats[0])
+            if monthly:
+                table.update(fv.veg_monthly_values(
+                    table['counts'], veg_stats, monthly, fv.WATER_CLASS[scheme]))
+        with phase('write'):
+            fv.write_veg_params(table, clsAttributes, veg['output'])
+        count_output(veg['output'])
+    count('cells', cells['cellid'].size)
+    return windows
+
+
+if __name__ == '__main__':
+    import argparse
+    from pipeline import build_stages, _run_stage
+    from tiling import _load_config
+    parser = argparse.ArgumentParser(
+        description='Build the soil, snow and veg parameter files of a domain '
+                    'config in a single pass over the template'
+    )
+    parser.add_argument('config', help='domain config JSON file')
+    parser.add_argument('--strip-rows', type=int, default=STRIP_ROWS)
+    args = parser.parse_args()
+    for stage in build_stages(_load_config(args.config), fused=True):
+        if stage.name == 'params':
+            stage.kwargs['strip_rows'] = args.strip_rows
+            _run_stage(stage)
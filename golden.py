@@ -0,0 +1,315 @@
+import os
+import sys
+import copy
+import json
+import pickle
+import shutil
+import tarfile
+import tempfile
+import subprocess
+import numpy as np
+
+# stages whose text outputs are compared, named as their config sections
+PARAM_STAGES = ('soil', 'snow', 'veg', 'veglib', 'forcing')
+
+# column of the cell id of the files whose reference revision may number the
+# cells 1, 2, ... in row major order of the active cells. Snow did before the
+# cell ids were shared (cell_index), all the files use the grid cell id since
+SEQUENTIAL_IDS = {'snow': 0}
+
+# Runs a single stage function from the code in argv[1]. The stage is read as a
+# pickled (module, function, args, kwargs) tuple from stdin, and keywords the
+# function doesn't take (e.g. cache in older revisions) are dropped
+RUNNER = '''
+import sys, pickle, inspect, importlib
+sys.path.insert(0, sys.argv[1])
+import numpy as np
+# the original scripts use the np.float alias removed in numpy 1.24
+if not hasattr(np, 'float'):
+    np.float = float
+module, function, args, kwargs = pickle.load(sys.stdin.buffer)
+func = getattr(importlib.import_module(module), function)
+params = inspect.signature(func).parameters
+func(*args, **{k: v for k, v in kwargs.items() if k in params})
+'''
+
+
+def _token(tok):
+    try:
+        return float(tok)
+    except ValueError:
+        return tok
+
+
+def read_rows(path):
+    '''
+    Reads a whitespace delimited parameter file into a list of token lists.
+    Numeric tokens are converted to float.
+    '''
+    with open(path) as f:
+        return [[_token(t) for t in line.split()] for line in f if line.strip()]
+
+
+def grid_ids(mask):
+    '''
+    Returns the grid cell id of each active cell (mask == 1) of a template
+    raster, in row major order, see cell_index.cell_table.
+    '''
+    from raster_io import read_raster
+    from cell_index import cell_table
+    array, gt = read_raster(mask)[:2]
+    return cell_table(array, gt)['cellid']
+
+
+def renumber_rows(rows, column, ids):
+    '''
+    Replaces the cell ids 1, 2, ... n of a column of the rows with the grid
+    cell ids of the n active cells. Rows numbered otherwise are returned as
+    they are.
+    '''
+    numbers = [row[column] for row in rows]
+    if len(numbers) != len(ids) or numbers != list(range(1, len(ids) + 1)):
+        return rows
+    return [row[:column] + [float(i)] + row[column+1:]
+            for row, i in zip(rows, ids)]
+
+
+def compare_files(ref, new, rtol=1e-6, atol=1e-4, max_report=10, ids=None):
+    '''
+    Compares two parameter files column by column. Numeric columns must agree
+    within rtol and atol (NaN equals NaN), the others must be equal.
+    Parameters
+    ----------
+    ref, new : str
+        reference and candidate files
+    rtol, atol: float
+        relative and absolute tolerance of numeric columns
+    max_report: int
+        maximum number of mismatching lines listed in the result
+    ids: tuple (optional)
+        (column, grid cell ids) to renumber the reference rows with if they
+        number the cells sequentially, see renumber_rows
+    Returns
+    -------
+    dict with the line counts, the max absolute difference and number of
+    mismatches per column, the first mismatching lines and an ok flag
+    '''
+    a = read_rows(ref)
+    b = read_rows(new)
+    if ids is not None:
+        a = renumber_rows(a, *ids)
+    result = {
+        'file': os.path.basename(new), 'lines': [len(a), len(b)],
+        'columns': {}, 'mismatches': [], 'ok': len(a) == len(b),
+    }
+    for n, (ra, rb) in enumerate(zip(a, b)):
+        bad = len(ra) != len(rb)
+        for k, (va, vb) in enumerate(zip(ra, rb)):
+            col = result['columns'].setdefault(k, {'max_abs_diff': 0., 'mismatches': 0})
+            if isinstance(va, float) and isinstance(vb, float):
+                if np.isnan(va) and np.isnan(vb):
+                    continue
+                diff = abs(va - vb)
+                col['max_abs_diff'] = max(col['max_abs_diff'], diff)
+                if not diff <= atol + rtol * abs(va):
+                    col['mismatches'] += 1
+                    bad = True
+            elif va != vb:
+                col['mismatches'] += 1
+                bad = True
+        if bad:
+            result['ok'] = False
+            if len(result['mismatches']) < max_report:
+                result['mismatches'].append({
+                    'line': n + 1,
+                    'reference': ' '.join(map(str, ra)),
+                    'candidate': ' '.join(map(str, rb)),
+                })
+    return result
+
+
+def compare_outputs(ref, new, rtol=1e-6, atol=1e-4, ids=None):
+    '''
+    Compares a reference and candidate output, either two files or two
+    folders (e.g. forcings) whose files are compared by name. Returns a list
+    of compare_files results.
+    '''
+    if not os.path.isdir(ref):
+        return [compare_files(ref, new, rtol, atol, ids=ids)]
+    results = []
+    names = sorted(set(os.listdir(ref)) | set(os.listdir(new)))
+    for name in names:
+        a, b = os.path.join(ref, name), os.path.join(new, name)
+        if not (os.path.exists(a) and os.path.exists(b)):
+            results.append({'file': name, 'ok': False,
+                            'missing': 'candidate' if os.path.exists(a) else 'reference'})
+            continue
+        results.append(compare_files(a, b, rtol, atol))
+    return results
+
+
+def checkout_reference(revision, dst):
+    '''
+    Extracts the scripts of a git revision of this repository into dst.
+    '''
+    repo = os.path.dirname(os.path.abspath(__file__))
+    archive = subprocess.run(
+        ['git', 'archive', '--format=tar', revision], cwd=repo,
+        check=True, stdout=subprocess.PIPE
+    ).stdout
+    with tempfile.TemporaryFile() as f:
+        f.write(archive)
+        f.seek(0)
+        with tarfile.open(fileobj=f) as tar:
+            tar.extractall(dst)
+    return dst
+
+
+def root_revision():
+    '''
+    Returns the first commit of the repository, with the original per-pixel
+    implementations.
+    '''
+    repo = os.path.dirname(os.path.abspath(__file__))
+    out = subprocess.run(
+        ['git', 'rev-list', '--max-parents=0', 'HEAD'], cwd=repo,
+        check=True, stdout=subprocess.PIPE, universal_newlines=True
+    ).stdout
+    return out.split()[-1]
+
+
+def run_stage(stage, code_dir):
+    '''
+    Runs a pipeline stage with the scripts in code_dir, in a new interpreter
+    so reference and candidate modules never mix.
+    '''
+    for out in stage.outputs:
+        folder = out if stage.name == 'forcing' else os.path.dirname(out)
+        os.makedirs(folder, exist_ok=True)
+    payload = pickle.dumps(
+        (stage.module, stage.function, stage.args, stage.kwargs)
+    )
+    subprocess.run(
+        [sys.executable, '-c', RUNNER, code_dir], input=payload, cwd=code_dir,
+        check=True
+    )
+
+
+def _variant(config, name):
+    '''
+    Returns a copy of a domain config writing the parameter files to a
+    subfolder name of the workdir.
+    '''
+    config = copy.deepcopy(config)
+    config.pop('cache', None)
+    for key in PARAM_STAGES:
+        if key in config:
+            config[key]['output'] = os.path.join(name, config[key]['output'])
+    return config
+
+
+def check_equivalence(config, reference=None, stages=PARAM_STAGES, rtol=1e-6,
+                      atol=1e-4):
+    '''
+    Builds the parameter files of a domain with a reference revision of the
+    scripts and with the working tree, and compares them column by column.
+    The GIS inputs (template grid, snapped rasters) are built once with the
+    working tree. Reference snow files numbering the active cells 1, 2, ...
+    (before the grid cell ids were shared) are renumbered to grid cell ids
+    first, so the ids are still compared.
+    Parameters
+    ----------
+    config : dict or str
+        domain config, or the path to its JSON file
+    reference: str (optional)
+        git revision, or folder with a copy of the scripts. Defaults to the
+        first commit of the repository
+    stages: list
+        parameter stages to compare
+    rtol, atol: float
+        tolerance of numeric columns
+    Returns
+    -------
+    dict with the compare results of each stage
+    '''
+    from pipeline import build_stages, dependencies, _topological_order
+    if isinstance(config, str):
+        with open(config) as f:
+            config = json.load(f)
+    here = os.path.dirname(os.path.abspath(__file__))
+    tmp = None
+    if reference is None:
+        reference = root_revision()
+    if os.path.isdir(reference):
+        code_dir = os.path.abspath(reference)
+    else:
+        tmp = tempfile.mkdtemp(prefix='vic-golden-')
+        code_dir = checkout_reference(reference, tmp)
+
+    inputs = {s.name: s for s in build_stages(_variant(config, 'candidate'))}
+    for name in _topological_order(dependencies(list(inputs.values()))):
+        if name not in PARAM_STAGES:
+            run_stage(inputs[name], here)
+
+    results = {}
+    for variant, code in (('reference', code_dir), ('candidate', here)):
+        for stage in build_stages(_variant(config, variant)):
+            if stage.name in stages:
+                print('Running {0} {1}'.format(variant, stage.name))
+                run_stage(stage, code)
+    ref = {s.name: s for s in build_stages(_variant(config, 'reference'))}
+    for name in stages:
+        if name not in inputs:
+            continue
+        ids = None
+        if name in SEQUENTIAL_IDS:
+            # the template grid is the first argument of the stage
+            ids = (SEQUENTIAL_IDS[name], grid_ids(inputs[name].args[0]))
+        results[name] = compare_outputs(
+            ref[name].outputs[0], inputs[name].outputs[0], rtol, atol, ids
+        )
+    if tmp is not None:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Compare the parameter files of the working tree with a '
+                    'reference revision on a synthetic (or given) domain'
+    )
+    parser.add_argument('--config', help='domain config, a synthetic domain '
+                        'is created if not given')
+    parser.add_argument('--reference', help='git revision or folder with the '
+                        'reference scripts, the first commit by default')
+    parser.add_argument('--stages', nargs='+', default=list(PARAM_STAGES))
+    parser.add_argument('--size', default='20x30', help='synthetic domain size')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', help='folder for the synthetic domain')
+    parser.add_argument('--rtol', type=float, default=1e-6)
+    parser.add_argument('--atol', type=float, default=1e-4)
+    parser.add_argument('--output', help='JSON report file')
+    args = parser.parse_args()
+
+    config = args.config
+    if config is None:
+        from synthetic_domain import make_synthetic_domain
+        rows, cols = (int(v) for v in args.size.lower().split('x'))
+        workdir = args.workdir or tempfile.mkdtemp(prefix='vic-golden-domain-')
+        config = make_synthetic_domain(workdir, rows, cols, seed=args.seed)
+    results = check_equivalence(
+        config, args.reference, args.stages, args.rtol, args.atol
+    )
+    failed = False
+    for name, files in results.items():
+        bad = [r for r in files if not r['ok']]
+        failed = failed or bool(bad)
+        print('{0:<10}{1:>6} files{2:>6} mismatching'.format(name, len(files), len(bad)))
+        for r in bad[:5]:
+            print('  {0}: {1}'.format(r['file'], r.get('missing') or r['mismatches'][:1]))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4, default=str)
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,384 @@
+import os
+import numpy as np
+from netCDF4 import Dataset, default_fillvals
+
+from raster_io import read_raster
+from cell_index import cell_table, cell_coordinates
+from instrument import instrumented, phase, count, count_output
+
+# rows of the grid written at once, also the lat and lon chunk size
+CHUNK_ROWS = 256
+CHUNK_COLS = 256
+
+# compression of every variable
+COMPRESSION = {'zlib': True, 'complevel': 4, 'shuffle': True}
+
+# earth radius of VIC, in meters
+R_EARTH = 6.37122e6
+
+MONTHS = 12
+
+
+def cell_positions(cellid, shape):
+    '''
+    Returns the (rows, cols) of grid cell ids, see cell_index.cell_table.
+    '''
+    cellid = np.asarray(cellid, dtype=np.int64) - 1
+    return cellid // shape[1], cellid % shape[1]
+
+
+def create_grid_file(path, gt, shape, dims=None):
+    '''
+    Creates a NetCDF4 file with the lat and lon coordinates of a grid.
+    Parameters
+    ----------
+    path : str
+        output file
+    gt: tuple
+        grid geotransform
+    shape: tuple
+        (rows, cols) of the grid
+    dims: dict (optional)
+        other dimensions of the variables, name to size
+    Returns
+    -------
+    the open netCDF4.Dataset
+    '''
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    nc = Dataset(path, 'w', format='NETCDF4')
+    nc.createDimension('lat', shape[0])
+    nc.createDimension('lon', shape[1])
+    for name, size in (dims or {}).items():
+        nc.createDimension(name, size)
+    lats, lons = cell_coordinates(gt, shape)
+    for name, values, units in (('lat', lats, 'degrees_north'),
+                                ('lon', lons, 'degrees_east')):
+        var = nc.createVariable(name, 'f8', (name,))
+        var.units = units
+        var[:] = values
+    return nc
+
+
+def write_variable(nc, name, values, rows, cols, dims=(), dtype='f8',
+                   units=None):
+    '''
+    Writes a variable of the active cells to a grid file. The grid is filled
+    and written in blocks of CHUNK_ROWS rows, with the cells of each block
+    found by their row, so memory does not grow with the grid.
+    Parameters
+    ----------
+    nc : netCDF4.Dataset
+        file from create_grid_file
+    name: str
+        variable name
+    values: numpy.ndarray
+        (cells, ...) values of each cell, the other axes along dims
+    rows, cols: numpy.ndarray
+        grid position of each cell, sorted by row
+    dims: tuple
+        dimensions of the other axes of values
+    dtype: str
+        NetCDF data type
+    units: str (optional)
+    '''
+    shape = (len(nc.dimensions['lat']), len(nc.dimensions['lon']))
+    extra = values.shape[1:]
+    fill = default_fillvals[dtype]
+    var = nc.createVariable(
+        name, dtype, tuple(dims) + ('lat', 'lon'), fill_value=fill,
+        chunksizes=(1,)*len(extra) + (min(CHUNK_ROWS, shape[0]),
+                                      min(CHUNK_COLS, shape[1])),
+        **COMPRESSION
+    )
+    if units is not None:
+        var.units = units
+    starts = np.searchsorted(rows, np.arange(0, shape[0] + CHUNK_ROWS, CHUNK_ROWS))
+    for k, r0 in enumerate(range(0, shape[0], CHUNK_ROWS)):
+        r1 = min(r0 + CHUNK_ROWS, shape[0])
+        i0, i1 = starts[k], starts[k + 1]
+        block = np.full(extra + (r1 - r0, shape[1]), fill, dtype=dtype)
+        # cells on the last axes, the other dims first
+        block[..., rows[i0:i1] - r0, cols[i0:i1]] = np.moveaxis(values[i0:i1], 0, -1)
+        var[..., r0:r1, :] = block
+    return
+
+
+def soil_variables(table, b_val=None, Ws_val=None, Ds_val=None, s2=None,
+                   s3=None):
+    '''
+    Returns the soil parameters of the image driver from a per-cell soil
+    table (see format_soil_params.soil_cell_table), with the same values as
+    the columns of the soil parameter file.
+    Returns
+    -------
+    dict from the variable name to its (cells, ...) values and dimensions
+    '''
+    from format_soil_params import (soil_calibration, BASEFLOW_C, PHI_S,
+        TOP_DEPTH, AVG_T, DP, SOIL_DEN, ORG_SOIL_DEN, ROUGH, SNOW_ROUGH,
+        FS_ACTIVE)
+    b_val, Ws_val, Ds_val, s2, s3 = soil_calibration(
+        table, b_val, Ws_val, Ds_val, s2, s3)
+    n = table['run'].size
+    full = lambda v: np.full(n, v, dtype=np.float64)
+    # top layer value and the lower layers value of each cell
+    layers = lambda top, low: np.stack(
+        [np.asarray(top, dtype=np.float64)] + [np.asarray(low, dtype=np.float64)]*2,
+        axis=1)
+    constant = lambda v: np.tile(np.asarray(v, dtype=np.float64), (n, 1))
+    init_moist = np.stack([
+        (table['bulk_den'] / SOIL_DEN[0]) * TOP_DEPTH * 1000,
+        (table['bulk_den1'] / SOIL_DEN[1]) * s2 * 1000,
+        (table['bulk_den1'] / SOIL_DEN[1]) * s3 * 1000], axis=1)
+    nlayer = ('nlayer',)
+    return {
+        'run_cell': (table['run'].astype(np.int32), ()),
+        'gridcell': (table['grdc'].astype(np.int32), ()),
+        'lats': (table['lat'], ()),
+        'lons': (table['lon'], ()),
+        'infilt': (full(b_val), ()),
+        'Ds': (full(Ds_val), ()),
+        'Dsmax': (table['Dsmax'], ()),
+        'Ws': (full(Ws_val), ()),
+        'c': (full(BASEFLOW_C), ()),
+        'expt': (layers(table['expt'], table['expt1']), nlayer),
+        'Ksat': (layers(table['tksat'], table['sksat']), nlayer),
+        'phi_s': (constant([PHI_S]*3), nlayer),
+        'init_moist': (init_moist, nlayer),
+        'elev': (table['elev'], ()),
+        'depth': (constant([TOP_DEPTH, s2, s3]), nlayer),
+        'avg_T': (full(AVG_T), ()),
+        'dp': (full(DP), ()),
+        'bubble': (layers(table['tbub'], table['sbub']), nlayer),
+        'quartz': (layers(table['quartz'], table['quartz1']), nlayer),
+        'bulk_density': (layers(table['bulk_den'], table['bulk_den1']), nlayer),
+        'soil_density': (constant([SOIL_DEN[0]] + [SOIL_DEN[1]]*2), nlayer),
+        'organic': (layers(table['t_oc'], table['s_oc']), nlayer),
+        'bulk_dens_org': (layers(0.25*table['bulk_den'], 0.25*table['bulk_den1']),
+                          nlayer),
+        'soil_dens_org': (constant([ORG_SOIL_DEN[0]] + [ORG_SOIL_DEN[1]]*2), nlayer),
+        'off_gmt': (table['off_gmt'], ()),
+        'Wcr_FRACT': (layers(table['wrc_frac'], table['wrc_frac1']), nlayer),
+        'Wpwp_FRACT': (layers(table['wpwp_frac'], table['wpwp_frac1']), nlayer),
+        'rough': (full(ROUGH), ()),
+        'snow_rough': (full(SNOW_ROUGH), ()),
+        'annual_prec': (table['annprecip'], ()),
+        'resid_moist': (layers(table['resid'], table['resid1']), nlayer),
+        'fs_active': (np.full(n, FS_ACTIVE, dtype=np.int32), ()),
+    }
+
+
+def snow_variables(table):
+    '''
+    Returns the snow band parameters of the image driver from a snow band
+    table, see format_snow_parameters.snow_band_table.
+    '''
+    dims = ('snow_band',)
+    return {
+        'AreaFract': (table['area'], dims),
+        'elevation': (table['elevation'], dims),
+        'Pfactor': (table['precip'], dims),
+    }
+
+
+def veg_variables(table, clsAttributes):
+    '''
+    Returns the vegetation parameters of the image driver from a veg cover
+    table (see format_veg_params.veg_cover_matrix) and the class attributes
+    of its scheme. Root zones are given for every class. Monthly LAI and
+    albedo of the table (see format_veg_params.veg_monthly_values) are given
+    for every class too, the classes not in a cell with their mean.
+    '''
+    counts = table['counts']
+    total = counts.sum(axis=1).astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cv = np.where(total[:, None] > 0, counts / total[:, None], 0.)
+    roots = np.array([[[float(c['properties'][k + str(z)]) for z in (1, 2, 3)]
+                       for k in ('rootd', 'rootfr')] for c in clsAttributes])
+    n = counts.shape[0]
+    variables = {
+        'Nveg': ((counts > 0).sum(axis=1).astype(np.int32), ()),
+        'Cv': (cv, ('veg_class',)),
+        'root_depth': (np.broadcast_to(roots[:, 0], (n,) + roots[:, 0].shape),
+                       ('veg_class', 'root_zone')),
+        'root_fract': (np.broadcast_to(roots[:, 1], (n,) + roots[:, 1].shape),
+                       ('veg_class', 'root_zone')),
+    }
+    cell, vegcls = np.nonzero(counts)
+    for k, name in (('lai', 'LAI'), ('albedo', 'albedo')):
+        if k in table:
+            values = np.repeat(table['class_' + k][None], n, axis=0)
+            values[cell, vegcls] = table[k]
+            variables[name] = (values, ('veg_class', 'month'))
+    return variables
+
+
+def veg_lib_variables(table, n):
+    '''
+    Returns the veg library parameters of the image driver for n cells, the
+    values of each class (see make_veg_lib.veg_lib_table) in every cell.
+    '''
+    cls = lambda k, dtype=np.float64: np.broadcast_to(
+        np.asarray(table[k], dtype=dtype), (n, len(table[k])))
+    monthly = lambda v: np.broadcast_to(
+        np.asarray(v, dtype=np.float64), (n, len(v), MONTHS))
+    fixed = lambda k: monthly(np.repeat(np.asarray(table[k], dtype=np.float64)[:, None],
+                                        MONTHS, axis=1))
+    dims = ('veg_class',)
+    return {
+        'overstory': (cls('overstory', np.int32), dims),
+        'rarc': (cls('rarc'), dims),
+        'rmin': (cls('rmin'), dims),
+        'wind_h': (cls('wind_h'), dims),
+        'RGL': (cls('rgl'), dims),
+        'rad_atten': (cls('rad_atten'), dims),
+        'wind_atten': (cls('wind_atten'), dims),
+        'trunk_ratio': (cls('trunk_ratio'), dims),
+        'LAI': (monthly(table['lai']), dims + ('month',)),
+        'albedo': (monthly(table['albedo']), dims + ('month',)),
+        'veg_rough': (fixed('rough'), dims + ('month',)),
+        'displacement': (fixed('displacement'), dims + ('month',)),
+    }
+
+
+def write_grid_file(path, gt, shape, sections):
+    '''
+    Writes variables of the active cells to a NetCDF4 grid file, with the
+    dimensions sized from the values.
+    Parameters
+    ----------
+    path : str
+        output file
+    gt: tuple
+        grid geotransform
+    shape: tuple
+        (rows, cols) of the grid
+    sections: list
+        (cellid, variables) of each group of variables, with the grid cell
+        ids of the cells of the values and the variables e.g. from
+        soil_variables
+    '''
+    dims = {}
+    for _, variables in sections:
+        for values, vdims in variables.values():
+            dims.update(zip(vdims, values.shape[1:]))
+    nc = create_grid_file(path, gt, shape, dims)
+    try:
+        for cellid, variables in sections:
+            rows, cols = cell_positions(cellid, shape)
+            for name, (values, vdims) in variables.items():
+                dtype = 'i4' if np.issubdtype(values.dtype, np.integer) else 'f8'
+                write_variable(nc, name, values, rows, cols, vdims, dtype)
+    finally:
+        nc.close()
+    return
+
+
+def write_domain(path, mask, gt):
+    '''
+    Writes the image driver domain file of a template grid: the active cell
+    mask, the area of each cell in m2 and the fraction of it in the domain.
+    Parameters
+    ----------
+    path : str
+        output domain file
+    mask: numpy.ndarray
+        template grid array
+    gt: tuple
+        template grid geotransform
+    '''
+    shape = mask.shape
+    cellid = np.arange(1, shape[0]*shape[1] + 1)
+    rows = cell_positions(cellid, shape)[0]
+    # area of each row, between the latitudes of its edges
+    edges = np.radians(gt[3] + np.arange(shape[0] + 1)*gt[5])
+    area = R_EARTH**2 * np.radians(abs(gt[1])) * np.abs(np.diff(np.sin(edges)))
+    active = (mask == 1).reshape(-1)
+    write_grid_file(path, gt, shape, [(cellid, {
+        'mask': (active.astype(np.int32), ()),
+        'area': (area[rows], ()),
+        'frac': (active.astype(np.float64), ()),
+    })])
+    return
+
+
+@instrumented('image')
+def format_image_params(basinMask, outParams, outDomain=None, soil=None,
+                        snow=None, veg=None, veglib=None, cache=None):
+    '''
+    Writes the VIC 5 image driver parameter file (params.nc) and domain file
+    (domain.nc) of a template, from the same inputs and with the same values
+    as the soil, snow, veg parameter and veg library files. Sections that are
+    not given are not written.
+    Parameters
+    ----------
+    basinMask : str, gdal.Dataset or tuple
+        template raster
+    outParams: str
+        output parameter file
+    outDomain: str (optional)
+        output domain file
+    soil: dict (optional)
+        'hwsd', 'elevation', 'precip' and 'slope' rasters snapped to the
+        template, and the calibration keywords of format_soil_params
+        ('b_val', 'Ws_val', 'Ds_val', 's2', 's3') if set
+    snow: dict (optional)
+        'elevation' hi res raster and band 'interval', and the 'precip'
+        climatology if set, see format_snow_params
+    veg: dict (optional)
+        'landcover' raster and classification 'scheme', and the 'lai' and
+        'albedo' folders of monthly rasters if set, see format_veg_params
+    veglib: dict (optional)
+        'landcover' raster, 'lai' and 'albedo' folders and classification
+        'scheme', see make_veg_lib
+    cache: artifact_cache.ArtifactCache (optional)
+        cache of the soil, snow and veg tables, shared with the formatters
+    '''
+    with phase('read'):
+        mask, gt, _ = read_raster(basinMask)
+        cells = cell_table(mask, gt)
+    shape = mask.shape
+    sections = []
+
+    if soil is not None:
+        import format_soil_params as fs
+        location = os.path.dirname(os.path.realpath(fs.__file__))
+        infiles = [basinMask] + [soil[k] for k in ('hwsd', 'elevation', 'precip', 'slope')]
+        table = fs.get_soil_table(infiles, location, cache)
+        sections.append((table['grdc'], soil_variables(table, *[
+            soil.get(k) for k in ('b_val', 'Ws_val', 'Ds_val', 's2', 's3')])))
+    if snow is not None:
+        from format_snow_parameters import get_snow_table
+        table = get_snow_table([basinMask, snow['elevation']], snow['interval'],
+                               cache, precip=snow.get('precip'))
+        sections.append((table['cellid'], snow_variables(table)))
+    if veg is not None:
+        import format_veg_params as fv
+        scheme = veg.get('scheme', 'IGBP')
+        attriFile, clsAttributes = fv.veg_class_attributes(scheme)
+        table = fv.get_veg_table(
+            [basinMask, veg['landcover']], attriFile, len(clsAttributes), cache,
+            monthly=fv.monthly_rasters(veg.get('lai'), veg.get('albedo')),
+            waterCls=fv.WATER_CLASS[scheme])
+        sections.append((table['cellid'], veg_variables(table, clsAttributes)))
+    if veglib is not None:
+        from make_veg_lib import veg_lib_table
+        table = veg_lib_table(veglib['landcover'], veglib['lai'],
+                              veglib['albedo'], veglib.get('scheme', 'IGBP'))
+        variables = veg_lib_variables(table, cells['cellid'].size)
+        # the per-cell monthly values of the veg section replace the ones of
+        # each class
+        for _, written in sections:
+            for k in ('LAI', 'albedo'):
+                if k in written:
+                    variables.pop(k)
+        sections.append((cells['cellid'], variables))
+
+    with phase('write'):
+        write_grid_file(outParams, gt, shape, sections)
+        count_output(outParams)
+        if outDomain is not None:
+            write_domain(outDomain, mask, gt)
+            count_output(outDomain)
+    count('cells', cells['cellid'].size)
+    return
@@ -0,0 +1,223 @@
+import os
+import re
+import json
+import numpy as np
+
+from cell_index import cell_table
+from tiling import (TILED_STAGES, OUTPUT_ARG, read_param_records,
+                    write_param_records)
+
+# position of the grid cell id among the whitespace separated fields of the
+# first line of a cell
+ID_FIELD = {'soil': 1, 'snow': 0, 'veg': 0}
+
+
+def grid_offset(old_gt, new_gt):
+    '''
+    Returns the (rows, cols) position of the first cell of a grid in another
+    grid with the same cell size. Grids from create_grid are aligned to
+    multiples of the cell size, so changing the basin extent only shifts
+    them by whole cells.
+    '''
+    if not (np.isclose(old_gt[1], new_gt[1]) and np.isclose(old_gt[5], new_gt[5])):
+        raise ValueError('The old and new masks have different cell sizes')
+    offset = np.array([(old_gt[3] - new_gt[3]) / new_gt[5],
+                       (old_gt[0] - new_gt[0]) / new_gt[1]])
+    if not np.allclose(offset, np.round(offset), atol=1e-6):
+        raise ValueError('The old and new masks are not aligned')
+    return tuple(int(v) for v in np.round(offset))
+
+
+def mask_changes(old_mask, new_mask):
+    '''
+    Compares the active cells of the template grid before and after a change
+    of the basin, e.g. when create_grid is run again with a new boundary.
+    Parameters
+    ----------
+    old_mask, new_mask : str, gdal.Dataset or tuple
+        old and new template rasters, see raster_io.read_raster. The grids
+        can have different extents but the same aligned cells
+    Returns
+    -------
+    dict with the boolean array of the cells of the new grid that were not
+    active ('added'), the cells of the old grid that are not active anymore
+    ('removed', see cell_index.cell_table), the grid cell ids of the cells
+    active in both in the old ('old_ids') and new ('new_ids') grid, and the
+    geotransform of the new grid ('gt')
+    '''
+    # imported here, splice_param_file doesn't need GDAL
+    from raster_io import read_raster
+    old, old_gt = read_raster(old_mask)[:2]
+    new, new_gt = read_raster(new_mask)[:2]
+    drow, dcol = grid_offset(old_gt, new_gt)
+    old_cells = cell_table(old, old_gt)
+
+    # position of the old active cells in the new grid
+    rows = old_cells['row'] + drow
+    cols = old_cells['col'] + dcol
+    inside = (rows >= 0) & (rows < new.shape[0]) & (cols >= 0) & (cols < new.shape[1])
+    kept = inside.copy()
+    kept[inside] = new[rows[inside], cols[inside]] == 1
+
+    covered = np.zeros(new.shape, dtype=bool)
+    covered[rows[kept], cols[kept]] = True
+    added = (new == 1) & ~covered
+    return {
+        'added': added,
+        'removed': {k: v if k == 'shape' else v[~kept]
+                    for k, v in old_cells.items()},
+        'old_ids': old_cells['cellid'][kept],
+        'new_ids': rows[kept]*new.shape[1] + cols[kept] + 1,
+        'gt': new_gt,
+    }
+
+
+def _set_field(text, k, value):
+    # replaces the k-th whitespace separated field of the text, keeping the
+    # separators
+    parts = re.split(r'(\s+)', text, maxsplit=k + 1)
+    parts[2*k] = value
+    return ''.join(parts)
+
+
+def soil_file_defaults(path):
+    '''
+    Returns the b_val, Ds_val and Ws_val written to the lines of a soil
+    parameter file, the same in every line, or an empty dict if it has none.
+    The cells added to the file get them too, so it never mixes the defaults
+    of two first cells.
+    '''
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        fields = f.readline().split()
+    if not fields:
+        return {}
+    # run, gridcel, lat, lon, infilt, Ds, Dsmax, Ws
+    return {'b_val': float(fields[4]), 'Ds_val': float(fields[5]),
+            'Ws_val': float(fields[7])}
+
+
+def splice_param_file(output, part, changes, kind):
+    '''
+    Updates a parameter file of the old grid to the new one: the cells
+    removed are dropped, the cells kept are renumbered to their new grid cell
+    id if the grid extent changed and the cells of part, the file with only
+    the added cells, are inserted. Cells stay in grid cell id order and snow
+    lines are padded again to the new maximum number of bands.
+    Parameters
+    ----------
+    output : str
+        parameter file of the old grid, overwritten
+    part: str or None
+        parameter file of the added cells
+    changes: dict
+        see mask_changes
+    kind: str
+        'soil', 'snow' or 'veg'
+    Returns
+    -------
+    number of cells written
+    '''
+    new_id = dict(zip(changes['old_ids'].tolist(), changes['new_ids'].tolist()))
+    records = []
+    for cellid, text in read_param_records(output, kind):
+        if cellid not in new_id:
+            continue
+        if new_id[cellid] != cellid:
+            text = _set_field(text, ID_FIELD[kind], str(new_id[cellid]))
+        records.append((new_id[cellid], text))
+    if part is not None:
+        records += read_param_records(part, kind)
+    return write_param_records(records, output, kind)
+
+
+def update_domain(config, old_mask, stages=TILED_STAGES):
+    '''
+    Updates the soil, snow, veg and forcing files of a domain after its
+    template grid changed, instead of building them again for all the cells.
+    Only the added cells are computed, from a mask with just them, and
+    spliced into the existing files with splice_param_file. The forcing files
+    of the removed cells are deleted.
+    Parameters
+    ----------
+    config : str or dict
+        path to a domain config JSON file, or the loaded config. Its mask is
+        the new template grid
+    old_mask: str
+        copy of the template grid the existing files were built from
+    stages: list
+        stages to update
+    Returns
+    -------
+    dict from mask_changes
+    '''
+    from pipeline import build_stages, _run_stage
+    if isinstance(config, str):
+        with open(config) as f:
+            config = json.load(f)
+    mask = os.path.join(config.get('workdir', '.'), config['mask'])
+    changes = mask_changes(old_mask, mask)
+    nadded = int(changes['added'].sum())
+    print('Cells added: {0}, removed: {1}, kept: {2}'.format(
+        nadded, changes['removed']['cellid'].size, changes['old_ids'].size))
+    # the formatters take in-memory rasters, the added cells are the only
+    # active cells of this one
+    added_mask = (changes['added'].astype(np.uint8), changes['gt'])
+
+    for stage in build_stages(config, fused=False):
+        if stage.name not in stages or stage.name not in TILED_STAGES:
+            continue
+        args = list(stage.args)
+        kwargs = dict(stage.kwargs)
+        if stage.name == 'soil':
+            # the parameters taken from the first cell when they are not set
+            # are the ones the kept cells were written with, the first cell of
+            # the old domain. A new file takes the first cell of the new one
+            defaults = soil_file_defaults(args[OUTPUT_ARG['soil']])
+            if not defaults:
+                from format_soil_params import soil_defaults
+                defaults = soil_defaults(*args[:3])
+            kwargs = dict(defaults, **kwargs)
+        args[0] = added_mask
+
+        if stage.name == 'forcing':
+            from format_meteo_forcing import forcing_path
+            removed = changes['removed']
+            for x, y in zip(removed['lon'], removed['lat']):
+                path = forcing_path(args[2], x, y)
+                if os.path.exists(path):
+                    os.remove(path)
+            if nadded:
+                if 'qa' in kwargs:
+                    # QA of the forcings of the added cells only
+                    kwargs['qa'] = kwargs['qa'] + '.added'
+                _run_stage(stage._replace(args=tuple(args), kwargs=kwargs))
+            continue
+
+        output = args[OUTPUT_ARG[stage.name]]
+        part = None
+        if nadded:
+            part = output + '.added'
+            args[OUTPUT_ARG[stage.name]] = part
+            _run_stage(stage._replace(args=tuple(args), kwargs=kwargs,
+                                      outputs=[part]))
+        n = splice_param_file(output, part, changes, stage.name)
+        if part is not None:
+            os.remove(part)
+        print('Updated {0}, {1} cells'.format(output, n))
+    return changes
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Update the soil, snow, veg and forcing files of a domain '
+                    'after its template grid changed, computing only the '
+                    'added cells'
+    )
+    parser.add_argument('config', help='domain config JSON file, with the new mask')
+    parser.add_argument('old_mask', help='template grid the files were built from')
+    parser.add_argument('--stages', nargs='+', default=list(TILED_STAGES))
+    args = parser.parse_args()
+    update_domain(args.config, args.old_mask, args.stages)
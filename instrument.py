@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import logging
+import functools
+from contextlib import contextmanager
+from datetime import datetime
+
+# Stage records are logged as JSON strings on this logger. They are also
+# appended as JSON lines to the file in $VIC_SCRIPTS_LOG if it is set
+logger = logging.getLogger('vic_scripts')
+
+# Callables called with (event, record) on 'stage_start', 'phase_end' and
+# 'stage_end', e.g. to report progress from a GUI or a workflow manager
+HOOKS = []
+
+# recorders of the stages running in this process, innermost last
+_STACK = []
+
+
+class Recorder(object):
+    '''
+    Per-phase wall times and counters (cells, bytes_read, bytes_written,
+    files_opened, ...) of a running stage.
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.phases = {}
+        self.counters = {}
+        self.start = time.perf_counter()
+        self.started = datetime.now().isoformat(timespec='seconds')
+
+    def record(self):
+        return {
+            'stage': self.name,
+            'started': self.started,
+            'pid': os.getpid(),
+            'wall_s': round(time.perf_counter() - self.start, 6),
+            'phases': {k: round(v, 6) for k, v in self.phases.items()},
+            'counters': dict(self.counters),
+        }
+
+
+def current():
+    '''
+    Returns the recorder of the innermost running stage, or None.
+    '''
+    return _STACK[-1] if _STACK else None
+
+
+def _emit(event, rec):
+    record = rec.record()
+    for hook in HOOKS:
+        hook(event, record)
+    return record
+
+
+@contextmanager
+def phase(name):
+    '''
+    Times a phase (read, lookup, compute, format, write, ...) of the running
+    stage. Nothing is recorded outside of a stage.
+    '''
+    rec = current()
+    if rec is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        rec.phases[name] = rec.phases.get(name, 0.) + time.perf_counter() - t0
+        if HOOKS:
+            _emit('phase_end', rec)
+
+
+def count(name, n=1):
+    '''
+    Adds n to a counter of the running stage.
+    '''
+    rec = current()
+    if rec is not None:
+        rec.counters[name] = rec.counters.get(name, 0) + int(n)
+
+
+def count_output(path):
+    '''
+    Counts a file written by the running stage and its size.
+    '''
+    if current() is not None and os.path.isfile(path):
+        count('files_written')
+        count('bytes_written', os.path.getsize(path))
+
+
+def _profile_stages():
+    names = os.environ.get('VIC_SCRIPTS_PROFILE', '')
+    return [n.strip() for n in names.split(',') if n.strip()]
+
+
+@contextmanager
+def stage(name, log=None, profile=None):
+    '''
+    Records the phases and counters of a stage and emits them as a JSON
+    record when it finishes.
+    Parameters
+    ----------
+    name : str
+        stage name (soil, snow, veg, veglib, forcing, ...)
+    log: str (optional)
+        JSON lines file the record is appended to, $VIC_SCRIPTS_LOG by default
+    profile: str (optional)
+        cProfile output file (pstats format, e.g. for snakeviz). By default the
+        stages listed in $VIC_SCRIPTS_PROFILE (comma separated) are profiled
+        to <name>.prof in $VIC_SCRIPTS_PROFILE_DIR or the working directory
+    '''
+    if profile is None and name in _profile_stages():
+        profile = os.path.join(
+            os.environ.get('VIC_SCRIPTS_PROFILE_DIR', '.'), '{0}.prof'.format(name)
+        )
+    prof = None
+    if profile is not None:
+        import cProfile
+        prof = cProfile.Profile()
+
+    rec = Recorder(name)
+    _STACK.append(rec)
+    if HOOKS:
+        _emit('stage_start', rec)
+    if prof is not None:
+        prof.enable()
+    try:
+        yield rec
+    finally:
+        if prof is not None:
+            prof.disable()
+            prof.dump_stats(profile)
+        _STACK.remove(rec)
+        record = _emit('stage_end', rec)
+        line = json.dumps(record)
+        logger.info(line)
+        log = log or os.environ.get('VIC_SCRIPTS_LOG')
+        if log:
+            with open(log, 'a') as f:
+                f.write(line + '\n')
+
+
+def instrumented(name):
+    '''
+    Decorator running a function as an instrumented stage.
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
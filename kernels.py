@@ -0,0 +1,159 @@
+import os
+import numpy as np
+
+# The per-cell kernels of the formatters have a NumPy version and, when numba
+# is installed (pip install vic-scripts[fast]), a compiled one that runs over
+# the cells in parallel. Both give the same values. Set VIC_SCRIPTS_NUMBA=0
+# to use the NumPy ones with numba installed
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+USE_NUMBA = njit is not None and os.environ.get('VIC_SCRIPTS_NUMBA', '1') != '0'
+
+
+def _snow_band_classes_numpy(inv, elv, ncells, interval):
+    valid = ~np.isnan(elv)
+
+    # find min and max values for interval
+    elvint = np.zeros(elv.shape, dtype=np.int64)
+    elvint[valid] = elv[valid].astype(np.int64)
+    minelv = np.full(ncells, np.iinfo(np.int64).max)
+    maxelv = np.full(ncells, np.iinfo(np.int64).min)
+    np.minimum.at(minelv, inv[valid], elvint[valid])
+    np.maximum.at(maxelv, inv[valid], elvint[valid])
+    empty = np.bincount(inv[valid], minlength=ncells) == 0
+    minelv[empty] = 0
+    maxelv[empty] = 0
+    minelv = minelv - (minelv%interval)
+    maxelv = maxelv + (maxelv%interval)
+
+    # number of band limits, the size of np.arange(minelv, maxelv+interval,
+    # interval)
+    nlimits = -((minelv - maxelv - interval) // interval)
+
+    # get the band of each hi res pixel, -1 if it is not in a band
+    low = minelv[inv]
+    bcls = np.full(elv.shape, -1, dtype=np.int64)
+    b = np.floor((elv[valid] - low[valid]) / interval).astype(np.int64)
+    b[elv[valid] < low[valid] + b*interval] -= 1
+    b[elv[valid] >= low[valid] + (b+1)*interval] += 1
+    inband = (b >= 0) & (b < nlimits[inv][valid] - 1)
+    bcls[np.nonzero(valid)[0][inband]] = b[inband]
+    return nlimits, bcls
+
+
+def _modal_fill_numpy(hist, nclasses):
+    counts = hist[:, :nclasses].copy()
+    data = hist[:, :nclasses-1]
+    modal = np.where(data.sum(axis=1) > 0, data.argmax(axis=1), 0)
+    counts[np.arange(counts.shape[0]), modal] += hist[:, nclasses]
+    return counts
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _group(inv, ncells):
+        # pixels of each cell, counting sort of the pixel cells
+        starts = np.zeros(ncells + 1, dtype=np.int64)
+        for p in range(inv.size):
+            starts[inv[p] + 1] += 1
+        for c in range(ncells):
+            starts[c + 1] += starts[c]
+        fill = starts[:-1].copy()
+        order = np.empty(inv.size, dtype=np.int64)
+        for p in range(inv.size):
+            order[fill[inv[p]]] = p
+            fill[inv[p]] += 1
+        return order, starts
+
+    @njit(parallel=True, cache=True)
+    def _snow_band_classes_numba(inv, elv, ncells, interval):
+        order, starts = _group(inv, ncells)
+        nlimits = np.empty(ncells, dtype=np.int64)
+        bcls = np.full(elv.size, -1, dtype=np.int64)
+        for c in prange(ncells):
+            # band limits from the cell min and max integer elevations
+            minelv = np.iinfo(np.int64).max
+            maxelv = np.iinfo(np.int64).min
+            for k in range(starts[c], starts[c + 1]):
+                e = elv[order[k]]
+                if not np.isnan(e):
+                    minelv = min(minelv, np.int64(e))
+                    maxelv = max(maxelv, np.int64(e))
+            if minelv > maxelv:
+                minelv = 0
+                maxelv = 0
+            minelv = minelv - (minelv % interval)
+            maxelv = maxelv + (maxelv % interval)
+            nlimits[c] = -((minelv - maxelv - interval) // interval)
+
+            # band of each pixel of the cell
+            for k in range(starts[c], starts[c + 1]):
+                p = order[k]
+                e = elv[p]
+                if np.isnan(e):
+                    continue
+                b = np.int64(np.floor((e - minelv) / interval))
+                if e < minelv + b*interval:
+                    b -= 1
+                if e >= minelv + (b + 1)*interval:
+                    b += 1
+                if b >= 0 and b < nlimits[c] - 1:
+                    bcls[p] = b
+        return nlimits, bcls
+
+    @njit(parallel=True, cache=True)
+    def _modal_fill_numba(hist, nclasses):
+        counts = np.empty((hist.shape[0], nclasses), dtype=hist.dtype)
+        for c in prange(hist.shape[0]):
+            modal = 0
+            for k in range(nclasses):
+                counts[c, k] = hist[c, k]
+                if k < nclasses - 1 and hist[c, k] > hist[c, modal]:
+                    modal = k
+            counts[c, modal] += hist[c, nclasses]
+        return counts
+
+
+def snow_band_classes(inv, elv, ncells, interval):
+    '''
+    Finds the elevation bands of the hi res pixels of a block of cells. The
+    band limits of a cell start at its minimum integer elevation rounded
+    down to the interval and end at its maximum integer elevation plus its
+    modulo of the interval, as the loop over each cell did.
+    Parameters
+    ----------
+    inv : numpy.ndarray
+        cell (0 to ncells - 1) of each pixel
+    elv: numpy.ndarray
+        float64 elevation of each pixel, NaN where masked
+    ncells: int
+        number of cells of the block
+    interval: int
+        vertical distance of the bands, both kernels use it as an int like
+        the formatters do
+    Returns
+    -------
+    (nlimits, bcls) with the number of band limits of each cell and the band
+    of each pixel, -1 if it is not in a band
+    '''
+    interval = int(interval)
+    if USE_NUMBA:
+        return _snow_band_classes_numba(np.ascontiguousarray(inv, dtype=np.int64),
+                                        np.ascontiguousarray(elv, dtype=np.float64),
+                                        ncells, interval)
+    return _snow_band_classes_numpy(inv, elv, ncells, interval)
+
+
+def modal_fill(hist, nclasses):
+    '''
+    Returns the (cells, nclasses) class counts of a (cells, nclasses+1)
+    histogram whose last column counts no data pixels. They are added to the
+    modal class of the data pixels among the first nclasses-1 classes (the
+    first one on ties), or to class 0 if there are none.
+    '''
+    if USE_NUMBA:
+        return _modal_fill_numba(np.ascontiguousarray(hist), nclasses)
+    return _modal_fill_numpy(hist, nclasses)
@@ -8,11 +8,25 @@ from osgeo import gdal
 from osgeo.gdalnumeric import *
 from osgeo.gdalconst import *
 from scipy import ndimage
+from instrument import instrumented, phase, count, count_output
+from param_writer import write_lines
 
 # set system to ignore simple warnings
 warnings.simplefilter("ignore")
 
-def make_veg_lib(LCFile, LAIFolder, ALBFolder, outVeg, scheme='IGBP'):
+def veg_lib_table(LCFile, LAIFolder, ALBFolder, scheme='IGBP'):
+    """
+    FUNCTION: veg_lib_table
+    ARGUMENTS: LCFile - land cover raster
+               LAIFolder, ALBFolder - folders with the monthly LAI and
+                                      albedo rasters (0.tif to 11.tif)
+    KEYWORDS: scheme - Abbreviation of land cover classification scheme
+    RETURNS: dictionary with the (classes, 12) monthly LAI ('lai') and
+             albedo ('albedo') arrays, a list per veg library attribute with
+             the value of each class, and the number of land cover pixels
+             read ('pixels')
+    NOTES: n/a
+    """
 
     # define script file path for relative path definitions
     __location__ = os.path.realpath(
@@ -47,6 +61,8 @@ def make_veg_lib(LCFile, LAIFolder, ALBFolder, outVeg, scheme='IGBP'):
     clsRes = ds.GetGeoTransform()[1]
     ds = None
     b1 = None
+    count('files_opened')
+    count('bytes_read', lccls.nbytes)
 
     # get list of paths to LAI and albedo data
     # laifiles = sorted(glob.glob(os.path.join(__location__, LAIFolder, '*.tif')))
@@ -54,58 +70,56 @@ def make_veg_lib(LCFile, LAIFolder, ALBFolder, outVeg, scheme='IGBP'):
     laifiles = [os.path.join(LAIFolder, f'{i}.tif') for i in range(12)]
     albfiles = [os.path.join(ALBFolder, f'{i}.tif') for i in range(12)]
     # loop over each month in the year
-    for i in range(12):
-        # read LAI data
-        laids = gdal.Open(laifiles[i], GA_ReadOnly)
-        b1 = laids.GetRasterBand(band)
-        lsRes = laids.GetGeoTransform()[1] # geotransform of land surface data
-
-        zoomFactor = lsRes / clsRes # factor for resampling land surface data
-
-        # resample LAI land surface data
-        laidata = ndimage.zoom(BandReadAsArray(b1), zoomFactor, order=0)
-
-        min_height = min(laidata.shape[0], lccls.shape[0])
-        min_width = min(laidata.shape[1], lccls.shape[1])
-        laidata = laidata[:min_height, :min_width]
-        lccls = lccls[:min_height, :min_width]
-        # if first iteration then create blank arrays to pass data to
-        if i == 0:
-            laiMon = np.zeros([laidata.shape[0],laidata.shape[1],12])
-            albMon = np.zeros([laidata.shape[0],laidata.shape[1],12])
-
-        laiMon[:,:,i] = laidata[:,:] # pass lai data in array
-
-        # Flush
-        laids = None
-        b1 = None
-
-        # read albedo data
-        albds = gdal.Open(albfiles[i],GA_ReadOnly)
-        b1 = albds.GetRasterBand(band)
-
-        # resmaple albedo land surface data
-        albdata = ndimage.zoom(BandReadAsArray(b1),zoomFactor,order=0)
-        albdata = albdata[:min_height, :min_width]
-        albMon[:,:,i] = albdata[:,:] # pass albedo data in array
-
-        # Flush
-        albds = None
-        b1 = None
-
+    with phase('read'):
+        for i in range(12):
+            # read LAI data
+            laids = gdal.Open(laifiles[i], GA_ReadOnly)
+            b1 = laids.GetRasterBand(band)
+            lsRes = laids.GetGeoTransform()[1] # geotransform of land surface data
+
+            zoomFactor = lsRes / clsRes # factor for resampling land surface data
+
+            # resample LAI land surface data
+            laidata = ndimage.zoom(BandReadAsArray(b1), zoomFactor, order=0)
+
+            # min is numpy's here, from the gdalnumeric star import
+            min_height, min_width = np.minimum(laidata.shape, lccls.shape)
+            laidata = laidata[:min_height, :min_width]
+            lccls = lccls[:min_height, :min_width]
+            # if first iteration then create blank arrays to pass data to
+            if i == 0:
+                laiMon = np.zeros([laidata.shape[0],laidata.shape[1],12])
+                albMon = np.zeros([laidata.shape[0],laidata.shape[1],12])
+
+            laiMon[:,:,i] = laidata[:,:] # pass lai data in array
+
+            # Flush
+            laids = None
+            b1 = None
+
+            # read albedo data
+            albds = gdal.Open(albfiles[i],GA_ReadOnly)
+            b1 = albds.GetRasterBand(band)
+
+            # resmaple albedo land surface data
+            albdata = ndimage.zoom(BandReadAsArray(b1),zoomFactor,order=0)
+            albdata = albdata[:min_height, :min_width]
+            albMon[:,:,i] = albdata[:,:] # pass albedo data in array
+
+            # Flush
+            albds = None
+            b1 = None
+            count('files_opened', 2)
+            count('bytes_read', laidata.nbytes + albdata.nbytes)
 
     # mask nodata values
     # albMon[np.where(albMon>=1000)] = np.nan
 
-    # get file path to output file
-    veglib = os.path.join(__location__,outVeg)
-
-    # check if the output parameter file exists, if so delete it
-    if os.path.exists(veglib)==True:
-        os.remove(veglib)
-
-    # open output file for writing
-    with open(veglib, 'w') as f:
+    # attributes of each class
+    table = {k: [] for k in ('lai','albedo','overstory','rarc','rmin','rough',
+                             'displacement','wind_h','rgl','rad_atten',
+                             'wind_atten','trunk_ratio','classname')}
+    with phase('compute'):
         # loop over each class
         for i in range(len(clsAttributes)):
 
@@ -154,23 +168,58 @@ def make_veg_lib(LCFile, LAIFolder, ALBFolder, outVeg, scheme='IGBP'):
 
             comment = str(attributes['classname']) # grab class name
 
-            if i == 0: # write header information
-                f.write('#Class\tOvrStry\tRarc\tRmin\tJAN-LAI\tFEB-LAI\tMAR-LAI\tAPR-LAI\tMAY-LAI\tJUN-LAI\tJUL-LAI\tAUG-LAI\tSEP-LAI\tOCT-LAI\tNOV-LAI\tDEC-LAI\tJAN-ALB\tFEB_ALB\tMAR-ALB\tAPR-ALB\tMAY-ALB\tJUN-ALB\tJUL-ALB\tAUG-ALB\tSEP-ALB\tOCT-ALB\tNOV-ALB\tDEC-ALB\tJAN-ROU\tFEB-ROU\tMAR-ROU\tAPR-ROU\tMAY-ROU\tJUN-ROU\tJUL-ROU\tAUG-ROU\tSEP-ROU\tOCT-ROU\tNOV-ROU\tDEC-ROU\tJAN-DIS\tFEB-DIS\tMAR-DIS\tAPR-DIS\tMAY-DIS\tJUN-DIS\tJUL-DIS\tAUG-DIS\tSEP-DIS\tOCT-DIS\tNOV-DIS\tDEC-DIS\tWIND_H\tRGL\trad_atten\twind_atten\ttruck_ratio\tCOMMENT\n')
+            for k, v in (('lai',lai),('albedo',alb),('overstory',overstory),
+                         ('rarc',rarc),('rmin',rmin),('rough',rough),
+                         ('displacement',dis),('wind_h',wind_h),('rgl',rgl),
+                         ('rad_atten',rad_atten),('wind_atten',wind_atten),
+                         ('trunk_ratio',trunk_ratio),('classname',comment)):
+                table[k].append(v)
 
-            # write the land surface parameterization data
-            f.write('{0}\t{1}\t{2}\t{3}\t{4:.4f}\t{5:.4f}\t{6:.4f}\t{7:.4f}\t{8:.4f}\t{9:.4f}\t{10:.4f}\t{11:.4f}\t{12:.4f}\t{13:.4f}\t{14:.4f}\t{15:.4f}\t{16:.4f}\t{17:.4f}\t{18:.4f}\t{19:.4f}\t{20:.4f}\t{21:.4f}\t{22:.4f}\t{23:.4f}\t{24:.4f}\t{25:.4f}\t{26:.4f}\t{27:.4f}\t{28}\t{28}\t{28}\t{28}\t{28}\t{28}\t{28}\t{28}\t{28}\t{28}\t{28}\t{28}\t{29}\t{29}\t{29}\t{29}\t{29}\t{29}\t{29}\t{29}\t{29}\t{29}\t{29}\t{29}\t{30}\t{31}\t{32}\t{33}\t{34}\t{35}\n'.format(i,
-                    overstory,rarc,rmin,lai[0],lai[1],lai[2],lai[3],lai[4],lai[5],lai[6],lai[7],lai[8],lai[9],lai[10],lai[11],alb[0],alb[1],alb[2],alb[3],alb[4],alb[5],alb[6],alb[7],alb[8],alb[9],alb[10],alb[11],rough,dis,wind_h,rgl,rad_atten,wind_atten,trunk_ratio,comment))
+    table['lai'] = np.array(table['lai'], dtype=np.float64)
+    table['albedo'] = np.array(table['albedo'], dtype=np.float64)
+    table['pixels'] = lccls.size
+    return table
 
+@instrumented('veglib')
+def make_veg_lib(LCFile, LAIFolder, ALBFolder, outVeg, scheme='IGBP'):
+
+    # define script file path for relative path definitions
+    __location__ = os.path.realpath(
+        os.path.join(os.getcwd(), os.path.dirname(__file__))
+    )
+
+    table = veg_lib_table(LCFile, LAIFolder, ALBFolder, scheme)
+
+    # get file path to output file
+    veglib = os.path.join(__location__,outVeg)
+
+    # check if the output parameter file exists, if so delete it
+    if os.path.exists(veglib)==True:
+        os.remove(veglib)
+
+    # text of each line of the output file
+    lines = ['#Class\tOvrStry\tRarc\tRmin\tJAN-LAI\tFEB-LAI\tMAR-LAI\tAPR-LAI\tMAY-LAI\tJUN-LAI\tJUL-LAI\tAUG-LAI\tSEP-LAI\tOCT-LAI\tNOV-LAI\tDEC-LAI\tJAN-ALB\tFEB_ALB\tMAR-ALB\tAPR-ALB\tMAY-ALB\tJUN-ALB\tJUL-ALB\tAUG-ALB\tSEP-ALB\tOCT-ALB\tNOV-ALB\tDEC-ALB\tJAN-ROU\tFEB-ROU\tMAR-ROU\tAPR-ROU\tMAY-ROU\tJUN-ROU\tJUL-ROU\tAUG-ROU\tSEP-ROU\tOCT-ROU\tNOV-ROU\tDEC-ROU\tJAN-DIS\tFEB-DIS\tMAR-DIS\tAPR-DIS\tMAY-DIS\tJUN-DIS\tJUL-DIS\tAUG-DIS\tSEP-DIS\tOCT-DIS\tNOV-DIS\tDEC-DIS\tWIND_H\tRGL\trad_atten\twind_atten\ttruck_ratio\tCOMMENT\n']
+    for i in range(len(table['classname'])):
+        lai = table['lai'][i]
+        alb = table['albedo'][i]
+
+        # write the land surface parameterization data
+        lines.append('{0}\t{1}\t{2}\t{3}\t{4:.4f}\t{5:.4f}\t{6:.4f}\t{7:.4f}\t{8:.4f}\t{9:.4f}\t{10:.4f}\t{11:.4f}\t{12:.4f}\t{13:.4f}\t{14:.4f}\t{15:.4f}\t{16:.4f}\t{17:.4f}\t{18:.4f}\t{19:.4f}\t{20:.4f}\t{21:.4f}\t{22:.4f}\t{23:.4f}\t{24:.4f}\t{25:.4f}\t{26:.4f}\t{27:.4f}\t{28}\t{28}\t{28}\t{28}\t{28}\t{28}\t{28}\t{28}\t{28}\t{28}\t{28}\t{28}\t{29}\t{29}\t{29}\t{29}\t{29}\t{29}\t{29}\t{29}\t{29}\t{29}\t{29}\t{29}\t{30}\t{31}\t{32}\t{33}\t{34}\t{35}\n'.format(i,
+            table['overstory'][i],table['rarc'][i],table['rmin'][i],lai[0],lai[1],lai[2],lai[3],lai[4],lai[5],lai[6],lai[7],lai[8],lai[9],lai[10],lai[11],alb[0],alb[1],alb[2],alb[3],alb[4],alb[5],alb[6],alb[7],alb[8],alb[9],alb[10],alb[11],
+            table['rough'][i],table['displacement'][i],table['wind_h'][i],
+            table['rgl'][i],table['rad_atten'][i],table['wind_atten'][i],
+            table['trunk_ratio'][i],table['classname'][i]))
+
+    # write the output veg library file
+    with phase('write'):
+        write_lines(veglib, lines)
+
+    count('cells', table['pixels'])
+    count_output(veglib)
     return
 
 
 # Execute the main level program if run as standalone
 if __name__ == "__main__":
-    INPUT_PATH = '/home/diego/vic-southeastern-us/data/input'
-    make_veg_lib(
-        os.path.join(INPUT_PATH, 'gis', 'sample-lc-igbp.tif'),
-        os.path.join(INPUT_PATH, 'ndvi_al-ga'),
-        os.path.join(INPUT_PATH, 'albedo_al-ga'),
-        os.path.join(INPUT_PATH, 'veg.lib'),
-        'IGBP'
-    )
+    from cli import main
+    main(['veglib'] + sys.argv[1:])
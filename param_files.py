@@ -0,0 +1,301 @@
+import os
+import hashlib
+import numpy as np
+
+# bytes of text parsed at once, split at line ends
+BLOCK_BYTES = 1 << 24
+
+# columns of a soil parameter file line, see format_soil_params. Layer
+# columns are read into (cells, 3) arrays
+LAYERS = 3
+SOIL_FIELDS = [
+    ('run', 1), ('gridcel', 1), ('lat', 1), ('lon', 1), ('infilt', 1),
+    ('Ds', 1), ('Dsmax', 1), ('Ws', 1), ('c', 1), ('expt', LAYERS),
+    ('Ksat', LAYERS), ('phi_s', LAYERS), ('init_moist', LAYERS), ('elev', 1),
+    ('depth', LAYERS), ('avg_T', 1), ('dp', 1), ('bubble', LAYERS),
+    ('quartz', LAYERS), ('bulk_density', LAYERS), ('soil_density', LAYERS),
+    ('organic', LAYERS), ('bulk_dens_org', LAYERS), ('soil_dens_org', LAYERS),
+    ('off_gmt', 1), ('Wcr_FRACT', LAYERS), ('Wpwp_FRACT', LAYERS),
+    ('rough', 1), ('snow_rough', 1), ('annual_prec', 1),
+    ('resid_moist', LAYERS), ('fs_active', 1),
+]
+INT_FIELDS = ('run', 'gridcel', 'fs_active')
+
+# columns of a veg library line, see make_veg_lib, before the comment
+VEGLIB_FIELDS = [
+    ('vegclass', 1), ('overstory', 1), ('rarc', 1), ('rmin', 1),
+    ('lai', 12), ('albedo', 12), ('veg_rough', 12), ('displacement', 12),
+    ('wind_h', 1), ('RGL', 1), ('rad_atten', 1), ('wind_atten', 1),
+    ('trunk_ratio', 1),
+]
+
+# monthly rows after each veg class line, in file order
+VEG_MONTHLY = ('lai', 'albedo')
+
+
+def parse_numbers(data):
+    '''
+    Returns the whitespace separated numbers of a text as a float64 array.
+    The text is parsed in blocks of whole lines, so only a block of tokens is
+    held as Python objects at once.
+    '''
+    out = []
+    start = 0
+    while start < len(data):
+        end = data.find(b'\n', start + BLOCK_BYTES)
+        end = len(data) if end < 0 else end + 1
+        out.append(np.array(data[start:end].split(), dtype=np.float64))
+        start = end
+    return np.concatenate(out) if out else np.zeros(0)
+
+
+def _columns(values, fields, names=INT_FIELDS):
+    # splits a (lines, columns) array into named columns, (lines, n) arrays
+    # for fields of n columns
+    out = {}
+    k = 0
+    for name, n in fields:
+        column = values[:, k] if n == 1 else values[:, k:k+n]
+        out[name] = column.astype(np.int64) if name in names else column
+        k += n
+    return out
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _lines(data, width):
+    # numbers of a file of lines with the same number of columns, an empty
+    # file has no lines of width columns
+    values = parse_numbers(data)
+    nlines = data.count(b'\n') + (1 if data and not data.endswith(b'\n') else 0)
+    if values.size == 0:
+        return values.reshape(0, width)
+    return values.reshape(nlines, -1)
+
+
+def read_soil(path):
+    '''
+    Reads a soil parameter file into a dictionary with a column per
+    SOIL_FIELDS entry. Layer columns are (cells, 3) arrays.
+    '''
+    ncols = sum(n for _, n in SOIL_FIELDS)
+    values = _lines(_read(path), ncols)
+    if values.shape[1] != ncols:
+        raise ValueError('{0} has {1} columns, not {2}'.format(
+            path, values.shape[1], ncols))
+    return _columns(values, SOIL_FIELDS)
+
+
+def read_snow(path):
+    '''
+    Reads a snow band file into a dictionary with the grid cell ids
+    ('cellid') and the (cells, bands) area fraction ('area'), elevation
+    ('elevation') and precipitation fraction ('precip') of each band.
+    '''
+    values = _lines(_read(path), 1)
+    nbands = (values.shape[1] - 1) // 3
+    return _columns(values, [('cellid', 1), ('area', nbands),
+                             ('elevation', nbands), ('precip', nbands)],
+                    ('cellid',))
+
+
+def read_veg(path):
+    '''
+    Reads a veg parameter file into a dictionary with the grid cell ids
+    ('cellid') and number of classes ('nveg') of each cell, and for each
+    class line the position of its cell ('cell'), its class ('vegclass'),
+    cover fraction ('Cv'), (lines, zones) root depths ('root_depth') and
+    fractions ('root_fract'), and the (lines, 12) monthly LAI and albedo if
+    the file has them.
+    '''
+    data = _read(path)
+    values = parse_numbers(data)
+    # kind of each line from its first characters: cell headers start with
+    # the cell id, class lines with a tab and monthly rows with two tabs
+    raw = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(raw == ord('\n'))
+    starts = np.concatenate([[0], ends + 1])
+    starts = starts[starts < raw.size]
+    first = raw[starts]
+    second = raw[np.minimum(starts + 1, raw.size - 1)]
+    header = first != ord('\t')
+    monthly = ~header & (second == ord('\t'))
+    classes = ~header & ~monthly
+    nclass, nmonthly = int(classes.sum()), int(monthly.sum())
+    nrows = nmonthly // nclass if nclass else 0
+    width = (values.size - 2*int(header.sum()) - 12*nmonthly) // nclass if nclass else 2
+
+    # first number of each line
+    count = np.where(header, 2, np.where(classes, width, 12))
+    offset = np.cumsum(count) - count
+    heads = values[offset[header][:, None] + np.arange(2)]
+    lines = values[offset[classes][:, None] + np.arange(width)]
+    out = {'cellid': heads[:, 0].astype(np.int64),
+           'nveg': heads[:, 1].astype(np.int64)}
+    out['cell'] = np.repeat(np.arange(out['nveg'].size), out['nveg'])
+    if out['cell'].size != nclass:
+        raise ValueError('{0} has {1} class lines, the headers give {2}'.format(
+            path, nclass, out['cell'].size))
+    # a file with no class lines (all the cells with Nveg 0) has no zones
+    nzones = (width - 2) // 2
+    out.update(_columns(lines, [('vegclass', 1), ('Cv', 1),
+                                ('roots', 2*nzones)], ('vegclass',)))
+    roots = out.pop('roots').reshape(nclass, nzones, 2)
+    out['root_depth'] = roots[:, :, 0].copy()
+    out['root_fract'] = roots[:, :, 1].copy()
+    rows = values[offset[monthly][:, None] + np.arange(12)]
+    for k, name in enumerate(VEG_MONTHLY[:nrows]):
+        out[name] = rows[k::nrows]
+    return out
+
+
+def read_veglib(path):
+    '''
+    Reads a veg library file into a dictionary with a column per
+    VEGLIB_FIELDS entry, monthly columns as (classes, 12) arrays, and the
+    class names ('comment').
+    '''
+    with open(path) as f:
+        lines = [line.rstrip('\n').split('\t') for line in f
+                 if line.strip() and not line.startswith('#')]
+    ncols = sum(n for _, n in VEGLIB_FIELDS)
+    values = np.array([line[:ncols] for line in lines], dtype=np.float64)
+    out = _columns(values.reshape(len(lines), ncols), VEGLIB_FIELDS,
+                   ('vegclass', 'overstory'))
+    out['comment'] = np.array(['\t'.join(line[ncols:]) for line in lines])
+    return out
+
+
+READERS = {'soil': read_soil, 'snow': read_snow, 'veg': read_veg,
+           'veglib': read_veglib}
+
+
+def read_param_file(path, kind, cache=None):
+    '''
+    Reads a soil, snow, veg or veg library file into typed arrays, see
+    read_soil, read_snow, read_veg and read_veglib.
+    Parameters
+    ----------
+    path : str
+        parameter file
+    kind: str
+        'soil', 'snow', 'veg' or 'veglib'
+    cache: str (optional)
+        folder where the arrays are saved the first time a file is read. The
+        next reads of the same file (same path, size and modification time)
+        memory map them instead of parsing the text
+    '''
+    if cache is None:
+        return READERS[kind](path)
+    stat = os.stat(path)
+    key = hashlib.sha1('{0}:{1}:{2}:{3}'.format(
+        os.path.abspath(path), stat.st_size, stat.st_mtime_ns, kind
+    ).encode()).hexdigest()
+    folder = os.path.join(cache, key)
+    if os.path.exists(os.path.join(folder, 'done')):
+        return {name[:-4]: np.load(os.path.join(folder, name), mmap_mode='r')
+                for name in os.listdir(folder) if name.endswith('.npy')}
+    table = READERS[kind](path)
+    os.makedirs(folder, exist_ok=True)
+    for name, values in table.items():
+        np.save(os.path.join(folder, name + '.npy'), values)
+    # written last, a folder without it is read again
+    open(os.path.join(folder, 'done'), 'w').close()
+    return table
+
+
+def _positions(ids, size):
+    # row of each grid cell id in a file, -1 if it is not in the file
+    pos = np.full(size, -1, dtype=np.int64)
+    pos[ids] = np.arange(ids.size)
+    return pos
+
+
+def consistency_index(soil, snow=None, veg=None, tol=1e-3):
+    '''
+    Indexes the grid cell ids of the soil, snow and veg files of a domain
+    and checks they agree, in time linear in the number of cells.
+    Parameters
+    ----------
+    soil : dict
+        soil file, see read_soil
+    snow, veg: dict (optional)
+        snow and veg files, see read_snow and read_veg
+    tol: float
+        tolerance of the sum of the cover fractions of a cell, the fractions
+        are written with 4 decimals
+    Returns
+    -------
+    dict with the row of each grid cell id in each file, -1 where it is
+    missing ('position'), the active soil cells missing from the snow and veg
+    files ('missing_snow', 'missing_veg'), the cells of the snow and veg files
+    that are not active in the soil file ('extra_snow', 'extra_veg'), the
+    cells repeated in a file ('repeated_<kind>'), the veg cells whose cover
+    fractions don't sum 1 ('cv_sum'), and an ok flag
+    '''
+    files = {'soil': np.asarray(soil['gridcel'], dtype=np.int64)}
+    if snow is not None:
+        files['snow'] = np.asarray(snow['cellid'], dtype=np.int64)
+    if veg is not None:
+        files['veg'] = np.asarray(veg['cellid'], dtype=np.int64)
+    size = int(np.max([ids.max(initial=0) for ids in files.values()])) + 1
+    active = np.zeros(size, dtype=bool)
+    active[files['soil'][np.asarray(soil['run']) > 0]] = True
+
+    out = {'position': {k: _positions(ids, size) for k, ids in files.items()}}
+    for kind, ids in files.items():
+        out['repeated_' + kind] = np.flatnonzero(np.bincount(ids, minlength=size) > 1)
+        if kind == 'soil':
+            continue
+        present = np.zeros(size, dtype=bool)
+        present[ids] = True
+        out['missing_' + kind] = np.flatnonzero(active & ~present)
+        out['extra_' + kind] = np.flatnonzero(present & ~active)
+    if veg is not None:
+        total = np.bincount(np.asarray(veg['cell']), np.asarray(veg['Cv']),
+                            files['veg'].size)
+        out['cv_sum'] = files['veg'][np.abs(total - 1) > tol]
+    out['ok'] = not any(v.size for k, v in out.items() if k != 'position')
+    return out
+
+
+def check_files(soil, snow=None, veg=None, cache=None, tol=1e-3):
+    '''
+    Reads the parameter files of a domain and prints the problems found by
+    consistency_index.
+    Returns
+    -------
+    the consistency_index result
+    '''
+    tables = {k: read_param_file(p, k, cache) if p is not None else None
+              for k, p in (('soil', soil), ('snow', snow), ('veg', veg))}
+    index = consistency_index(tables['soil'], tables['snow'], tables['veg'], tol)
+    print('Cells: soil {0}'.format(tables['soil']['gridcel'].size) + ''.join(
+        ', {0} {1}'.format(k, v['cellid'].size) for k, v in tables.items()
+        if k != 'soil' and v is not None))
+    for k, ids in index.items():
+        if k not in ('position', 'ok') and ids.size:
+            print('{0}: {1} cells, e.g. {2}'.format(k, ids.size, ids[:10].tolist()))
+    print('OK' if index['ok'] else 'Problems found')
+    return index
+
+
+if __name__ == '__main__':
+    import sys
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Check that the soil, snow and veg parameter files of a '
+                    'domain have the same cells and valid cover fractions'
+    )
+    parser.add_argument('soil', help='soil parameter file')
+    parser.add_argument('--snow', help='snow band file')
+    parser.add_argument('--veg', help='veg parameter file')
+    parser.add_argument('--cache', help='folder of the memory mapped arrays')
+    parser.add_argument('--tol', type=float, default=1e-3,
+                        help='tolerance of the cover fraction sums')
+    args = parser.parse_args()
+    index = check_files(args.soil, args.snow, args.veg, args.cache, args.tol)
+    sys.exit(0 if index['ok'] else 1)
@@ -0,0 +1,68 @@
+import itertools
+import numpy as np
+
+# size of the blocks of text written at once, in lines
+CHUNK_LINES = 65536
+
+
+def format_column(values, fmt='{}'):
+    '''
+    Formats a column of values into a list of strings. The values are
+    converted to Python scalars first, so '{}' gives the shortest repr of
+    floats exactly like formatting the scalars one by one did.
+    Parameters
+    ----------
+    values : array like
+        column values
+    fmt: str
+        str.format pattern of a single value, e.g. '{}' or '{:.4f}'
+    '''
+    values = np.asarray(values).tolist()
+    if fmt == '{}':
+        return list(map(str, values))
+    return list(map(fmt.format, values))
+
+
+def join_columns(fields, sep='\t', end=''):
+    '''
+    Joins columns into lines.
+    Parameters
+    ----------
+    fields : list
+        columns of the lines, in order. Each one is either a list of already
+        formatted strings, a (values, fmt) tuple formatted with format_column
+        or a str written as it is in every line
+    sep: str
+        column separator
+    end: str
+        appended to each line
+    Returns
+    -------
+    list with the text of each line
+    '''
+    columns = []
+    nlines = None
+    for field in fields:
+        if isinstance(field, str):
+            columns.append(field)
+            continue
+        if isinstance(field, tuple):
+            field = format_column(*field)
+        columns.append(field)
+        nlines = len(field)
+    if nlines is None:
+        raise ValueError('At least one column needs a value per line')
+    columns = [itertools.repeat(c, nlines) if isinstance(c, str) else c
+               for c in columns]
+    if end:
+        return [sep.join(t) + end for t in zip(*columns)]
+    return [sep.join(t) for t in zip(*columns)]
+
+
+def write_lines(path, lines, mode='w'):
+    '''
+    Writes lines of text (with their line ends) in large blocks.
+    '''
+    with open(path, mode, buffering=1 << 20) as f:
+        for k in range(0, len(lines), CHUNK_LINES):
+            f.write(''.join(lines[k:k+CHUNK_LINES]))
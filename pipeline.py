@@ -0,0 +1,351 @@
+import os
+import glob
+import json
+import importlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+
+# A pipeline stage. The function is referenced by module and name so it is
+# only imported in the process that runs it
+Stage = namedtuple(
+    'Stage', ['name', 'module', 'function', 'args', 'kwargs', 'inputs', 'outputs']
+)
+
+
+# raster inputs of the config sections passed whole to the image and fused
+# parameter stages
+SECTION_RASTERS = {
+    'soil': ('hwsd', 'elevation', 'precip', 'slope'),
+    'snow': ('elevation', 'precip'),
+    'veg': ('landcover', 'lai', 'albedo'),
+    'veglib': ('landcover', 'lai', 'albedo'),
+}
+
+
+def _sections(config, path, names, output=False):
+    # the given config sections with their rasters (and output) resolved
+    # against the workdir, and the list of those rasters
+    out, inputs = {}, []
+    for name in names:
+        if name not in config:
+            continue
+        keys = SECTION_RASTERS[name] + (('output',) if output else ())
+        out[name] = {k: path(v) if k in keys else v
+                     for k, v in config[name].items()
+                     if output or k != 'output'}
+        inputs += [out[name][k] for k in SECTION_RASTERS[name] if k in out[name]]
+    return out, inputs
+
+
+def build_stages(config, fused=None):
+    '''
+    Builds the list of stages of a domain from its config. Stage sections
+    missing from the config are not built. All relative paths are relative to
+    the config workdir.
+    Parameters
+    ----------
+    config : dict
+        domain config, see domain_config.json for an example
+    fused: bool (optional)
+        replace the soil, snow and veg stages with a single 'params' stage
+        that builds the three files in one pass over the template, see
+        fused_params.py. Taken from the config 'fused' key if not set
+    '''
+    wd = config.get('workdir', '.')
+    path = lambda p: os.path.join(wd, p)
+    mask = path(config['mask'])
+    stages = []
+
+    # artifact cache shared by the snap, soil, snow and veg stages
+    cached = {}
+    if 'cache' in config:
+        from artifact_cache import ArtifactCache
+        cached['cache'] = ArtifactCache(**config['cache'])
+
+    if 'grid' in config:
+        cfg = config['grid']
+        stages.append(Stage(
+            'grid', 'create_base_grid', 'create_grid',
+            (path(cfg['shapefile']), mask, cfg['gridSize']), {},
+            [path(cfg['shapefile'])], [mask]
+        ))
+
+    if 'climatology' in config:
+        cfg = config['climatology']
+        prefix = path(cfg['prefix'])
+        stages.append(Stage(
+            'climatology', 'avg_annual', 'aggregate_rasters',
+            (prefix, datetime.strptime(cfg['start'], '%Y-%m-%d'),
+             datetime.strptime(cfg['end'], '%Y-%m-%d'), path(cfg['output'])),
+            {'statistic': cfg.get('statistic', 'mean')},
+            [prefix + '*'], [path(cfg['output'])]
+        ))
+
+    for cfg in config.get('snap', []):
+        name = 'snap:{0}'.format(os.path.basename(cfg['output']))
+        stages.append(Stage(
+            name, 'snap_grid', 'snap_raster',
+            (path(cfg['input']), path(cfg['output']), mask, cfg['subGrid'],
+             cfg['resample']), dict(cached),
+            [path(cfg['input']), mask], [path(cfg['output'])]
+        ))
+
+    if 'soil' in config:
+        cfg = config['soil']
+        rasters = [mask] + [
+            path(cfg[k]) for k in ('hwsd', 'elevation', 'precip', 'slope')
+        ]
+        kwargs = {
+            k: cfg[k] for k in ('b_val', 'Ws_val', 'Ds_val', 's2', 's3')
+            if k in cfg
+        }
+        kwargs.update(cached)
+        stages.append(Stage(
+            'soil', 'format_soil_params', 'format_soil_params',
+            tuple(rasters) + (path(cfg['output']),), kwargs,
+            rasters, [path(cfg['output'])]
+        ))
+
+    if 'snow' in config:
+        cfg = config['snow']
+        kwargs = dict(cached)
+        inputs = [mask, path(cfg['elevation'])]
+        if 'precip' in cfg:
+            # precipitation climatology weighting the band precipitation
+            kwargs['precip'] = path(cfg['precip'])
+            inputs.append(kwargs['precip'])
+        stages.append(Stage(
+            'snow', 'format_snow_parameters', 'format_snow_params',
+            (mask, path(cfg['elevation']), path(cfg['output']), cfg['interval']),
+            kwargs, inputs, [path(cfg['output'])]
+        ))
+
+    if 'veg' in config:
+        cfg = config['veg']
+        kwargs = dict(cached, scheme=cfg.get('scheme', 'IGBP'))
+        inputs = [mask, path(cfg['landcover'])]
+        for key, kw in (('lai', 'LAIFolder'), ('albedo', 'ALBFolder')):
+            if key in cfg:
+                # monthly rasters averaged by class in each cell
+                kwargs[kw] = path(cfg[key])
+                inputs.append(kwargs[kw])
+        stages.append(Stage(
+            'veg', 'format_veg_params', 'format_veg_params',
+            (mask, path(cfg['landcover']), path(cfg['output'])),
+            kwargs, inputs, [path(cfg['output'])]
+        ))
+
+    if fused is None:
+        fused = config.get('fused', False)
+    merged = [s for s in stages if s.name in ('soil', 'snow', 'veg')]
+    if fused and merged:
+        kwargs, inputs = _sections(config, path, ('soil', 'snow', 'veg'), True)
+        stages = [s for s in stages if s not in merged]
+        stages.append(Stage(
+            'params', 'fused_params', 'format_params_fused', (mask,), kwargs,
+            [mask] + inputs, [out for s in merged for out in s.outputs]
+        ))
+
+    if 'veglib' in config:
+        cfg = config['veglib']
+        inputs = [path(cfg[k]) for k in ('landcover', 'lai', 'albedo')]
+        stages.append(Stage(
+            'veglib', 'make_veg_lib', 'make_veg_lib',
+            tuple(inputs) + (path(cfg['output']),),
+            {'scheme': cfg.get('scheme', 'IGBP')},
+            inputs, [path(cfg['output'])]
+        ))
+
+    if 'archive' in config and 'forcing' in config:
+        # the daily files of the forcing stage are cut from a shared archive,
+        # downloading only what it is missing for this domain
+        cfg, forcing = config['archive'], config['forcing']
+        stages.append(Stage(
+            'archive', 'era5_archive', 'domain_forcing_files',
+            (cfg['root'], cfg['name'], mask, forcing['start'], forcing['end'],
+             path(forcing['weather'])), {},
+            [mask], [path(forcing['weather'])]
+        ))
+
+    if 'forcing' in config:
+        cfg = config['forcing']
+        kwargs = dict(cached)
+        for key in ('method', 'max_open', 'read_ahead_days'):
+            if key in cfg:
+                kwargs[key] = cfg[key]
+        if 'qa' in cfg:
+            kwargs['qa'] = path(cfg['qa'])
+        stages.append(Stage(
+            'forcing', 'format_meteo_forcing', 'format_meteo_forcing',
+            (mask, path(cfg['weather']), path(cfg['output']), cfg['start'],
+             cfg['end']), kwargs,
+            [mask, path(cfg['weather'])], [path(cfg['output'])]
+        ))
+    if 'image' in config:
+        # the image driver files are built from the inputs of the soil,
+        # snow, veg and veg library sections
+        cfg = config['image']
+        kwargs, inputs = _sections(config, path, SECTION_RASTERS)
+        kwargs.update(cached)
+        inputs = [mask] + inputs
+        domain = path(cfg['domain']) if 'domain' in cfg else None
+        stages.append(Stage(
+            'image', 'image_params', 'format_image_params',
+            (mask, path(cfg['params']), domain), kwargs, inputs,
+            [p for p in (path(cfg['params']), domain) if p is not None]
+        ))
+    return stages
+
+
+def _mtimes(pattern):
+    '''
+    Returns the modification times of the files matched by a path. Folders
+    are expanded to the files inside them and glob patterns are expanded.
+    '''
+    out = []
+    for p in glob.glob(pattern):
+        if os.path.isdir(p):
+            for root, _, files in os.walk(p):
+                out += [os.path.getmtime(os.path.join(root, f)) for f in files]
+        else:
+            out.append(os.path.getmtime(p))
+    return out
+
+
+def is_up_to_date(stage):
+    '''
+    Returns True if all the stage outputs exist and are newer than its inputs.
+    '''
+    outputs = []
+    for p in stage.outputs:
+        times = _mtimes(p)
+        if not times:
+            return False
+        outputs += times
+    inputs = []
+    for p in stage.inputs:
+        inputs += _mtimes(p)
+    return not inputs or min(outputs) >= max(inputs)
+
+
+def dependencies(stages):
+    '''
+    Returns a dict with the names of the stages each stage depends on. A stage
+    depends on another one if any of its inputs is, or is inside, one of the
+    other stage outputs.
+    '''
+    deps = {}
+    for stage in stages:
+        deps[stage.name] = set()
+        for other in stages:
+            if other is stage:
+                continue
+            for inp in stage.inputs:
+                inp = os.path.normpath(inp)
+                if any(inp == os.path.normpath(out) or
+                       inp.startswith(os.path.normpath(out) + os.sep)
+                       for out in other.outputs):
+                    deps[stage.name].add(other.name)
+    return deps
+
+
+def _run_stage(stage):
+    for out in stage.outputs:
+        folder = out if stage.name == 'forcing' else os.path.dirname(out)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+    module = importlib.import_module(stage.module)
+    getattr(module, stage.function)(*stage.args, **stage.kwargs)
+    return stage.name
+
+
+def run_pipeline(config, workers=4, force=False, only=None):
+    '''
+    Builds a VIC domain running its stages in dependency order. Stages that
+    don't depend on each other run concurrently, and stages whose outputs
+    are newer than their inputs are skipped.
+    Parameters
+    ----------
+    config : str or dict
+        path to a domain config JSON file, or the loaded config
+    workers: int
+        maximum number of stages running at the same time
+    force: bool
+        run all the stages even if they are up to date
+    only: list (optional)
+        names of the stages to run, the others are considered up to date
+    '''
+    if isinstance(config, str):
+        with open(config) as f:
+            config = json.load(f)
+    stages = {s.name: s for s in build_stages(config)}
+    deps = dependencies(list(stages.values()))
+    # make sure the graph is acyclic before starting anything
+    order = _topological_order(deps)
+
+    pending = set(order)
+    done = set()
+    running = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            ready = [
+                name for name in order
+                if name in pending and deps[name] <= done
+            ]
+            for name in ready:
+                pending.discard(name)
+                stage = stages[name]
+                skip = only is not None and name not in only
+                if not skip and not force:
+                    skip = is_up_to_date(stage)
+                if skip:
+                    print('Skipping {0}'.format(name))
+                    done.add(name)
+                else:
+                    print('Running {0}'.format(name))
+                    running[executor.submit(_run_stage, stage)] = name
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    future.result()
+                except Exception:
+                    for f in running:
+                        f.cancel()
+                    raise
+                print('Finished {0}'.format(name))
+                done.add(name)
+    return
+
+
+def _topological_order(deps):
+    order = []
+    visiting = set()
+    def visit(name):
+        if name in order:
+            return
+        if name in visiting:
+            raise ValueError('Cyclic dependency at stage {0}'.format(name))
+        visiting.add(name)
+        for dep in sorted(deps[name]):
+            visit(dep)
+        visiting.discard(name)
+        order.append(name)
+    for name in sorted(deps):
+        visit(name)
+    return order
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Build a VIC domain')
+    parser.add_argument('config', help='domain config JSON file')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--force', action='store_true',
+                        help='rerun stages that are up to date')
+    parser.add_argument('--only', nargs='+', help='stages to run')
+    args = parser.parse_args()
+    run_pipeline(args.config, args.workers, args.force, args.only)
@@ -0,0 +1,251 @@
+import numpy as np
+from osgeo import gdal, gdal_array
+from osgeo.gdalconst import *
+from instrument import count
+
+# GeoTIFF creation options shared by the scripts writing rasters. 'plain' is
+# the striped, uncompressed layout GDAL writes with no options
+PROFILES = {
+    'plain': [],
+    'deflate': ['TILED=YES', 'COMPRESS=DEFLATE', 'BIGTIFF=IF_SAFER'],
+    'zstd': ['TILED=YES', 'COMPRESS=ZSTD', 'BIGTIFF=IF_SAFER'],
+}
+DEFAULT_PROFILE = 'deflate'
+
+
+def creation_options(profile, dtype):
+    '''
+    Returns the GeoTIFF creation options for a profile name from PROFILES or
+    a list of custom options. A predictor matching the data type (horizontal
+    differencing for integers, floating point for floats) is added to the
+    compressed profiles.
+    '''
+    if profile is None:
+        profile = DEFAULT_PROFILE
+    if not isinstance(profile, str):
+        return list(profile)
+    try:
+        options = list(PROFILES[profile])
+    except KeyError:
+        raise KeyError('{0} is not a valid output profile'.format(profile))
+    if any(opt.startswith('COMPRESS=') for opt in options):
+        if dtype in (gdal.GDT_Float32, gdal.GDT_Float64):
+            options.append('PREDICTOR=3')
+        else:
+            options.append('PREDICTOR=2')
+    return options
+
+
+def create_raster(path, xsize, ysize, dtype, profile=None, nbands=1):
+    '''
+    Creates a GeoTIFF with the creation options of an output profile.
+    Parameters
+    ----------
+    path : str
+        output raster file with TIF file extension
+    xsize, ysize: int
+        raster width and height
+    dtype: int
+        GDAL data type
+    profile: str or list (optional)
+        name of a profile in PROFILES or a list of creation options. Defaults
+        to DEFAULT_PROFILE
+    nbands: int (optional)
+        number of bands
+    '''
+    return gdal.GetDriverByName('GTiff').Create(
+        path, xsize, ysize, nbands, dtype,
+        options=creation_options(profile, dtype)
+    )
+
+
+def build_overviews(ds, overviews, resample='nearest'):
+    '''
+    Builds internal overviews for a dataset opened for writing.
+    Parameters
+    ----------
+    ds : gdal.Dataset
+    overviews: list or bool
+        decimation factors, e.g. [2, 4, 8]. If True the factors are doubled
+        until the overview is smaller than 256 pixels. Nothing is done for
+        None or False
+    resample: str (optional)
+        overview resampling method (nearest, average, mode, ...)
+    '''
+    if not overviews:
+        return
+    if overviews is True:
+        overviews = []
+        factor = 2
+        while max(ds.RasterXSize, ds.RasterYSize) / factor >= 256:
+            overviews.append(factor)
+            factor *= 2
+    if overviews:
+        ds.BuildOverviews(resample.upper(), list(overviews))
+
+
+def array_to_dataset(array, geotransform, projection=None, nodata=-9999.):
+    '''
+    Wraps a numpy array into a single band in-memory (MEM) GDAL dataset.
+    Parameters
+    ----------
+    array : numpy.ndarray
+        2D array with the raster values
+    geotransform: tuple
+        GDAL geotransform of the array
+    projection: str (optional)
+        WKT of the array coordinate system, WGS84 if not provided
+    nodata: float (optional)
+        no data value to set on the band
+    '''
+    array = np.asarray(array)
+    dtype = gdal_array.NumericTypeCodeToGDALTypeCode(array.dtype)
+    ds = gdal.GetDriverByName('MEM').Create(
+        '', array.shape[1], array.shape[0], 1, dtype
+    )
+    ds.SetGeoTransform(tuple(geotransform))
+    if projection is None:
+        projection = 'EPSG:4326'
+    ds.SetProjection(projection)
+    band = ds.GetRasterBand(1)
+    band.WriteArray(array)
+    if nodata is not None:
+        band.SetNoDataValue(nodata)
+    return ds
+
+
+def open_dataset(src):
+    '''
+    Returns a GDAL dataset for a raster input. The input can be a path to a
+    raster file, an already opened gdal.Dataset (e.g. the in-memory output of
+    snap_raster) or an (array, geotransform[, nodata]) tuple.
+    '''
+    if isinstance(src, gdal.Dataset):
+        return src
+    if isinstance(src, tuple):
+        nodata = src[2] if len(src) > 2 else -9999.
+        return array_to_dataset(src[0], src[1], nodata=nodata)
+    ds = gdal.Open(src, GA_ReadOnly)
+    if ds is None:
+        raise IOError(
+            'Raster file input error, check that {0} is correct'.format(src)
+        )
+    count('files_opened')
+    return ds
+
+
+def raster_info(src):
+    '''
+    Returns the (geotransform, (rows, cols)) of a raster input without
+    reading its values.
+    '''
+    if isinstance(src, tuple):
+        return tuple(src[1]), np.shape(src[0])
+    if isinstance(src, np.ndarray):
+        return None, src.shape
+    ds = open_dataset(src)
+    return ds.GetGeoTransform(), (ds.RasterYSize, ds.RasterXSize)
+
+
+def window_geotransform(geotransform, window):
+    '''
+    Returns the geotransform of a (row_off, col_off, nrows, ncols) window.
+    '''
+    gt = list(geotransform)
+    gt[0] = gt[0] + window[1]*gt[1]
+    gt[3] = gt[3] + window[0]*gt[5]
+    return tuple(gt)
+
+
+def read_raster(src, band=1, window=None):
+    '''
+    Reads a raster input into memory. The input can be a path, a gdal.Dataset,
+    an (array, geotransform) or (array, geotransform, nodata) tuple, or a bare
+    numpy array. Array inputs are copied, so the formatters can modify the
+    returned array in place.
+    Parameters
+    ----------
+    src : str, gdal.Dataset, numpy.ndarray or tuple
+        raster input
+    band: int (optional)
+        band to read
+    window: tuple (optional)
+        (row_off, col_off, nrows, ncols) of the part of the raster to read. It
+        is clipped to the raster size
+    Returns
+    -------
+    (array, geotransform, nodata). The geotransform and nodata are None when
+    they can not be known from the input. The geotransform is the one of the
+    window when it is given.
+    '''
+    if isinstance(src, (np.ndarray, tuple)):
+        if isinstance(src, np.ndarray):
+            array, geotransform, nodata = src, None, None
+        else:
+            array, geotransform = src[:2]
+            nodata = src[2] if len(src) > 2 else None
+            geotransform = tuple(geotransform)
+        if window is not None:
+            array = np.asarray(array)[window[0]:window[0]+window[2],
+                                      window[1]:window[1]+window[3]]
+            if geotransform is not None:
+                geotransform = window_geotransform(geotransform, window)
+        return np.array(array), geotransform, nodata
+    ds = open_dataset(src)
+    b1 = ds.GetRasterBand(band)
+    geotransform = ds.GetGeoTransform()
+    if window is None:
+        array = b1.ReadAsArray()
+    else:
+        row_off, col_off, nrows, ncols = window
+        nrows = min(nrows, ds.RasterYSize - row_off)
+        ncols = min(ncols, ds.RasterXSize - col_off)
+        array = b1.ReadAsArray(col_off, row_off, ncols, nrows)
+        geotransform = window_geotransform(geotransform, window)
+    count('bytes_read', array.nbytes)
+    return array, geotransform, b1.GetNoDataValue()
+
+
+def sample_raster(src, rows, cols, band=1, block_rows=512):
+    '''
+    Reads the values of a raster input at a set of cells, in the raster data
+    type. File and dataset inputs are read in strips of block_rows rows, and
+    strips without cells are skipped, so the whole raster is never held in
+    memory. Array inputs (including numpy.memmap arrays) and (array,
+    geotransform[, nodata]) tuples are indexed directly.
+    Parameters
+    ----------
+    src : str, gdal.Dataset, numpy.ndarray or tuple
+        raster input
+    rows, cols: numpy.ndarray
+        row and column of each cell, sorted by row
+    band: int (optional)
+        band to read
+    block_rows: int (optional)
+        number of rows read at once
+    Returns
+    -------
+    (values, geotransform, nodata), see read_raster
+    '''
+    rows = np.asarray(rows)
+    cols = np.asarray(cols)
+    if isinstance(src, np.ndarray):
+        return src[rows, cols], None, None
+    if isinstance(src, tuple):
+        nodata = src[2] if len(src) > 2 else None
+        return np.asarray(src[0])[rows, cols], tuple(src[1]), nodata
+    ds = open_dataset(src)
+    b1 = ds.GetRasterBand(band)
+    values = np.empty(rows.size, gdal_array.GDALTypeCodeToNumericTypeCode(b1.DataType))
+    for y0 in range(0, ds.RasterYSize, block_rows):
+        nrows = min(block_rows, ds.RasterYSize - y0)
+        k0, k1 = np.searchsorted(rows, [y0, y0 + nrows])
+        if k0 == k1:
+            continue
+        # only the columns spanned by the cells in the strip are read
+        x0 = int(cols[k0:k1].min())
+        x1 = int(cols[k0:k1].max()) + 1
+        block = b1.ReadAsArray(x0, y0, x1 - x0, nrows)
+        count('bytes_read', block.nbytes)
+        values[k0:k1] = block[rows[k0:k1] - y0, cols[k0:k1] - x0]
+    return values, ds.GetGeoTransform(), b1.GetNoDataValue()
@@ -2,6 +2,8 @@ import numpy as np
 from osgeo import gdal
 from osgeo.gdalnumeric import *
 from osgeo.gdalconst import *
+from raster_io import open_dataset, create_raster, build_overviews
+from instrument import instrumented, phase, count, count_output
 
 DATATYPES = {
     'Byte': gdal.GDT_Byte, 'Int16': gdal.GDT_Int16, 
@@ -15,16 +17,19 @@ SAMPS = {
     'mode': GRA_Mode
 }
 
-def snap_raster(inputRas, outputRas, templateRas, subGrid, resample):
+@instrumented('snap')
+def snap_raster(inputRas, outputRas, templateRas, subGrid, resample,
+                driver='GTiff', profile=None, overviews=None, cache=None):
     """
     Snap raster to a reference raster. 
     Parameters
     ----------
-    inputRas : str
+    inputRas : str or gdal.Dataset
         input raster file to be snapped with TIF file extension
     outputRas: str
-        output snapped raster file with TIF file extension
-    templateRas: str
+        output snapped raster file with TIF file extension. It is ignored
+        (can be None) when the driver is MEM or VRT
+    templateRas: str or gdal.Dataset
         input raster that the raster will be snapped to with TIF file extension
     subGrid: bool
         boolean value to set whether the output raster's resolution will be at 
@@ -32,8 +37,37 @@ def snap_raster(inputRas, outputRas, templateRas, subGrid, resample):
     resample: 
         resampling method to be used when snapping (nearest, bilinear, cubic, 
         spline, mean, mode)
+    driver: str (optional)
+        GTiff to write the snapped raster to outputRas, MEM to return it as an
+        in-memory dataset, or VRT to return a lazy warped dataset that is only
+        resampled when it is read.
+    profile: str or list (optional)
+        GeoTIFF output profile (plain, deflate, zstd) or list of creation 
+        options, see raster_io.PROFILES. Defaults to tiled DEFLATE
+    overviews: list or bool (optional)
+        overview decimation factors to build in the GeoTIFF output, True to
+        pick them from the raster size
+    cache: artifact_cache.ArtifactCache (optional)
+        cache to copy the GeoTIFF output from when the same input and
+        template were already snapped with the same options
+    Returns
+    -------
+    None for GTiff outputs, otherwise the snapped gdal.Dataset. It can be
+    passed directly to the format_* functions instead of a path.
     """
-    src = gdal.Open(inputRas, GA_ReadOnly)
+    if driver not in ('GTiff', 'MEM', 'VRT'):
+        raise ValueError('{0} is not a valid output driver'.format(driver))
+
+    if cache is not None and driver == 'GTiff':
+        key = cache.key(
+            'snap', [inputRas, templateRas], subGrid=subGrid, 
+            resample=resample, profile=profile, overviews=overviews
+        )
+        if cache.get_file(key, outputRas):
+            count('cache_hits')
+            return
+
+    src = open_dataset(inputRas)
     src_proj = src.GetProjection()
     srcXSize = src.RasterXSize
     srcYSize = src.RasterYSize
@@ -58,7 +92,7 @@ def snap_raster(inputRas, outputRas, templateRas, subGrid, resample):
             pass
 
     # We want a section of source that matches this:
-    match_ds = gdal.Open(templateRas, GA_ReadOnly)
+    match_ds = open_dataset(templateRas)
     match_proj = match_ds.GetProjection()
     match_geotrans = match_ds.GetGeoTransform()
     matchXSize = match_ds.RasterXSize
@@ -80,33 +114,46 @@ def snap_raster(inputRas, outputRas, templateRas, subGrid, resample):
         high = matchYSize
         outGeom = match_geotrans
 
-    dst = gdal.GetDriverByName('GTiff').Create(outputRas, wide, high, 1, src_dtype)
+    if driver == 'VRT':
+        # lazy warp, pixels are only resampled when the dataset is read
+        return gdal.Warp(
+            '', src, format='VRT', width=wide, height=high,
+            outputBounds=(
+                outGeom[0], outGeom[3] + high*outGeom[5],
+                outGeom[0] + wide*outGeom[1], outGeom[3]
+            ),
+            dstSRS='EPSG:4326', resampleAlg=sampMethod,
+            outputType=src_dtype, dstNodata=-9999.
+        )
+
+    if driver == 'MEM':
+        dst = gdal.GetDriverByName('MEM').Create('', wide, high, 1, src_dtype)
+    else:
+        dst = create_raster(outputRas, wide, high, src_dtype, profile)
     dst.SetGeoTransform(outGeom)
     dst.SetProjection(match_proj)
     band = dst.GetRasterBand(1)
     band.SetNoDataValue(-9999.)
 
-    gdal.ReprojectImage(src, dst, src_proj, 'EPSG:4326', sampMethod)
+    count('cells', wide*high)
+    with phase('warp'):
+        gdal.ReprojectImage(src, dst, src_proj, 'EPSG:4326', sampMethod)
+    if driver == 'MEM':
+        return dst
+    with phase('write'):
+        if resample in ('nearest', 'mode'):
+            build_overviews(dst, overviews, 'nearest')
+        else:
+            build_overviews(dst, overviews, 'average')
+        dst.FlushCache()
+        dst = None
+    count_output(outputRas)
+    if cache is not None:
+        cache.put_file(key, outputRas)
     return
 
 # Execute the main level program if run as standalone
 if __name__ == "__main__":
-    import os
-    WD = '/home/diego/vic-southeastern-us/data/input/gis'
-    os.chdir(WD)
-    ARGS = [
-        ('srtm-southeastern-us-500m-filled.tif', 'sample-strm-snap.tif', 
-         'grid-sample.tif', True, 'bilinear'),
-        ('srtm-southeastern-us-500m-filled.tif', 'sample-strm-avg.tif', 
-         'grid-sample.tif', False, 'bilinear'),
-        ('slope-southeastern-us-500m.tif', 'sample-slope-avg.tif', 
-         'grid-sample.tif', False, 'mean'),
-        ('modis-lc-southeastern-us.tif', 'sample-lc-igbp.tif', 
-         'grid-sample.tif', True, 'nearest'),
-        ('hswd-southeastern-us.tif', 'sample-soils-agg.tif', 
-         'grid-sample.tif', False, 'mode'),
-        ('precip.tif', 'sample-precip-snap.tif', 
-         'grid-sample.tif', False, 'mode'),
-    ]
-    for args in ARGS:
-        snap_raster(*args)
\ No newline at end of file
+    import sys
+    from cli import main
+    main(['snap'] + sys.argv[1:])
@@ -0,0 +1,279 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from osgeo import gdal_array, ogr, osr
+from netCDF4 import Dataset
+from datetime import datetime, timedelta
+from raster_io import create_raster
+
+from format_meteo_forcing import VAR_PREFIX, VAR_NCNAME
+
+# template grid origin (upper left corner) and resolution
+ORIGIN = (-85.0, 34.0)
+GRID_SIZE = 0.05
+# resolution of the synthetic AgERA5 forcings
+FORCING_SIZE = 0.1
+
+
+def _smooth_field(rng, shape, scale):
+    '''
+    Returns a smooth random field in [0, 1] by upsampling coarse noise.
+    '''
+    coarse = rng.random((shape[0] // scale + 2, shape[1] // scale + 2))
+    field = np.kron(coarse, np.ones((scale, scale)))
+    # average the blocks to remove the steps
+    kernel = np.ones(scale) / scale
+    field = np.apply_along_axis(np.convolve, 0, field, kernel, 'same')
+    field = np.apply_along_axis(np.convolve, 1, field, kernel, 'same')
+    field = field[:shape[0], :shape[1]]
+    return (field - field.min()) / (field.max() - field.min())
+
+
+def _blocky_field(rng, shape, scale, values):
+    '''
+    Returns a field of patches of scale pixels with values picked from values.
+    '''
+    coarse = rng.choice(values, (shape[0] // scale + 1, shape[1] // scale + 1))
+    return np.kron(coarse, np.ones((scale, scale), coarse.dtype))[:shape[0], :shape[1]]
+
+
+def write_raster(path, array, geotransform, nodata=None):
+    '''
+    Writes a single band WGS84 GeoTIFF.
+    '''
+    dtype = gdal_array.NumericTypeCodeToGDALTypeCode(array.dtype)
+    ds = create_raster(path, array.shape[1], array.shape[0], dtype)
+    ds.SetGeoTransform(geotransform)
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    ds.SetProjection(srs.ExportToWkt())
+    band = ds.GetRasterBand(1)
+    band.WriteArray(array)
+    if nodata is not None:
+        band.SetNoDataValue(nodata)
+    ds.FlushCache()
+    return path
+
+
+def write_basin_shapefile(path, center, radii, npoints=64):
+    '''
+    Writes an elliptic basin polygon shapefile.
+    '''
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    drv = ogr.GetDriverByName('ESRI Shapefile')
+    if os.path.exists(path):
+        drv.DeleteDataSource(path)
+    ds = drv.CreateDataSource(path)
+    layer = ds.CreateLayer('basin', srs, ogr.wkbPolygon)
+    ring = ogr.Geometry(ogr.wkbLinearRing)
+    for t in np.linspace(0, 2*np.pi, npoints):
+        ring.AddPoint(center[0] + radii[0]*np.cos(t), center[1] + radii[1]*np.sin(t))
+    ring.CloseRings()
+    poly = ogr.Geometry(ogr.wkbPolygon)
+    poly.AddGeometry(ring)
+    feature = ogr.Feature(layer.GetLayerDefn())
+    feature.SetGeometry(poly)
+    layer.CreateFeature(feature)
+    ds = None
+    return path
+
+
+def write_forcing_day(path, ncname, array, lats, lons, date):
+    '''
+    Writes a daily AgERA5 like netCDF file with a single time step.
+    '''
+    with Dataset(path, 'w') as nc:
+        nc.createDimension('time', 1)
+        nc.createDimension('lat', lats.size)
+        nc.createDimension('lon', lons.size)
+        time = nc.createVariable('time', 'f8', ('time',))
+        time.units = 'days since 1900-01-01'
+        time[:] = (date - datetime(1900, 1, 1)).days
+        nc.createVariable('lat', 'f8', ('lat',))[:] = lats
+        nc.createVariable('lon', 'f8', ('lon',))[:] = lons
+        var = nc.createVariable(ncname, 'f4', ('time', 'lat', 'lon'), zlib=True)
+        var[0] = array
+    return path
+
+
+def make_synthetic_domain(folder, rows=40, cols=60, ratio=10, days=365,
+                          year=2010, seed=0):
+    '''
+    Creates the inputs of a synthetic VIC domain (basin shapefile, hi res
+    elevation, slope, land cover and HWSD rasters, monthly LAI and albedo
+    rasters, and AgERA5 like daily forcings) and returns a domain config for
+    pipeline.build_stages that builds every parameter file from them. The
+    config is also written to domain.json inside the folder.
+    Parameters
+    ----------
+    folder : str
+        output folder, used as the config workdir
+    rows, cols: int
+        size of the template grid, at GRID_SIZE resolution
+    ratio: int
+        number of hi res pixels per template pixel side
+    days: int
+        number of daily forcing files per variable, starting on January 1st.
+        The forcing stage is only configured for whole years
+    year: int
+        year of the first forcing file
+    seed: int
+        random seed
+    Returns
+    -------
+    dict with the domain config
+    '''
+    rng = np.random.default_rng(seed)
+    folder = os.path.abspath(folder)
+    os.makedirs(os.path.join(folder, 'gis'), exist_ok=True)
+    path = lambda p: os.path.join(folder, p)
+
+    x0, y0 = ORIGIN
+    x1 = x0 + cols*GRID_SIZE
+    y1 = y0 - rows*GRID_SIZE
+    # keep the basin extent a quarter pixel inside the grid so create_grid
+    # rounds it out to exactly rows x cols
+    write_basin_shapefile(
+        path('basin.shp'), ((x0 + x1) / 2, (y0 + y1) / 2),
+        ((x1 - x0) / 2 - GRID_SIZE / 4, (y0 - y1) / 2 - GRID_SIZE / 4)
+    )
+
+    # hi res rasters cover the grid plus a margin of template pixels
+    margin = 2
+    res = GRID_SIZE / ratio
+    shape = ((rows + 2*margin)*ratio, (cols + 2*margin)*ratio)
+    hgt = (x0 - margin*GRID_SIZE, res, 0, y0 + margin*GRID_SIZE, 0, -res)
+
+    dem = (_smooth_field(rng, shape, 4*ratio) * 1500 + 20).astype(np.float32)
+    dem += rng.normal(0, 15, shape).astype(np.float32)
+    write_raster(path('gis/dem.tif'), dem, hgt, -9999.)
+
+    dy, dx = np.gradient(dem.astype(np.float64), res*111000.)
+    slope = (np.hypot(dx, dy) * 100).astype(np.float32)
+    write_raster(path('gis/slope.tif'), slope, hgt, -9999.)
+
+    lc = _blocky_field(rng, shape, max(ratio // 2, 1), np.arange(17, dtype=np.uint8))
+    lc[rng.random(shape) < 0.02] = 255
+    write_raster(path('gis/landcover.tif'), lc, hgt, 255)
+
+    # HWSD mapping units that have topsoil data
+    hwsd_table = pd.read_csv(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'HWSD_CLS_DATA.csv'),
+        usecols=['MU_GLOBAL', 'T_USDA_TEX_CLASS']
+    )
+    mus = np.unique(hwsd_table.MU_GLOBAL[hwsd_table.T_USDA_TEX_CLASS.notna()])
+    hwsd = _blocky_field(rng, shape, 2*ratio, rng.choice(mus, 50).astype(np.int32))
+    write_raster(path('gis/hwsd.tif'), hwsd, hgt, -9999.)
+
+    # monthly LAI and albedo at twice the land cover pixel size, starting at
+    # the template origin like the snapped land cover
+    lshape = (rows*ratio // 2, cols*ratio // 2)
+    lgt = (x0, 2*res, 0, y0, 0, -2*res)
+    for name, low, high in (('lai', 5000, 60000), ('albedo', 50, 300)):
+        os.makedirs(path(name), exist_ok=True)
+        for month in range(12):
+            values = low + (high - low) * _smooth_field(rng, lshape, ratio)
+            write_raster(path('{0}/{1}.tif'.format(name, month)),
+                         values.astype(np.uint16), lgt)
+
+    # daily forcings, with latitudes from north to south like AgERA5
+    os.makedirs(path('weather'), exist_ok=True)
+    lons = np.arange(x0 - FORCING_SIZE, x1 + FORCING_SIZE, FORCING_SIZE) + FORCING_SIZE/2
+    lats = np.arange(y0 + FORCING_SIZE, y1 - FORCING_SIZE, -FORCING_SIZE) - FORCING_SIZE/2
+    fshape = (lats.size, lons.size)
+    base = {
+        'tmax': 295 + 8*_smooth_field(rng, fshape, 2),
+        'tmin': 282 + 8*_smooth_field(rng, fshape, 2),
+        'precip': 4*_smooth_field(rng, fshape, 2),
+        'wind': 1 + 3*_smooth_field(rng, fshape, 2),
+    }
+    start = datetime(year, 1, 1)
+    for day in range(days):
+        date = start + timedelta(days=day)
+        season = np.cos(2*np.pi*(day - 200) / 365.)
+        for var, prefix in VAR_PREFIX.items():
+            array = base[var] + rng.normal(0, 0.5, fshape)
+            if var in ('tmax', 'tmin'):
+                array = array + 10*season
+            else:
+                array = np.clip(array, 0, None)
+            write_forcing_day(
+                path('weather/{0}-{1}.nc'.format(prefix, date.strftime('%Y%m%d'))),
+                VAR_NCNAME[var], array.astype(np.float32), lats, lons, date
+            )
+    end = start + timedelta(days=days - 1)
+
+    config = {
+        'workdir': folder,
+        'mask': 'gis/grid.tif',
+        'grid': {'shapefile': 'basin.shp', 'gridSize': GRID_SIZE},
+        'climatology': {
+            'prefix': 'weather/{0}-'.format(VAR_PREFIX['precip']),
+            'start': start.strftime('%Y-%m-%d'),
+            'end': end.strftime('%Y-%m-%d'),
+            'output': 'gis/precip.tif',
+            'statistic': 'mean'
+        },
+        'snap': [
+            {'input': 'gis/dem.tif', 'output': 'gis/dem-snap.tif', 'subGrid': True, 'resample': 'bilinear'},
+            {'input': 'gis/dem.tif', 'output': 'gis/dem-avg.tif', 'subGrid': False, 'resample': 'bilinear'},
+            {'input': 'gis/slope.tif', 'output': 'gis/slope-avg.tif', 'subGrid': False, 'resample': 'mean'},
+            {'input': 'gis/landcover.tif', 'output': 'gis/lc-igbp.tif', 'subGrid': True, 'resample': 'nearest'},
+            {'input': 'gis/hwsd.tif', 'output': 'gis/soils-agg.tif', 'subGrid': False, 'resample': 'mode'},
+            {'input': 'gis/precip.tif', 'output': 'gis/precip-snap.tif', 'subGrid': False, 'resample': 'mode'},
+        ],
+        'soil': {
+            'hwsd': 'gis/soils-agg.tif',
+            'elevation': 'gis/dem-avg.tif',
+            'precip': 'gis/precip-snap.tif',
+            'slope': 'gis/slope-avg.tif',
+            'output': 'params/soil.param'
+        },
+        'snow': {
+            'elevation': 'gis/dem-snap.tif',
+            'output': 'params/snow.param',
+            'interval': 5
+        },
+        'veg': {
+            'landcover': 'gis/lc-igbp.tif',
+            'output': 'params/veg.param',
+            'scheme': 'IGBP'
+        },
+        'veglib': {
+            'landcover': 'gis/lc-igbp.tif',
+            'lai': 'lai',
+            'albedo': 'albedo',
+            'output': 'params/veg.lib',
+            'scheme': 'IGBP'
+        },
+    }
+    # format_meteo_forcing reads whole years of daily files
+    if end.month == 12 and end.day == 31:
+        config['forcing'] = {
+            'weather': 'weather',
+            'output': 'forcing',
+            'start': start.year,
+            'end': end.year
+        }
+    with open(path('domain.json'), 'w') as f:
+        json.dump(config, f, indent=4)
+    return config
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Create a synthetic VIC domain')
+    parser.add_argument('folder', help='output folder')
+    parser.add_argument('--rows', type=int, default=40)
+    parser.add_argument('--cols', type=int, default=60)
+    parser.add_argument('--ratio', type=int, default=10)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--year', type=int, default=2010)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    make_synthetic_domain(
+        args.folder, args.rows, args.cols, args.ratio, args.days, args.year,
+        args.seed
+    )
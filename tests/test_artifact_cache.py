@@ -0,0 +1,113 @@
+import os
+import numpy as np
+
+from artifact_cache import ArtifactCache, input_digest
+
+
+def _age(cache, key, seconds, suffix='.pkl'):
+    # sets the last use of an artifact seconds ago
+    path = cache.path(key) + suffix
+    t = os.path.getmtime(path) - seconds
+    os.utime(path, (t, t))
+
+
+def test_key_depends_on_inputs_and_arguments(tmp_path):
+    cache = ArtifactCache(str(tmp_path / 'cache'))
+    src = tmp_path / 'input.txt'
+    src.write_text('a')
+    key = cache.key('table', [str(src)], interval=5)
+    assert key.startswith('table-')
+    assert cache.key('table', [str(src)], interval=5) == key
+    assert cache.key('table', [str(src)], interval=10) != key
+    assert cache.key('other', [str(src)], interval=5) != key
+    src.write_text('b')
+    assert cache.key('table', [str(src)], interval=5) != key
+
+
+def test_input_digest_of_arrays():
+    a = np.arange(6).reshape(2, 3)
+    assert input_digest(a) == input_digest(a.copy())
+    assert input_digest(a) != input_digest(a.reshape(3, 2))
+    assert input_digest(a) != input_digest(a.astype(np.float64))
+    gt = (0., 1., 0., 0., 0., -1.)
+    assert input_digest((a, gt)) != input_digest((a, gt[:5] + (-2.,)))
+
+
+def test_get_put(tmp_path):
+    cache = ArtifactCache(str(tmp_path))
+    assert cache.get('missing') is None
+    assert cache.get('missing', 1) == 1
+    value = {'cellid': np.arange(3), 'name': 'x'}
+    assert cache.put('k', value) is value
+    out = cache.get('k')
+    assert np.array_equal(out['cellid'], value['cellid'])
+    assert out['name'] == 'x'
+
+
+def test_get_put_file(tmp_path):
+    cache = ArtifactCache(str(tmp_path / 'cache'))
+    src = tmp_path / 'src.tif'
+    src.write_bytes(b'raster')
+    dst = tmp_path / 'dst.tif'
+    assert not cache.get_file('f', str(dst))
+    cache.put_file('f', str(src))
+    assert cache.get_file('f', str(dst))
+    assert dst.read_bytes() == b'raster'
+
+
+def test_cached_calls_once(tmp_path):
+    cache = ArtifactCache(str(tmp_path))
+    calls = []
+
+    def build(n):
+        calls.append(n)
+        return list(range(n))
+
+    assert cache.cached('k', build, 3) == [0, 1, 2]
+    assert cache.cached('k', build, 3) == [0, 1, 2]
+    assert calls == [3]
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_bytes=1 << 20)
+    blob = np.zeros(40000, dtype=np.uint8)
+    for k, age in (('a', 30), ('b', 20), ('c', 10)):
+        cache.put(k, blob)
+        _age(cache, k, age)
+    # reading a refreshes it, so b is the least recently used one
+    cache.get('a')
+    (tmp_path / 'partial.pkl.1.tmp').write_bytes(b'x' * 100)
+    cache.max_bytes = 2 * 40000 + 1000
+    cache.evict()
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+    # files being written are never evicted
+    assert (tmp_path / 'partial.pkl.1.tmp').exists()
+
+
+def test_clear(tmp_path):
+    cache = ArtifactCache(str(tmp_path))
+    cache.put('k', 1)
+    cache.clear()
+    assert cache.get('k') is None
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_files_removed_by_another_process(tmp_path, monkeypatch):
+    cache = ArtifactCache(str(tmp_path), max_bytes=0)
+    cache._touch(cache.path('gone') + '.pkl')
+    assert not cache.get_file('gone', str(tmp_path / 'dst'))
+    # listed, then removed before evict stats or removes it
+    listdir = os.listdir
+    monkeypatch.setattr(os, 'listdir', lambda root: listdir(root) + ['gone.pkl'])
+    cache.evict()
+    remove = os.remove
+
+    def remove_twice(path):
+        remove(path)
+        remove(path)
+
+    cache.put('k', 1)
+    monkeypatch.setattr(os, 'remove', remove_twice)
+    cache.evict()
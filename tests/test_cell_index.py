@@ -0,0 +1,53 @@
+import numpy as np
+
+from cell_index import cell_coordinates, cell_table, select_cells
+
+GT = (-85., 0.5, 0., 34., 0., -0.5)
+
+
+def _mask():
+    mask = np.zeros((4, 5), dtype=np.uint8)
+    mask[0, 1] = mask[1, 3] = mask[2, 0] = mask[3, 4] = 1
+    mask[2, 2] = 2
+    return mask
+
+
+def test_cell_ids_are_grid_positions():
+    mask = _mask()
+    cells = cell_table(mask, GT)
+    rows, cols = np.nonzero(mask == 1)
+    assert np.array_equal(cells['row'], rows)
+    assert np.array_equal(cells['col'], cols)
+    assert np.array_equal(cells['cellid'], rows*5 + cols + 1)
+    assert cells['shape'] == (4, 5)
+    lats, lons = cell_coordinates(GT, mask.shape)
+    assert np.array_equal(cells['lat'], lats[rows])
+    assert np.array_equal(cells['lon'], lons[cols])
+
+
+def test_active_cells():
+    mask = _mask()
+    cells = cell_table(mask, GT, mask >= 1)
+    assert cells['cellid'].tolist() == [2, 9, 11, 13, 20]
+
+
+def test_tile_ids_match_the_whole_grid():
+    mask = _mask()
+    whole = cell_table(mask, GT)
+    window = (1, 2, 3, 3)
+    tile = mask[1:4, 2:5]
+    cells = cell_table(tile, GT, None, window, mask.shape)
+    keep = (whole['row'] >= 1) & (whole['col'] >= 2)
+    for k in ('cellid', 'lat', 'lon'):
+        assert np.array_equal(cells[k], whole[k][keep])
+    # rows and columns index the tile
+    assert np.array_equal(cells['row'], whole['row'][keep] - 1)
+    assert np.array_equal(cells['col'], whole['col'][keep] - 2)
+    assert cells['shape'] == mask.shape
+
+
+def test_select_cells():
+    cells = cell_table(_mask(), GT)
+    out = select_cells(cells, cells['cellid'] > 5)
+    assert out['cellid'].tolist() == [9, 11, 20]
+    assert out['shape'] == cells['shape']
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from incremental import grid_offset, soil_file_defaults, splice_param_file
+
+
+def _changes(old_ids, new_ids):
+    return {'old_ids': np.array(old_ids), 'new_ids': np.array(new_ids)}
+
+
+def test_grid_offset():
+    old = (-85., 0.5, 0., 34., 0., -0.5)
+    assert grid_offset(old, old) == (0, 0)
+    assert grid_offset(old, (-86., 0.5, 0., 35., 0., -0.5)) == (2, 2)
+    with pytest.raises(ValueError):
+        grid_offset(old, (-85.25, 0.5, 0., 34., 0., -0.5))
+    with pytest.raises(ValueError):
+        grid_offset(old, (-85., 0.25, 0., 34., 0., -0.25))
+
+
+def test_splice_soil(tmp_path):
+    output, part = tmp_path / 'soil.param', tmp_path / 'added'
+    output.write_text('1\t1\t33.9\t-85.1\n1\t2\t33.9\t-85.0\n1\t5\t33.8\t-85.1\n')
+    part.write_text('1\t4\t33.9\t-84.9\n')
+    # cell 2 removed, the grid grew one column to the left
+    n = splice_param_file(str(output), str(part), _changes([1, 5], [2, 7]), 'soil')
+    assert n == 3
+    assert output.read_text() == ('1\t2\t33.9\t-85.1\n1\t4\t33.9\t-84.9\n'
+                                  '1\t7\t33.8\t-85.1\n')
+
+
+def test_splice_veg_records(tmp_path):
+    output, part = tmp_path / 'veg.param', tmp_path / 'added'
+    output.write_text('1 2\n\t0 0.5000 0.1 1\n\t3 0.5000 0.1 1\n3 1\n\t4 1.0000 0.1 1\n')
+    part.write_text('2 1\n\t5 1.0000 0.1 1\n')
+    n = splice_param_file(str(output), str(part), _changes([1, 3], [1, 3]), 'veg')
+    assert n == 3
+    assert output.read_text() == ('1 2\n\t0 0.5000 0.1 1\n\t3 0.5000 0.1 1\n'
+                                  '2 1\n\t5 1.0000 0.1 1\n3 1\n\t4 1.0000 0.1 1\n')
+
+
+def test_splice_snow_without_added_cells(tmp_path):
+    output = tmp_path / 'snow.param'
+    output.write_text('1\t0.6000\t0.4000\t100.0000\t110.0000\t0.6000\t0.4000\t\n'
+                      '2\t1.0000\t0.0000\t100.0000\t0.0000\t1.0000\t0.0000\t\n')
+    # the only cell with two bands is removed, the file shrinks to one band
+    n = splice_param_file(str(output), None, _changes([2], [2]), 'snow')
+    assert n == 1
+    assert output.read_text() == '2\t1.0000\t100.0000\t1.0000\t\n'
+
+
+def test_soil_file_defaults(tmp_path):
+    path = tmp_path / 'soil.param'
+    assert soil_file_defaults(str(path)) == {}
+    path.write_text('')
+    assert soil_file_defaults(str(path)) == {}
+    path.write_text('1\t5\t33.9\t-85.1\t0.2000\t0.0010\t10.5\t0.9000\t2\n'
+                    '1\t7\t33.8\t-85.1\t0.2000\t0.0010\t9.5\t0.9000\t2\n')
+    assert soil_file_defaults(str(path)) == {'b_val': 0.2, 'Ds_val': 0.001,
+                                             'Ws_val': 0.9}
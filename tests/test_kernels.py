@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+import kernels
+
+
+def _data(seed, npix=4000, ncells=60):
+    rng = np.random.default_rng(seed)
+    inv = rng.integers(0, ncells, npix)
+    elv = rng.random(npix) * 400 - 20
+    elv[rng.random(npix) < 0.05] = np.nan
+    # cells with no pixels and cells with only missing pixels
+    inv[inv == 7] = 8
+    elv[inv == 9] = np.nan
+    return inv, elv, ncells
+
+
+def _loop_classes(inv, elv, ncells, interval):
+    # band limits and classes of each cell computed one cell at a time, as the
+    # original formatter did
+    nlimits = np.zeros(ncells, dtype=np.int64)
+    bcls = np.full(elv.size, -1, dtype=np.int64)
+    for c in range(ncells):
+        pix = np.flatnonzero(inv == c)
+        tmp = elv[pix]
+        data = tmp[~np.isnan(tmp)].astype(np.int64)
+        low, high = (data.min(), data.max()) if data.size else (0, 0)
+        bands = np.arange(low - low % interval, high + high % interval + interval,
+                          interval)
+        nlimits[c] = bands.size
+        for b in range(bands.size - 1):
+            bcls[pix[(tmp >= bands[b]) & (tmp < bands[b+1])]] = b
+    return nlimits, bcls
+
+
+@pytest.mark.parametrize('interval', [1, 7, 50, 500])
+def test_snow_band_classes_numpy(interval):
+    inv, elv, ncells = _data(interval)
+    nlimits, bcls = kernels._snow_band_classes_numpy(inv, elv, ncells, interval)
+    ref_nlimits, ref_bcls = _loop_classes(inv, elv, ncells, interval)
+    assert np.array_equal(nlimits, ref_nlimits)
+    assert np.array_equal(bcls, ref_bcls)
+
+
+@pytest.mark.parametrize('interval', [1, 7, 50, 500])
+def test_snow_band_classes_numba(interval):
+    pytest.importorskip('numba')
+    inv, elv, ncells = _data(interval + 1)
+    out = kernels._snow_band_classes_numba(inv, elv, ncells, interval)
+    ref = kernels._snow_band_classes_numpy(inv, elv, ncells, interval)
+    for a, b in zip(out, ref):
+        assert np.array_equal(a, b)
+
+
+@pytest.mark.parametrize('use_numba', [False, True])
+def test_snow_band_classes_integer_interval(monkeypatch, use_numba):
+    if use_numba:
+        pytest.importorskip('numba')
+    monkeypatch.setattr(kernels, 'USE_NUMBA', use_numba)
+    inv, elv, ncells = _data(3)
+    out = kernels.snow_band_classes(inv, elv, ncells, 7.5)
+    ref = _loop_classes(inv, elv, ncells, 7)
+    for a, b in zip(out, ref):
+        assert np.array_equal(a, b)
+
+
+def test_modal_fill_numpy():
+    # last column counts the no data pixels, the last class is not a candidate
+    hist = np.array([[1, 3, 3, 9, 4],
+                     [0, 0, 0, 5, 2],
+                     [2, 0, 1, 0, 0]])
+    out = kernels._modal_fill_numpy(hist, 4)
+    assert out.tolist() == [[1, 7, 3, 9], [2, 0, 0, 5], [2, 0, 1, 0]]
+
+
+def test_modal_fill_numba():
+    pytest.importorskip('numba')
+    rng = np.random.default_rng(0)
+    hist = rng.integers(0, 4, (500, 18))
+    hist[::7, :16] = 0
+    assert np.array_equal(kernels._modal_fill_numba(hist, 17),
+                          kernels._modal_fill_numpy(hist, 17))
@@ -0,0 +1,158 @@
+import numpy as np
+import pytest
+
+from param_files import (SOIL_FIELDS, read_soil, read_snow, read_veg,
+                         read_veglib, read_param_file, consistency_index)
+
+NSOIL = sum(n for _, n in SOIL_FIELDS)
+
+
+def _soil_line(run, cellid):
+    values = [run, cellid] + [0.25 + k for k in range(NSOIL - 3)] + [0]
+    return '\t'.join(str(v) for v in values) + '\n'
+
+
+VEG = ('3 2\n'
+       '\t0 0.2500 0.1 0.7 0.5 0.2 1.0 0.1\n'
+       '\t5 0.7500 0.1 0.6 0.5 0.3 1.0 0.1\n'
+       '4 1\n'
+       '\t2 1.0000 0.1 0.7 0.5 0.2 1.0 0.1\n')
+
+
+def _monthly(values):
+    return '\t\t' + '\t'.join('{:.4f}'.format(v) for v in values) + '\n'
+
+
+def test_read_soil(tmp_path):
+    path = tmp_path / 'soil.param'
+    path.write_text(_soil_line(1, 3) + _soil_line(0, 4))
+    soil = read_soil(str(path))
+    assert soil['run'].tolist() == [1, 0]
+    assert soil['gridcel'].tolist() == [3, 4]
+    assert soil['gridcel'].dtype == np.int64
+    assert soil['expt'].shape == (2, 3)
+    assert soil['expt'][0].tolist() == [7.25, 8.25, 9.25]
+    assert soil['fs_active'].tolist() == [0, 0]
+
+
+def test_read_soil_columns(tmp_path):
+    path = tmp_path / 'soil.param'
+    path.write_text('1\t3\t33.9\n')
+    with pytest.raises(ValueError):
+        read_soil(str(path))
+
+
+def test_read_snow(tmp_path):
+    path = tmp_path / 'snow.param'
+    path.write_text('3\t0.6000\t0.4000\t100.5000\t110.0000\t0.5000\t0.5000\t\n'
+                    '4\t1.0000\t0.0000\t90.0000\t0.0000\t1.0000\t0.0000\t\n')
+    snow = read_snow(str(path))
+    assert snow['cellid'].tolist() == [3, 4]
+    assert snow['area'].tolist() == [[0.6, 0.4], [1., 0.]]
+    assert snow['elevation'].tolist() == [[100.5, 110.], [90., 0.]]
+    assert snow['precip'].tolist() == [[0.5, 0.5], [1., 0.]]
+
+
+def test_read_empty_files(tmp_path):
+    path = tmp_path / 'empty'
+    path.write_text('')
+    assert read_soil(str(path))['expt'].shape == (0, 3)
+    assert read_snow(str(path))['area'].shape == (0, 0)
+    veg = read_veg(str(path))
+    assert veg['cellid'].size == 0 and veg['root_depth'].shape == (0, 0)
+
+
+def test_read_veg(tmp_path):
+    path = tmp_path / 'veg.param'
+    path.write_text(VEG)
+    veg = read_veg(str(path))
+    assert veg['cellid'].tolist() == [3, 4]
+    assert veg['nveg'].tolist() == [2, 1]
+    assert veg['cell'].tolist() == [0, 0, 1]
+    assert veg['vegclass'].tolist() == [0, 5, 2]
+    assert veg['Cv'].tolist() == [0.25, 0.75, 1.]
+    assert veg['root_depth'].tolist() == [[0.1, 0.5, 1.]] * 3
+    assert veg['root_fract'][1].tolist() == [0.6, 0.3, 0.1]
+    assert 'lai' not in veg
+
+
+def test_read_veg_monthly(tmp_path):
+    lines = VEG.splitlines(True)
+    text = ''
+    for k, line in enumerate(lines):
+        text += line
+        if line.startswith('\t'):
+            text += _monthly(np.arange(12) + k) + _monthly(np.full(12, 0.1*k))
+    path = tmp_path / 'veg.param'
+    path.write_text(text)
+    veg = read_veg(str(path))
+    assert veg['Cv'].tolist() == [0.25, 0.75, 1.]
+    assert veg['lai'].shape == (3, 12)
+    assert veg['lai'][:, 0].tolist() == [1., 2., 4.]
+    assert np.allclose(veg['albedo'][:, 11], [0.1, 0.2, 0.4])
+
+
+def test_read_veg_without_classes(tmp_path):
+    path = tmp_path / 'veg.param'
+    path.write_text('1 0\n3 0\n')
+    veg = read_veg(str(path))
+    assert veg['nveg'].tolist() == [0, 0]
+    assert veg['Cv'].size == 0
+    assert veg['root_depth'].shape == (0, 0)
+
+
+def test_read_veglib(tmp_path):
+    row = ['1', '1', '60', '250'] + ['3.0'] * 48 + ['20', '100', '0.5', '0.5', '0.2']
+    path = tmp_path / 'veglib'
+    path.write_text('#Class\tOvrStry\n' + '\t'.join(row + ['Evergreen Needleleaf Trees']) + '\n')
+    lib = read_veglib(str(path))
+    assert lib['vegclass'].tolist() == [1]
+    assert lib['lai'].shape == (1, 12)
+    assert lib['trunk_ratio'].tolist() == [0.2]
+    assert lib['comment'].tolist() == ['Evergreen Needleleaf Trees']
+
+
+def test_cache(tmp_path):
+    path = tmp_path / 'veg.param'
+    path.write_text(VEG)
+    cache = str(tmp_path / 'cache')
+    first = read_param_file(str(path), 'veg', cache)
+    again = read_param_file(str(path), 'veg', cache)
+    assert isinstance(again['Cv'], np.memmap)
+    for k in first:
+        assert np.array_equal(first[k], again[k])
+    # a changed file is read again
+    path.write_text(VEG.replace('4 1', '5 1'))
+    assert read_param_file(str(path), 'veg', cache)['cellid'].tolist() == [3, 5]
+
+
+def _tables():
+    soil = {'gridcel': np.array([3, 4, 8]), 'run': np.array([1, 1, 0])}
+    snow = {'cellid': np.array([3, 4])}
+    veg = {'cellid': np.array([3, 4]), 'cell': np.array([0, 0, 1]),
+           'Cv': np.array([0.25, 0.75, 1.])}
+    return soil, snow, veg
+
+
+def test_consistency_ok():
+    index = consistency_index(*_tables())
+    assert index['ok']
+    assert index['position']['snow'][[3, 4, 8]].tolist() == [0, 1, -1]
+    assert index['position']['soil'][8] == 2
+
+
+def test_consistency_problems():
+    soil, snow, veg = _tables()
+    snow['cellid'] = np.array([4, 4, 8])
+    veg['cellid'] = np.array([3, 4, 6])
+    veg['cell'] = np.array([0, 0, 1])
+    veg['Cv'] = np.array([0.25, 0.7, 1.])
+    index = consistency_index(soil, snow, veg)
+    assert not index['ok']
+    assert index['missing_snow'].tolist() == [3]
+    assert index['extra_snow'].tolist() == [8]
+    assert index['repeated_snow'].tolist() == [4]
+    assert index['extra_veg'].tolist() == [6]
+    assert index['missing_veg'].size == 0
+    # cell 3 sums 0.95 and cell 6 has no classes
+    assert index['cv_sum'].tolist() == [3, 6]
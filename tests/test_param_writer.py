@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+import param_writer
+from param_writer import format_column, join_columns, write_lines
+
+
+def test_format_column():
+    values = np.array([0.1, 1/3, 2.0])
+    assert format_column(values) == [str(v) for v in values.tolist()]
+    assert format_column(values, '{:.4f}') == ['0.1000', '0.3333', '2.0000']
+    assert format_column(np.array([1, 2], dtype=np.int64)) == ['1', '2']
+
+
+def test_join_columns():
+    lines = join_columns([(np.array([1, 2]), '{}'), 'x',
+                          ['a', 'b'], (np.array([0.5, 0.25]), '{:.2f}')])
+    assert lines == ['1\tx\ta\t0.50', '2\tx\tb\t0.25']
+    lines = join_columns([(np.array([1, 2]), '{}'), ['a', 'b']], sep=' ', end='\n')
+    assert lines == ['1 a\n', '2 b\n']
+
+
+def test_join_columns_needs_a_column():
+    with pytest.raises(ValueError):
+        join_columns(['x', 'y'])
+
+
+def test_write_lines(tmp_path, monkeypatch):
+    # blocks smaller than the file
+    monkeypatch.setattr(param_writer, 'CHUNK_LINES', 3)
+    lines = ['{0}\n'.format(k) for k in range(10)]
+    path = str(tmp_path / 'out.txt')
+    write_lines(path, lines)
+    with open(path) as f:
+        assert f.read() == ''.join(lines)
+    write_lines(path, ['end\n'], 'a')
+    with open(path) as f:
+        assert f.read() == ''.join(lines) + 'end\n'
+    write_lines(path, [])
+    with open(path) as f:
+        assert f.read() == ''
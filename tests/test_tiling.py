@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from tiling import (tile_windows, tile_output, snow_line_bands, pad_snow_line,
+                    merge_param_files, read_param_records)
+
+
+def _snow_line(cellid, area, elevation, precip):
+    values = [str(cellid)] + ['{:.4f}'.format(v) for v in area + elevation + precip]
+    return '\t'.join(values) + '\t\n'
+
+
+def test_tile_windows():
+    mask = np.zeros((5, 7), dtype=np.uint8)
+    mask[0, 0] = mask[4, 6] = 1
+    mask[3, 1] = 2
+    assert tile_windows(mask, 2, 3) == [(0, 0, 2, 3), (2, 0, 2, 3), (4, 6, 1, 1)]
+
+
+def test_tile_output():
+    assert tile_output('params/snow.param', (64, 128, 64, 64)) == \
+        'params/snow.param.tiles/snow_00064_00128.param'
+
+
+def test_snow_line_bands():
+    assert snow_line_bands(_snow_line(1, [0.6, 0.4, 0], [100, 110, 0], [0.6, 0.4, 0])) == 2
+    assert snow_line_bands(_snow_line(1, [1, 0], [100, 0], [1, 0])) == 1
+    assert snow_line_bands(_snow_line(1, [0, 0], [0, 0], [0, 0])) == 0
+    # a band with zero area but an elevation is kept
+    assert snow_line_bands(_snow_line(1, [1, 0], [100, 120], [1, 0])) == 2
+
+
+def test_pad_snow_line():
+    line = _snow_line(7, [0.6, 0.4], [100, 110], [0.5, 0.5])
+    assert pad_snow_line(line, 2) is line
+    assert pad_snow_line(line, 3) == _snow_line(7, [0.6, 0.4, 0], [100, 110, 0],
+                                                [0.5, 0.5, 0])
+    padded = _snow_line(7, [1, 0, 0], [100, 0, 0], [1, 0, 0])
+    assert pad_snow_line(padded, 1) == _snow_line(7, [1], [100], [1])
+
+
+def test_merge_in_cell_id_order(tmp_path):
+    a, b = tmp_path / 'a', tmp_path / 'b'
+    a.write_text('12 1\n\t0 1.0000 0.1 1\n3 2\n\t1 0.5000 0.1 1\n\t2 0.5000 0.1 1\n')
+    b.write_text('5 1\n\t4 1.0000 0.1 1\n')
+    out = str(tmp_path / 'veg.param')
+    assert merge_param_files([str(a), str(b)], out, 'veg') == 3
+    assert [r[0] for r in read_param_records(out, 'veg')] == [3, 5, 12]
+    with open(out) as f:
+        assert f.read() == ('3 2\n\t1 0.5000 0.1 1\n\t2 0.5000 0.1 1\n'
+                            '5 1\n\t4 1.0000 0.1 1\n12 1\n\t0 1.0000 0.1 1\n')
+
+
+def test_merge_pads_snow_bands(tmp_path):
+    a, b = tmp_path / 'a', tmp_path / 'b'
+    a.write_text(_snow_line(9, [1], [100], [1]))
+    b.write_text(_snow_line(2, [0.6, 0.4, 0], [100, 110, 0], [0.6, 0.4, 0]))
+    out = str(tmp_path / 'snow.param')
+    assert merge_param_files([str(a), str(b)], out, 'snow') == 2
+    with open(out) as f:
+        assert f.read() == (_snow_line(2, [0.6, 0.4], [100, 110], [0.6, 0.4]) +
+                            _snow_line(9, [1, 0], [100, 0], [1, 0]))
+
+
+def test_merge_repeated_cells(tmp_path):
+    a = tmp_path / 'a'
+    a.write_text('1\t4\t33.9\n1\t4\t33.9\n')
+    with pytest.raises(ValueError):
+        merge_param_files([str(a)], str(tmp_path / 'soil.param'), 'soil')
@@ -0,0 +1,306 @@
+import os
+import json
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from param_writer import write_lines
+
+# stages that can run on a tile of the template, named as their config sections
+TILED_STAGES = ('soil', 'snow', 'veg', 'forcing')
+
+# position of the output file in the stage arguments. The forcing files are
+# one per cell, so the tiles write them to the same folder and need no merge
+OUTPUT_ARG = {'soil': 5, 'snow': 2, 'veg': 2}
+
+
+def tile_windows(mask, tile_rows, tile_cols):
+    '''
+    Splits a template grid into tiles of tile_rows by tile_cols cells.
+    Parameters
+    ----------
+    mask : numpy.ndarray
+        template grid array
+    tile_rows, tile_cols: int
+        tile size in cells, the last tiles of each row and column are smaller
+    Returns
+    -------
+    list with the (row_off, col_off, nrows, ncols) window of each tile with
+    active cells (mask >= 1), in row major order
+    '''
+    windows = []
+    nrows, ncols = mask.shape
+    for r0 in range(0, nrows, tile_rows):
+        for c0 in range(0, ncols, tile_cols):
+            tile = mask[r0:r0+tile_rows, c0:c0+tile_cols]
+            if np.any(tile >= 1):
+                windows.append((r0, c0, tile.shape[0], tile.shape[1]))
+    return windows
+
+
+def tile_output(output, window):
+    '''
+    Returns the path of the part of an output file written by a tile, in a
+    <output>.tiles folder next to it.
+    '''
+    name, ext = os.path.splitext(os.path.basename(output))
+    return os.path.join(
+        output + '.tiles', '{0}_{1:05d}_{2:05d}{3}'.format(name, window[0], window[1], ext)
+    )
+
+
+def _load_config(config):
+    if isinstance(config, str):
+        with open(config) as f:
+            config = json.load(f)
+    return config
+
+
+def domain_tiles(config, tile_rows, tile_cols):
+    '''
+    Returns the tile windows of a domain config, see tile_windows. The
+    template grid has to exist already.
+    '''
+    # imported here, the merge and record helpers don't need GDAL
+    from raster_io import read_raster
+    config = _load_config(config)
+    mask = read_raster(os.path.join(config.get('workdir', '.'), config['mask']))[0]
+    return tile_windows(mask, tile_rows, tile_cols)
+
+
+def tile_stages(config, window, stages=TILED_STAGES):
+    '''
+    Returns the pipeline stages of a domain config restricted to a tile. The
+    soil, snow and veg stages write their part of the parameter file to
+    tile_output, the forcing stage writes the files of the tile cells to the
+    forcing folder.
+    '''
+    from pipeline import build_stages
+    config = _load_config(config)
+    out = []
+    for stage in build_stages(config, fused=False):
+        if stage.name not in stages or stage.name not in TILED_STAGES:
+            continue
+        args = list(stage.args)
+        kwargs = dict(stage.kwargs, window=tuple(window))
+        outputs = stage.outputs
+        if stage.name == 'soil':
+            # the parameters taken from the first cell when they are not set
+            # come from the first cell of the domain, not of the tile
+            from format_soil_params import soil_defaults
+            kwargs = dict(soil_defaults(*args[:3]), **kwargs)
+        if stage.name in OUTPUT_ARG:
+            k = OUTPUT_ARG[stage.name]
+            args[k] = tile_output(args[k], window)
+            outputs = [args[k]]
+        if 'qa' in kwargs:
+            # each tile reports the QA of its own forcings
+            kwargs['qa'] = tile_output(kwargs['qa'], window)
+        out.append(stage._replace(args=tuple(args), kwargs=kwargs, outputs=outputs))
+    return out
+
+
+def run_tile(config, window, stages=TILED_STAGES):
+    '''
+    Runs the stages of a single tile in this process, e.g. as a job of a
+    cluster array, see the command line interface.
+    '''
+    from pipeline import _run_stage
+    for stage in tile_stages(config, window, stages):
+        print('Running {0} on tile {1}'.format(stage.name, tuple(window)))
+        _run_stage(stage)
+    return
+
+
+def _soil_records(lines):
+    # one line per cell, the grid cell id is the second column
+    return [(int(line.split(None, 2)[1]), line) for line in lines]
+
+
+def _snow_records(lines):
+    # one line per cell, the grid cell id is the first column
+    return [(int(line.split('\t', 1)[0]), line) for line in lines]
+
+
+def _veg_records(lines):
+    # a cell header line followed by a tab indented line per class
+    records = []
+    for line in lines:
+        if line.startswith('\t'):
+            cellid, text = records[-1]
+            records[-1] = (cellid, text + line)
+        else:
+            records.append((int(line.split(None, 1)[0]), line))
+    return records
+
+
+def snow_line_bands(line):
+    '''
+    Returns the number of bands of a snow parameter line, without the
+    trailing bands padded with zeros.
+    '''
+    values = line.rstrip('\n').rstrip('\t').split('\t')
+    nbands = (len(values) - 1) // 3
+    while nbands > 0 and all(
+            float(values[1 + k*nbands + nbands - 1]) == 0 for k in range(3)):
+        nbands -= 1
+    return nbands
+
+
+def pad_snow_line(line, maxbands):
+    '''
+    Pads the area, elevation and precipitation columns of a snow parameter
+    line with zero bands up to maxbands, or drops zero bands above it.
+    '''
+    values = line.rstrip('\n').rstrip('\t').split('\t')
+    nbands = (len(values) - 1) // 3
+    if nbands == maxbands:
+        return line
+    keep = min(nbands, maxbands)
+    pad = ['0.0000'] * (maxbands - keep)
+    out = [values[0]]
+    for k in range(3):
+        out += values[1 + k*nbands:1 + k*nbands + keep] + pad
+    return '\t'.join(out) + '\t\n'
+
+
+_RECORDS = {'soil': _soil_records, 'snow': _snow_records, 'veg': _veg_records}
+
+
+def read_param_records(path, kind):
+    '''
+    Reads a soil, snow or veg parameter file into a list of (grid cell id,
+    text) records, one per cell, the text with all the lines of the cell.
+    '''
+    with open(path) as f:
+        return _RECORDS[kind](f.readlines())
+
+
+def write_param_records(records, output, kind):
+    '''
+    Writes (grid cell id, text) records of a parameter file in grid cell id
+    order, the order the whole domain is written in. Snow lines are padded to
+    the maximum number of bands of the records.
+    Returns
+    -------
+    number of cells written
+    '''
+    ids = np.array([r[0] for r in records], dtype=np.int64)
+    if np.unique(ids).size != ids.size:
+        raise ValueError('Some cell ids of {0} are repeated'.format(output))
+    lines = [records[k][1] for k in np.argsort(ids, kind='stable')]
+    if kind == 'snow' and lines:
+        maxbands = int(np.max([snow_line_bands(line) for line in lines]))
+        maxbands = maxbands if maxbands > 0 else 1
+        lines = [pad_snow_line(line, maxbands) for line in lines]
+        print('Number of maximum bands: {0}'.format(maxbands))
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    write_lines(output, lines)
+    return len(lines)
+
+
+def merge_param_files(parts, output, kind):
+    '''
+    Merges the tile parts of a parameter file into a single file with the
+    cells in grid cell id order, the order the whole domain is written in.
+    Parameters
+    ----------
+    parts : list
+        paths of the tile files
+    output: str
+        path of the merged parameter file
+    kind: str
+        'soil', 'snow' or 'veg'. Snow lines are padded to the maximum number
+        of bands of all the tiles
+    Returns
+    -------
+    number of cells written
+    '''
+    records = []
+    for part in parts:
+        records += read_param_records(part, kind)
+    return write_param_records(records, output, kind)
+
+
+def merge_tiles(config, windows, stages=TILED_STAGES):
+    '''
+    Merges the tile parts of the soil, snow and veg parameter files of a
+    domain config.
+    '''
+    from pipeline import build_stages
+    config = _load_config(config)
+    for stage in build_stages(config, fused=False):
+        if stage.name not in stages or stage.name not in OUTPUT_ARG:
+            continue
+        output = stage.args[OUTPUT_ARG[stage.name]]
+        parts = [tile_output(output, w) for w in windows]
+        n = merge_param_files(parts, output, stage.name)
+        print('Merged {0} tiles, {1} cells into {2}'.format(len(parts), n, output))
+    return
+
+
+def _run_tile_job(args):
+    run_tile(*args)
+    return args[1]
+
+
+def run_tiled(config, tile_rows, tile_cols, workers=4, stages=TILED_STAGES):
+    '''
+    Builds the soil, snow, veg and forcing files of a domain tile by tile,
+    running the tiles in parallel processes, and merges the parameter files.
+    The template grid and the snapped rasters have to exist already, e.g.
+    built with pipeline.py --only grid snap:...
+    Parameters
+    ----------
+    config : str or dict
+        path to a domain config JSON file, or the loaded config
+    tile_rows, tile_cols: int
+        tile size in template cells
+    workers: int
+        number of tiles processed at the same time
+    stages: list
+        stages to run
+    Returns
+    -------
+    list with the tile windows
+    '''
+    config = _load_config(config)
+    windows = domain_tiles(config, tile_rows, tile_cols)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        jobs = [(config, w, stages) for w in windows]
+        for window in executor.map(_run_tile_job, jobs):
+            print('Finished tile {0}'.format(tuple(window)))
+    merge_tiles(config, windows, stages)
+    return windows
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Build the soil, snow, veg and forcing files of a domain in '
+                    'tiles. Tiles can run here in parallel (default) or as '
+                    'separate jobs with --list, --tile and --merge'
+    )
+    parser.add_argument('config', help='domain config JSON file')
+    parser.add_argument('--tile-size', type=int, nargs=2, default=[100, 100],
+                        metavar=('ROWS', 'COLS'), help='tile size in cells')
+    parser.add_argument('--stages', nargs='+', default=list(TILED_STAGES))
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--list', action='store_true',
+                        help='print the tile windows, one per line')
+    parser.add_argument('--tile', type=int,
+                        help='only run the tile with this index of --list')
+    parser.add_argument('--merge', action='store_true',
+                        help='only merge the tile parts')
+    args = parser.parse_args()
+
+    windows = domain_tiles(args.config, *args.tile_size)
+    if args.list:
+        for k, w in enumerate(windows):
+            print(k, *w)
+    elif args.tile is not None:
+        run_tile(args.config, windows[args.tile], args.stages)
+    elif args.merge:
+        merge_tiles(args.config, windows, args.stages)
+    else:
+        run_tiled(args.config, *args.tile_size, args.workers, args.stages)
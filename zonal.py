@@ -0,0 +1,241 @@
+import numpy as np
+
+from raster_io import open_dataset, read_raster, raster_info, sample_raster
+from instrument import count
+
+# hi res pixels read at once, in whole rows of template cells
+BLOCK_PIXELS = 1 << 22
+
+
+def axis_map(cell_origin, cell_size, pix_origin, pix_size, npix, ncells):
+    '''
+    Returns the template cell index of each pixel along one axis of a raster,
+    -1 for pixels out of the template. A pixel belongs to the cell its center
+    falls in, so any ratio of resolutions works and partial edge cells get
+    the pixels they cover.
+    '''
+    offset = (pix_origin - cell_origin) / cell_size
+    ratio = pix_size / cell_size
+    idx = np.floor(offset + (np.arange(npix) + 0.5)*ratio).astype(np.int64)
+    idx[(idx < 0) | (idx >= ncells)] = -1
+    return idx
+
+
+def _accumulate(out, index, weights=None):
+    # adds the (weighted) counts of index to out, only over the range of
+    # cells of a block
+    if index.size == 0:
+        return
+    k0, k1 = index.min(), index.max() + 1
+    out[k0:k1] += np.bincount(index - k0, weights, k1 - k0)
+
+
+def sample_points(src, ys, xs, band=1):
+    '''
+    Returns the values of a raster input at a set of points, as float64 with
+    NaN out of the raster and at no data. The points have to be sorted by
+    row, as pixels read row by row are.
+    '''
+    gt, shape = raster_info(src)
+    rows = np.floor((ys - gt[3]) / gt[5]).astype(np.int64)
+    cols = np.floor((xs - gt[0]) / gt[1]).astype(np.int64)
+    inside = (rows >= 0) & (rows < shape[0]) & (cols >= 0) & (cols < shape[1])
+    out = np.full(ys.size, np.nan)
+    values, _, nodata = sample_raster(src, rows[inside], cols[inside], band)
+    values = values.astype(np.float64)
+    if nodata is not None:
+        values[values == nodata] = np.nan
+    out[inside] = values
+    return out
+
+
+class CellZones(object):
+    '''
+    Pixels of a hi res raster under each active cell of a template grid,
+    matched through the geotransforms of both. The raster is read lazily in
+    blocks of whole template rows, so every cell is complete in a single
+    block and any per-cell statistic can be computed block by block.
+    Parameters
+    ----------
+    cells : dict
+        active cells, see cell_index.cell_table. The rows and columns index
+        the template array the cells were taken from
+    cell_gt: tuple
+        geotransform of that template array (of the tile if it's a tile)
+    src: str, gdal.Dataset or tuple
+        hi res raster input, see raster_io.read_raster. It needs a
+        geotransform
+    band: int (optional)
+        band to read
+    block_pixels: int (optional)
+        approximate number of pixels read at once
+    '''
+    def __init__(self, cells, cell_gt, src, band=1, block_pixels=BLOCK_PIXELS):
+        # files are opened once for all the blocks
+        if isinstance(src, str):
+            src = open_dataset(src)
+        pix_gt, pix_shape = raster_info(src)
+        if pix_gt is None:
+            raise ValueError('Zonal statistics need a raster with a geotransform')
+        nrows = int(cells['row'].max()) + 1 if cells['row'].size else 0
+        ncols = int(cells['col'].max()) + 1 if cells['col'].size else 0
+        self.src = src
+        self.band = band
+        self.pix_gt = pix_gt
+        self.size = cells['row'].size
+        self.row_map = axis_map(cell_gt[3], cell_gt[5], pix_gt[3], pix_gt[5],
+                                pix_shape[0], nrows)
+        self.col_map = axis_map(cell_gt[0], cell_gt[1], pix_gt[0], pix_gt[1],
+                                pix_shape[1], ncols)
+        # position of each active cell in the cell table, -1 elsewhere
+        self.lut = np.full((nrows, ncols), -1, dtype=np.int64)
+        self.lut[cells['row'], cells['col']] = np.arange(self.size)
+        self.block_pixels = block_pixels
+
+    def blocks(self, *others, rows=None):
+        '''
+        Yields the (zone, values) arrays of the pixels of each block, with
+        zone the position of the pixel cell in the cell table. Pixels are in
+        row major order and values keep the raster data type. Other raster
+        inputs given are sampled at each pixel center (see sample_points) and
+        their arrays are yielded after values, e.g. a precipitation
+        climatology to weight the pixels with. If rows, a (first, last + 1)
+        range of template rows, is given only the blocks of those rows are
+        read, so a caller can walk the template in strips.
+        '''
+        if self.size == 0:
+            return
+        others = [open_dataset(o) if isinstance(o, str) else o for o in others]
+        first, last = (0, self.lut.shape[0]) if rows is None else rows
+        cols = np.nonzero(self.col_map >= 0)[0]
+        rows = np.nonzero(self.row_map >= 0)[0]
+        if cols.size == 0 or rows.size == 0:
+            return
+        q0, q1 = cols[0], cols[-1] + 1
+        # template rows per block
+        pixels_per_row = (q1 - q0) * max(1, rows.size // self.lut.shape[0])
+        step = max(1, self.block_pixels // pixels_per_row)
+        active_rows = np.nonzero((self.lut >= 0).any(axis=1))[0]
+        for r0 in range(first, last, step):
+            r1 = min(r0 + step, last)
+            if not np.any((active_rows >= r0) & (active_rows < r1)):
+                continue
+            prow = rows[(self.row_map[rows] >= r0) & (self.row_map[rows] < r1)]
+            if prow.size == 0:
+                continue
+            p0, p1 = prow[0], prow[-1] + 1
+            values = read_raster(self.src, self.band,
+                                 (p0, q0, p1 - p0, q1 - q0))[0]
+            rmap = self.row_map[p0:p1]
+            cmap = self.col_map[q0:q1]
+            zone = np.where((rmap[:, None] >= 0) & (cmap[None, :] >= 0),
+                            self.lut[rmap[:, None], cmap[None, :]], -1)
+            keep = zone >= 0
+            if not keep.any():
+                # no pixel of the block falls on an active cell, e.g. where
+                # the hi res raster doesn't cover them
+                continue
+            count('pixels', int(keep.sum()))
+            out = (zone[keep], values[keep])
+            if others:
+                prow, pcol = np.nonzero(keep)
+                ys = self.pix_gt[3] + (prow + p0 + 0.5)*self.pix_gt[5]
+                xs = self.pix_gt[0] + (pcol + q0 + 0.5)*self.pix_gt[1]
+                out += tuple(sample_points(o, ys, xs, self.band) for o in others)
+            yield out
+
+    def count(self, where=None):
+        '''
+        Returns the number of pixels of each cell, only those where the
+        callable where(values) is True if it is given.
+        '''
+        out = np.zeros(self.size, dtype=np.int64)
+        for zone, values in self.blocks():
+            if where is not None:
+                zone = zone[where(values)]
+            _accumulate(out, zone)
+        return out
+
+    def mean(self, where=None):
+        '''
+        Returns the mean value of each cell, NaN for cells without pixels.
+        '''
+        total = np.zeros(self.size)
+        n = np.zeros(self.size)
+        for zone, values in self.blocks():
+            if where is not None:
+                keep = where(values)
+                zone, values = zone[keep], values[keep]
+            _accumulate(total, zone, values.astype(np.float64))
+            _accumulate(n, zone)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return total / n
+
+    def histogram(self, nbins, labels=None, rows=None, out=None):
+        '''
+        Returns the (cells, nbins) pixel count of each bin, with the bin of
+        each pixel given by the callable labels(values), or the values
+        themselves. Pixels out of [0, nbins) are not counted. The counts of
+        the template rows given (see blocks) are added to out if it is given.
+        '''
+        if out is None:
+            out = np.zeros((self.size, nbins), dtype=np.int64)
+        for zone, values in self.blocks(rows=rows):
+            bins = values if labels is None else labels(values)
+            bins = np.asarray(bins, dtype=np.int64)
+            keep = (bins >= 0) & (bins < nbins)
+            _accumulate(out.reshape(-1), zone[keep]*nbins + bins[keep])
+        return out
+
+    def histogram_sums(self, nbins, others, labels=None, rows=None, out=None):
+        '''
+        Returns the histogram of the cells (see histogram) and, in the same
+        pass, the sums of other raster inputs sampled at the pixels of each
+        cell and bin (see blocks), to average them by cell and class.
+        Returns
+        -------
+        (counts, sums, n) with the (cells, nbins) pixel counts and the
+        (len(others), cells, nbins) sums and numbers of the samples with
+        data. If out, a tuple like the returned one, is given the values of
+        the template rows given are added to it
+        '''
+        if out is None:
+            out = (np.zeros((self.size, nbins), dtype=np.int64),
+                   np.zeros((len(others), self.size, nbins)),
+                   np.zeros((len(others), self.size, nbins), dtype=np.int64))
+        counts, sums, n = out
+        for zone, values, *samples in self.blocks(*others, rows=rows):
+            bins = values if labels is None else labels(values)
+            bins = np.asarray(bins, dtype=np.int64)
+            keep = (bins >= 0) & (bins < nbins)
+            key = zone[keep]*nbins + bins[keep]
+            _accumulate(counts.reshape(-1), key)
+            for k, sample in enumerate(samples):
+                sample = sample[keep]
+                data = ~np.isnan(sample)
+                _accumulate(sums[k].reshape(-1), key[data], sample[data])
+                _accumulate(n[k].reshape(-1), key[data])
+        return out
+
+    def percentile(self, q, where=None):
+        '''
+        Returns the q-th percentile (linear interpolation, like
+        numpy.percentile) of each cell, NaN for cells without pixels.
+        '''
+        out = np.full(self.size, np.nan)
+        for zone, values in self.blocks():
+            if where is not None:
+                keep = where(values)
+                zone, values = zone[keep], values[keep]
+            if zone.size == 0:
+                continue
+            values = values.astype(np.float64)
+            order = np.lexsort((values, zone))
+            zone, values = zone[order], values[order]
+            cells, start, n = np.unique(zone, return_index=True, return_counts=True)
+            pos = (n - 1) * (q / 100.)
+            lo = np.floor(pos).astype(np.int64)
+            hi = np.minimum(lo + 1, n - 1)
+            frac = pos - lo
+            out[cells] = (values[start + lo]*(1 - frac) + values[start + hi]*frac)
+        return out